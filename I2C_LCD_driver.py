@@ -23,17 +23,39 @@ I2CBUS = 1
 # LCD Address
 ADDRESS = 0x27
 
-import smbus
+# Most bytes one SMBus block write can carry: the command byte plus 32 data bytes
+# The PCF8574 backpack has no registers, so every byte of a block, the command byte included, is latched onto the LCD pins in turn
+BLOCK_SIZE = 33
+
 from time import sleep
 
 class i2c_device:
-   def __init__(self, addr, port=I2CBUS):
+   # bus: any object with the smbus.SMBus interface (i.e. a simulated bus), opens SMBus(port) if omitted
+   def __init__(self, addr, port=I2CBUS, bus=None):
       self.addr = addr
-      self.bus = smbus.SMBus(port)
+      if bus is None:
+         import smbus
+         bus = smbus.SMBus(port)
+      self.bus = bus
+      self.transactions = 0 # bus writes issued, for benchmarking
 
 # Write a single command
    def write_cmd(self, cmd):
       self.bus.write_byte(self.addr, cmd)
+      self.transactions += 1
+      sleep(0.0001)
+
+# Write a sequence of bytes in as few bus transactions as possible
+# Each byte still takes a full byte time on the wire (90us at 100kHz), longer than the LCD needs between nibbles, so no sleeps are needed within a block
+   def write_bytes(self, data):
+      if not hasattr(self.bus, 'write_i2c_block_data'):
+         for byte in data:
+            self.write_cmd(byte)
+         return
+      for start in range(0, len(data), BLOCK_SIZE):
+         block = data[start:start + BLOCK_SIZE]
+         self.bus.write_i2c_block_data(self.addr, block[0], list(block[1:]))
+         self.transactions += 1
       sleep(0.0001)
 
 # Write a command and argument
@@ -107,8 +129,8 @@ Rs = 0b00000001 # Register select bit
 
 class lcd:
    #initializes objects and lcd
-   def __init__(self):
-      self.lcd_device = i2c_device(ADDRESS)
+   def __init__(self, bus=None):
+      self.lcd_device = i2c_device(ADDRESS, bus=bus)
 
       self.lcd_write(0x03)
       self.lcd_write(0x03)
@@ -133,6 +155,21 @@ class lcd:
       self.lcd_device.write_cmd(data | LCD_BACKLIGHT)
       self.lcd_strobe(data)
 
+   # bytes that put one nibble on the pins and clock it in, the same sequence lcd_write_four_bits() sends
+   def nibble_bytes(self, data):
+      return [data | LCD_BACKLIGHT, data | En | LCD_BACKLIGHT, (data & ~En) | LCD_BACKLIGHT]
+
+   # bytes that write a command (mode=0) or character (mode=Rs) to lcd
+   def encode(self, cmd, mode=0):
+      return self.nibble_bytes(mode | (cmd & 0xF0)) + self.nibble_bytes(mode | ((cmd << 4) & 0xF0))
+
+   # write a sequence of (value, mode) pairs to lcd in as few bus transactions as possible
+   def lcd_write_bulk(self, writes):
+      data = []
+      for value, mode in writes:
+         data += self.encode(value, mode)
+      self.lcd_device.write_bytes(data)
+
    # write a command to lcd
    def lcd_write(self, cmd, mode=0):
       self.lcd_write_four_bits(mode | (cmd & 0xF0))
@@ -155,10 +192,7 @@ class lcd:
     elif line == 4:
       pos_new = 0x54 + pos
 
-    self.lcd_write(0x80 + pos_new)
-
-    for char in string:
-      self.lcd_write(ord(char), Rs)
+    self.lcd_write_bulk([(0x80 + pos_new, 0)] + [(ord(char), Rs) for char in string])
 
    # clear lcd and set to home
    def lcd_clear(self):
@@ -0,0 +1,195 @@
+'''
+Index of the alarm sounds under alarms/<urgency>/ with decoded copies kept in memory
+    The folders are listed once and re-listed only when a poll of their modification times shows a change, instead of on every urgency change
+    Sounds are decoded ahead of time (pygame.mixer.Sound) within MEMORY_BUDGET bytes, so starting an alarm only queues samples that are already in memory
+    The decoded size is estimated from the WAV header or the file size before decoding, so a sound that can't fit is never decoded
+    Decoding uses the mixer, so it runs on the Speaker's audio worker (Speaker.preload()) like every other mixer call
+    Sounds that don't fit the budget are streamed from disk with mixer.music as before
+'''
+import os, random, threading, wave
+from log import get_logger
+
+logger = get_logger('alarm_library')
+
+ALARM_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alarms')
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg')
+MEMORY_BUDGET = int(os.environ.get('PITIME_ALARM_MEMORY_BYTES', 64 * 1024 * 1024))
+URGENCY_ORDER = ['Extremely', 'Very', 'Urgent', 'Somewhat', 'Not at all'] # Preload priority, the most urgent alarms are decoded first
+WATCH_INTERVAL = 5 # Seconds between checks of the folder modification times
+COMPRESSED_BITRATE = 128000 # Bits per second assumed for MP3/OGG files, whose length can't be read without decoding them
+
+def bytes_per_second(mixer):
+    frequency, sample_format, channels = mixer.get_init()
+    return frequency * channels * abs(sample_format) // 8
+
+def decoded_size(sound, mixer):
+    '''
+    Estimates the memory held by a decoded Sound (int, bytes) from its length and the mixer's output format
+    '''
+    return int(sound.get_length() * bytes_per_second(mixer))
+
+def estimated_size(path, mixer):
+    '''
+    Estimates the memory a file will take once decoded (int, bytes) without decoding it
+        WAV lengths come from the header; other formats are assumed to be COMPRESSED_BITRATE, so a lower bitrate file can decode larger than estimated
+    '''
+    if path.lower().endswith('.wav'):
+        try:
+            with wave.open(path) as header:
+                return int(header.getnframes() / header.getframerate() * bytes_per_second(mixer))
+        except (wave.Error, EOFError, OSError, ZeroDivisionError): # i.e. float or extensible WAVs, which pygame reads but wave doesn't
+            pass
+    return int(os.path.getsize(path) * 8 / COMPRESSED_BITRATE * bytes_per_second(mixer))
+
+class AlarmLibrary:
+    def __init__(self, directory=ALARM_DIRECTORY, budget=MEMORY_BUDGET):
+        '''
+        Initializes the AlarmLibrary object and indexes directory
+        Args:
+            directory (str), folder holding one subfolder of sound files per urgency
+            budget (int), maximum bytes of decoded audio kept in memory by preload()
+        '''
+        self.directory = directory
+        self.budget = budget
+        self.sounds = {} # urgency -> sorted list of file paths
+        self.decoded = {} # file path -> decoded Sound
+        self.decoded_bytes = 0
+        self.mtimes = {}
+        self.decoder = None # Callable queueing preload() on the thread that owns the mixer, set by Speaker.preload() so a change is decoded again there
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.watching = threading.Event()
+        self.refresh()
+
+    def scan_mtimes(self):
+        '''
+        Returns the modification time of the alarm folder and each urgency folder (dict), which change whenever a file is added, removed or renamed
+        '''
+        mtimes = {}
+        try:
+            mtimes[self.directory] = os.stat(self.directory).st_mtime_ns
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.is_dir():
+                        mtimes[entry.path] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return mtimes
+
+    def refresh(self):
+        '''
+        Rebuilds the index from the alarm folders
+        '''
+        mtimes = self.scan_mtimes()
+        sounds = {}
+        for path in mtimes:
+            if path == self.directory:
+                continue
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(AUDIO_EXTENSIONS))
+            if files:
+                sounds[os.path.basename(path)] = files
+        with self.lock:
+            self.sounds = sounds
+            self.mtimes = mtimes
+        logger.info("Indexed %s alarm sounds for %s urgencies", sum(len(files) for files in sounds.values()), len(sounds))
+
+    def changed(self):
+        return self.scan_mtimes() != self.mtimes
+
+    def check(self):
+        '''
+        Re-indexes, and queues another preload() if one was used, when the folders changed since the last index
+        Returns:
+            True if anything changed
+        '''
+        if not self.changed():
+            return False
+        logger.info("Alarm folder changed, re-indexing")
+        self.refresh()
+        if self.decoder is not None:
+            self.decoder()
+        return True
+
+    def start_watcher(self, interval=WATCH_INTERVAL):
+        '''
+        Starts a daemon thread that calls check() every interval seconds until stop_watcher()
+        '''
+        if self.watcher is None:
+            self.watching.clear()
+            self.watcher = threading.Thread(target=self.watch, args=(interval,), name='pitime-alarm-watcher', daemon=True)
+            self.watcher.start()
+
+    def watch(self, interval):
+        while not self.watching.wait(interval):
+            try:
+                self.check()
+            except Exception as ex:
+                logger.error("Error checking the alarm folder: %s", ex)
+
+    def stop_watcher(self):
+        self.watching.set()
+        if self.watcher is not None:
+            self.watcher.join()
+            self.watcher = None
+
+    def preload(self, mixer):
+        '''
+        Decodes sounds into memory until the budget is spent
+            The smallest sound of each urgency first, most urgent first, so as many urgencies as possible can start instantly; the remaining candidates fill what is left
+            Sounds already decoded are kept, sounds no longer in the index are released
+            Must run on the thread that owns the mixer, see Speaker.preload()
+        Args:
+            mixer (pygame.mixer), initialized mixer used to decode
+        Returns:
+            decoded_bytes (int), estimated memory held by decoded sounds
+        '''
+        with self.lock:
+            sounds = {urgency: list(files) for urgency, files in self.sounds.items()}
+            decoded = {path: sound for path, sound in self.decoded.items() if any(path in files for files in sounds.values())}
+        urgencies = sorted(sounds, key=lambda urgency: URGENCY_ORDER.index(urgency) if urgency in URGENCY_ORDER else len(URGENCY_ORDER))
+        for files in sounds.values():
+            files.sort(key=os.path.getsize) # File size tracks decoded size closely enough to order by
+        first = [sounds[urgency][0] for urgency in urgencies]
+        rest = [path for urgency in urgencies for path in sounds[urgency][1:]]
+        used = sum(decoded_size(sound, mixer) for sound in decoded.values())
+        for path in first + rest:
+            if path in decoded:
+                continue
+            estimate = estimated_size(path, mixer)
+            if used + estimate > self.budget: # Checked first, so memory never peaks a whole decoded file over the budget
+                logger.debug("Skipping %s, about %s bytes would exceed the %s byte budget", path, estimate, self.budget)
+                continue
+            try:
+                sound = mixer.Sound(path)
+            except Exception as ex:
+                logger.warning("Couldn't decode %s, it will be streamed: %s", path, ex)
+                continue
+            size = decoded_size(sound, mixer)
+            if used + size > self.budget: # Decoded larger than estimated, i.e. a low bitrate MP3
+                logger.debug("Releasing %s, %s bytes exceed the %s byte budget", path, size, self.budget)
+                del sound
+                continue
+            decoded[path] = sound
+            used += size
+        with self.lock:
+            self.decoded = decoded
+            self.decoded_bytes = used
+        logger.info("Decoded %s of %s alarm sounds, %.1f MiB of %.1f MiB budget", len(decoded), len(first) + len(rest), used / 1048576, self.budget / 1048576)
+        return used
+
+    def choose(self, urgency):
+        '''
+        Picks a random sound for urgency, preferring ones already decoded
+        Returns:
+            path (str) or None if the urgency has no sounds
+            sound (pygame.mixer.Sound) or None if the sound has to be streamed from path
+        '''
+        with self.lock:
+            files = self.sounds.get(urgency, [])
+            decoded = [path for path in files if path in self.decoded]
+            if decoded:
+                path = random.choice(decoded)
+                return path, self.decoded[path]
+        if files:
+            return random.choice(files), None
+        return None, None
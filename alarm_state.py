@@ -0,0 +1,126 @@
+'''
+Alarm bookkeeping shared by rpi_main's lanes, the snooze button callback thread and the unlock channel listener
+    Replaces the alarm_trigger, options_dict, current_events_dict and current_urgency module globals, which were read and written from several threads without a lock
+    Every change goes through one lock and then calls on_change, which wakes the asyncio alarm lane
+'''
+import threading, time
+from collections import namedtuple
+
+URGENCY_COMPARATOR = { None : 0,
+                    'None' : 0, #  Means of quantifying/comparing urgency
+                    'Not at all' : 1,
+                    'Somewhat' : 2,
+                    'Urgent' : 3,
+                    'Very' : 4,
+                    'Extremely' : 5}
+
+# Consistent copy of the state taken under the lock, so a lane never sees a half applied batch of reminders
+AlarmSnapshot = namedtuple('AlarmSnapshot', ['trigger', 'options', 'events', 'urgency', 'web_unlock_key_set'])
+
+def default_options():
+    '''
+    Returns the options (dict) of an idle alarm
+        buzzer (bool), intermittent beeping if True
+        vibration (bool), intermittent vibration if True
+        web_unlock (bool), if True, the alarm requires the user to visit a custom URL to deactivate
+        alarm (set), a set of all alarm urgencies currently triggered
+        pattern (str), custom buzzer/vibration rhythm of the first triggered reminder that has one
+    '''
+    return {'buzzer': False, 'vibration': False, 'web_unlock': False, 'alarm': {'None'}, 'pattern': None}
+
+class AlarmState:
+    __slots__ = ('trigger', 'options', 'events', 'urgency', 'web_unlock_key_set', 'pressed_at', 'lock', 'on_change')
+
+    def __init__(self, on_change=None):
+        '''
+        Initializes the AlarmState object
+            trigger (bool), True if there is an active alarm, False if not
+            options (dict), aggregate options of the triggered reminders, see default_options()
+            events (dict), event.id -> (event.title, event.description) of every triggered event, read out when the alarm is deactivated
+            urgency (str), the maximum urgency of the triggered alarms
+            web_unlock_key_set (bool), True once a web unlock key was generated for the current alarm
+            pressed_at (float), time.perf_counter() of a snooze press not yet silenced, None otherwise
+        Args:
+            on_change (callable), called after every change, from the thread that made it; must not block
+        '''
+        self.lock = threading.RLock()
+        self.on_change = on_change
+        self.pressed_at = None
+        self.reset()
+
+    def reset(self):
+        '''
+        Returns every field to the idle state, without waking anyone
+        '''
+        with self.lock:
+            self.trigger = False
+            self.options = default_options()
+            self.events = {}
+            self.urgency = 'None'
+            self.web_unlock_key_set = False
+
+    def notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def __repr__(self): # Lets loggers take the state itself as a field, so the snapshot is only copied when a handler emits the record
+        return repr(self.snapshot())
+
+    def snapshot(self):
+        with self.lock:
+            options = dict(self.options, alarm=set(self.options['alarm']))
+            return AlarmSnapshot(self.trigger, options, dict(self.events), self.urgency, self.web_unlock_key_set)
+
+    def add_reminders(self, reminders, urgency_comparator=URGENCY_COMPARATOR):
+        '''
+        Merges a batch of due reminders into the alarm in one step and triggers it
+            Flags are ORed so one True among the reminders is enough, events are keyed by event.id so events with the same title are logged separately, and the urgency only ever rises
+        Args:
+            reminders (list of Row), due reminder rows from rpi_main.fetch_due_reminder_rows()
+            urgency_comparator (dict), associates urgency values with a finite score
+        '''
+        if not reminders:
+            return
+        with self.lock:
+            for reminder in reminders:
+                self.options['buzzer'] = self.options['buzzer'] or reminder.buzzer
+                self.options['vibration'] = self.options['vibration'] or reminder.vibration
+                self.options['web_unlock'] = self.options['web_unlock'] or reminder.web_unlock
+                self.options['alarm'].add(reminder.alarm)
+                self.options['pattern'] = self.options['pattern'] or reminder.pattern
+                self.events[reminder.event_id] = (reminder.event_title, reminder.event_description)
+            for urgency in self.options['alarm']:
+                if urgency_comparator.get(urgency, 0) > urgency_comparator.get(self.urgency, 0):
+                    self.urgency = urgency
+            self.trigger = True
+        self.notify()
+
+    def set_web_unlock_key(self, flag):
+        '''
+        Records whether a web unlock key was generated; clearing it also drops the web unlock option so no new key is generated for this alarm
+        '''
+        with self.lock:
+            self.web_unlock_key_set = flag
+            if not flag:
+                self.options['web_unlock'] = False
+
+    def snooze(self):
+        '''
+        Clears the trigger on a snooze button press and stamps the press time for take_press()
+        Returns:
+            was_triggered (bool)
+        '''
+        with self.lock:
+            was_triggered = self.trigger
+            self.trigger = False
+            self.pressed_at = time.perf_counter()
+        self.notify()
+        return was_triggered
+
+    def take_press(self):
+        '''
+        Returns the time.perf_counter() of the last snooze press (float) and forgets it, or None if there wasn't one
+        '''
+        with self.lock:
+            pressed_at, self.pressed_at = self.pressed_at, None
+            return pressed_at
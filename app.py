@@ -1,27 +1,109 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, abort, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
-import re, os, socket, time 
+import re, os, socket, time, logging
 # from I2C_LCD_driver import lcd
 from models import db, Event, Reminder
+from sqlalchemy import select, exists, and_, or_
+from migrations import run_migrations
+from ipc import Channel, APP_SOCKET, MAIN_SOCKET
+from log import get_logger
+from metrics import Registry, render, instrument_database, CONTENT_TYPE
+from tts_cache import TTSCache, event_phrases
+from backends import get_backend
+from rpi_models import parse_pattern
+from images import image_info, ImagePipeline, StagedUpload, store_image, STORE_DIRECTORY
+from importer import import_events, detect_format, ImportFormatError, FORMATS
+import clock
+
+logger = get_logger('app')
+
+class UploadRequest(Request):
+    '''
+    Writes file uploads straight into the image store as they are received, hashing them on the way, instead of buffering them in memory or a temporary file
+    '''
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = StagedUpload(os.path.join(app.config['UPLOAD_FOLDER'], STORE_DIRECTORY))
+        self.__dict__.setdefault('staged_uploads', []).append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        for upload in self.__dict__.get('staged_uploads', ()): # Including uploads cut off by MAX_CONTENT_LENGTH, which never made it into request.files
+            upload.close()
 
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+app.request_class = UploadRequest
 # lcd_screen = lcd()
 
 image_folder = os.path.join(app.root_path, 'static') # Create a default folder to store images, in this case shared with the static folder
 if not os.path.exists(image_folder):
     os.makedirs(image_folder)
 app.config['UPLOAD_FOLDER'] = image_folder
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('PITIME_MAX_UPLOAD_BYTES', 16 * 1024 * 1024)) # Larger requests are refused with 413 while they are being received
 
 app.config['SECRET_KEY'] = ';lkjfdsa' # nice try hacker man
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///alarm-reminder.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PITIME_DATABASE_URI', 'sqlite:///alarm-reminder.db')
 db.init_app(app) # Initializes context for database reads/writes
 
+unlock_channel = Channel(APP_SOCKET, MAIN_SOCKET) # Pushes unlocks and reminder changes to rpi_main, receives the current unlock key from it
+unlock_state = {'key': None} # Current web unlock key, None until the channel is listening (key_check then reads unlock.txt)
+
+metrics = Registry(process='app')
+request_time = metrics.histogram('pitime_http_request_seconds', "Time to handle a request, per Flask route", ('route', 'method', 'status'))
+import_rows = metrics.counter('pitime_import_rows_total', "Rows read by /import", ('outcome',))
+main_metrics = {'snapshot': None} # Latest metrics snapshot (JSON str) published by rpi_main, parsed only when scraped
+tts_cache = TTSCache() # Shared with rpi_main, which plays the clips rendered here when announcing events
+image_pipeline = ImagePipeline(image_folder, lambda event_id, variants: record_image_variants(event_id, variants)) # Thumbnails are made on a process pool, not in the request
+EVENTS_PER_PAGE = 20 # /events page size unless ?limit= is given
+MAX_EVENTS_PER_PAGE = 100
+
 with app.app_context(): # creates a background environment to keep track of application-level data for the current app instance 
     db.create_all() #idempotent, creates tables if absent but leaves them if they already exist
+    run_migrations(db.engine) # brings tables created by older versions up to the current schema (indexes, new columns)
+    instrument_database(metrics, db.engine, db.session)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    '''
+    Observes the handling time of every request, labelled by route rule rather than URL so /unlock/<key> doesn't create a series per key
+    '''
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_time.observe(time.perf_counter() - start, route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    '''
+    Serves this server's metrics and the latest snapshot from rpi_main in the Prometheus text format
+    '''
+    registries = [metrics]
+    if main_metrics['snapshot']:
+        try:
+            registries.append(Registry.from_snapshot(main_metrics['snapshot']))
+        except (ValueError, KeyError, TypeError) as ex:
+            logger.warning("Discarding malformed metrics snapshot from rpi_main: %s", ex)
+            main_metrics['snapshot'] = None
+    return app.response_class(render(*registries), content_type=CONTENT_TYPE)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(ex):
+    logger.info("Refused a %s request larger than %s bytes", request.endpoint, app.config['MAX_CONTENT_LENGTH'])
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    if request.endpoint != 'submit': # /import is called by scripts, which need the status rather than a flashed message
+        return {'error': f"Request bodies must be smaller than {limit} MB"}, 413
+    flash(f"Images must be smaller than {limit} MB.")
+    return redirect(url_for('index'))
 
 @app.route("/") # When accessing the root website, which shows the alarm submission form
 def index():
-    print("INDEX.APP.PY: '/' Root route triggered. Rendering alarm template.")
+    logger.debug("'/' Root route triggered. Rendering alarm template.")
     return render_template("index.html")
 
 @app.route('/submit', methods=['POST']) # HTTP verb called for sending data to a server when host/submit URL is called
@@ -29,13 +111,11 @@ def submit():
     '''
     Uses functions parse_form_data and add_event_reminders to convert user input into Event and Reminder objects, which are then stored in an SQLite database
     '''
-    print(f"\n\nSUBMIT.APP.PY: Event and reminder form submitted.\n Request form: {request.form}\n\n Request files: {request.files}\n\n")
-    print("Passing form to parse_form_data...")
+    logger.debug("Event and reminder form submitted. Request form: %s Request files: %s", request.form, request.files)
+    logger.debug("Passing form to parse_form_data...")
     event_title, event_description, reminders = parse_form_data(request.form)
-    print("\n\n Returning to submit()\n")
-    print(f"Event title: {event_title}\n Event description: {event_description}\nReminders:")
-    for current_reminders in reminders:
-        print(f"{current_reminders}")
+    logger.debug("Returning to submit()")
+    logger.debug("Event title: %s Event description: %s Reminders: %s", event_title, event_description, reminders)
     
     reminder_dates = [reminder['date'] for reminder in reminders]
     reminder_times = [reminder['time'] for reminder in reminders]
@@ -43,39 +123,81 @@ def submit():
     valid, error_messages = validate_reminders(reminder_dates, reminder_times) # Error handling for user input problems
 
     if not valid:
-        print("Errors found in event form submission data.")
+        logger.info("Errors found in event form submission data.")
         for message in error_messages:
             flash(message)
-            print(f"Error in event submission: {message}")
+            logger.info("Error in event submission: %s", message)
             return redirect(url_for('index'))
-    print("\n")
     try:
-        print("Passing to add_event_and_reminders...")
+        logger.debug("Passing to add_event_and_reminders...")
         event_id = add_event_and_reminders(event_title, event_description, reminders)
-        print("\n\n Returning to submit()...")
-        print(f"\nEvent {event_title} added successfully")
+        logger.debug("Returning to submit()...")
+        logger.info("Event %s added successfully", event_title)
         flash(f"{event_title} added successfully!")
 
         if 'event_image' in request.files:
             file = request.files['event_image']
             if file.filename != '':
-                print(f"Initial file name: {file.filename}")
+                logger.debug("Initial file name: %s", file.filename)
                 allowed_extensions = {'png', 'jpg', 'jpeg', 'gif'}
                 if not('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-                    print(f"File submitted is not an image of ext. {allowed_extensions}")
+                    logger.debug("File submitted is not an image of ext. %s", allowed_extensions)
                     flash("File must be an image of the extension png, jpg, jpeg, or gif.")
                 else:
-                    _, file_extension = os.path.splitext(file.filename)
-                    new_filename = f"{event_id}{file_extension}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                    file.save(file_path)
-                    print(f"File uploaded for event {event_id} at {file_path}")
+                    # Already on disk and hashed by UploadRequest, an image uploaded before is referenced rather than stored again
+                    new_filename, sha256, stored = store_image(file.stream, app.config['UPLOAD_FOLDER'], file.filename.rsplit('.', 1)[1])
+                    event = db.session.get(Event, event_id) # Recorded once here so /events never has to look for the file
+                    info = image_info(os.path.join(app.config['UPLOAD_FOLDER'], new_filename), sha256)
+                    event.image_path, event.image_width, event.image_height, event.image_sha256 = new_filename, info['width'], info['height'], sha256
+                    variants = db.session.execute(select(Event.image_thumb_path, Event.image_web_path)
+                                                  .where(Event.image_sha256 == sha256, Event.image_thumb_path.is_not(None)).limit(1)).first()
+                    if variants: # Resized for an earlier event
+                        event.image_thumb_path, event.image_web_path = variants
+                    db.session.commit()
+                    if not variants:
+                        image_pipeline.submit(event_id, new_filename, sha256)
+                    logger.info("File uploaded", extra={'fields': {'event_id': event_id, 'path': new_filename, 'stored': stored}})
 
         return redirect(url_for('index'))
     except Exception as ex:
         flash(f"An error occurred in submit.app.py: {ex} \n")
         return redirect(url_for('index'))
 
+@app.route('/import', methods=['POST'])
+def import_route():
+    '''
+    Bulk imports events and their reminders from the request body, see importer.py for the layouts
+        i.e. curl --data-binary @calendar.ics -H 'Content-Type: text/calendar' http://pitime.local:5000/import
+        Valid rows are inserted in one transaction, invalid rows are skipped and listed in the report
+    Optional args (passed from URL):
+        format: 'json', 'ndjson' or 'ics', taken from the Content-Type header if omitted
+    Returns:
+        JSON report of rows read, events and reminders inserted, row errors and throughput (see importer.import_events())
+        400 without importing anything if the format is unknown or the file is malformed
+    '''
+    import_format = detect_format(request.args.get('format'), request.content_type)
+    if import_format is None:
+        return {'error': f"Unknown import format, pass ?format= with one of {', '.join(FORMATS)}"}, 400
+    try:
+        report = import_events(db.session, request.stream, import_format, clock.now())
+        db.session.commit()
+    except ImportFormatError as ex:
+        db.session.rollback()
+        logger.info("Rejected %s import: %s", import_format, ex)
+        return {'error': str(ex)}, 400
+    except RequestEntityTooLarge: # Raised by the stream once MAX_CONTENT_LENGTH is read, answered by upload_too_large()
+        db.session.rollback()
+        raise
+    except Exception as ex:
+        db.session.rollback()
+        logger.error("Error in import_route.app.py, %s", ex)
+        return {'error': "Import failed, nothing was imported"}, 500
+    import_rows.inc(report['events'], outcome='imported')
+    import_rows.inc(report['error_count'], outcome='rejected')
+    if report['events']:
+        unlock_channel.send('reminders') # Wakes the scheduler in rpi_main, announcements of imported events are rendered by rpi_main when they trigger
+    return report
+
 def validate_reminders(reminder_dates, reminder_times):
     '''
         Determines if all time and date input is legal
@@ -89,7 +211,7 @@ def validate_reminders(reminder_dates, reminder_times):
             valid (bool), T/F flag if the all the form data is legal
             error_messages (list), list of relevant error messages to be included as a flesh message after POST
     '''
-    print(f"\n\nVALIDATE_REMINDERS.APP.PY: Validating all reminders for legal content from raw data.\n Reminder dates: {reminder_dates}\n Reminder times {reminder_times}")
+    logger.debug("Validating all reminders for legal content from raw data. Reminder dates: %s Reminder times %s", reminder_dates, reminder_times)
     valid = True # Default is a legal position, only specific rules can violate it
     error_messages = []
     try:
@@ -97,21 +219,21 @@ def validate_reminders(reminder_dates, reminder_times):
             if not date or not time: # If these fields are empty
                 valid = False # A violation has been raised
                 error_messages.append(f"Reminder {index + 1} has empty date/time fields.") # Bespoke message describing which reminders posed problems
-                print(f"Empty date/time fields for reminder {index + 1} at {(date, time)}\n")
+                logger.debug("Empty date/time fields for reminder %s at %s", index + 1, (date, time))
                 continue # Since this reminder lacks the relevant data to be tested as a valid datetime object, the remaining steps in this loop are skipped
 
             try: # An attempt will be made to force the current date/time data into a datetime object
                 reminder_datetime = datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M')
-                if reminder_datetime <= datetime.now(): # If a reminder is set in the past
+                if reminder_datetime <= clock.now(): # If a reminder is set in the past
                     valid = False
-                    print(f"Reminder {index + 1} has a datetime set in the past: {(date, time)}")
+                    logger.debug("Reminder %s has a datetime set in the past: %s", index + 1, (date, time))
                     error_messages.append(f"Reminder {index + 1} is set in the past.\n")
             except ValueError: # If the form data is not parsable as a datetime object
                 valid = False
-                print(f"Reminder {index + 1} has an invalid date/time: {(date, time)}")
+                logger.debug("Reminder %s has an invalid date/time: %s", index + 1, (date, time))
                 error_messages.append(f"Reminder {index + 1} has an incorrect date/time format.\n")
     except Exception as ex:
-        print(f"Error at validate_numbers.app.py: {ex}")
+        logger.error("Error at validate_numbers.app.py: %s", ex)
     return valid, error_messages # Fed to the function associated with the /submit route
 
 
@@ -139,17 +261,17 @@ def parse_form_data(form):
                 repeats (str), the frequency with which that reminder repeats
                     i.e., 'Never', 'Hourly', 'Daily', 'Weekly', 'Monthly', 'Yearly'
     '''
-    print(f"\n\nPARSE_FORM_DATA.APP.PY: Attempting to parse form data from form:\n {form}")
+    logger.debug("Attempting to parse form data from form: %s", form)
     try:
         event_title = form.get('main_event_title') # One string
         event_description = form.get('main_event_description') # One string
-        print(f"Event title: {event_title}")
-        print(f"Event description: {event_description}")
+        logger.debug("Event title: %s", event_title)
+        logger.debug("Event description: %s", event_description)
 
         reminder_times = form.getlist('reminder_time[]') # Times for each reminder in order
         reminder_dates = form.getlist('reminder_date[]') # Dates for each reminder in order
-        print(f"Reminder times:\n {reminder_times}\n")
-        print(f"Reminder dates:\n {reminder_dates}\n")
+        logger.debug("Reminder times: %s", reminder_times)
+        logger.debug("Reminder dates: %s", reminder_dates)
         # reminder_repeats = form.getlist('reminder_repeats[]') # Deprecated in favor of new reminders data structure
         # reminder_options = [[] for _ in reminder_times]
         # reminder_alarms = [None for _ in reminder_times]
@@ -160,24 +282,30 @@ def parse_form_data(form):
                 parse_key = re.split(r'\[|\]', key) # Treats header as a regular expression and splits them at square brackets
                 options_keys.append(int(parse_key[1])) # Cracks the ID out of the key
         options_keys = sorted(list(set(options_keys))) # Set eliminates redundant terms, converts it to a list so it can be ordered, then is ordered alphanumerically from low to high ID
-        print(f"Registered reminder IDs: {options_keys}\n")
+        logger.debug("Registered reminder IDs: %s", options_keys)
 
         reminders = [] # A list of dictionaries each representing reminder objects 
         for index, reminder_id in enumerate(options_keys): # Pairing submitted reminder IDs to the order in which the reminders are declared
-            options, alarm, repeats, buzzer = [], None, None, None # Options are a collection of qualities, alarm and repeats are single items that either exist or don't
+            options, alarm, repeats, buzzer, pattern = [], None, None, None, None # Options are a collection of qualities, alarm and repeats are single items that either exist or don't
             for key in form: # For every submitted value in the form
                 if key.startswith(f'reminder_options[{reminder_id}]'): # These keys occur first in the form, and are therefore processed first
                     options.append(form[key]) # Adds option (str) to the options list
-                    print(f"{form[key]} option added to Reminder {index}")
+                    logger.debug("%s option added to Reminder %s", form[key], index)
                 if key.startswith(f'reminder_alarm[{reminder_id}]'): # These keys sometimes are sent out of order and thus need to be sorted by reminder ID
                     alarm = form[key] if 'Alarm' in options else None # Because options have already been parsed, this control structure allows an urgency to be set if and only if the alarm function has been enabled
-                    print(f"Alarm urgency '{form[key]}' added to Reminder {index}")
+                    logger.debug("Alarm urgency '%s' added to Reminder %s", form[key], index)
                 if key.startswith(f'reminder_repeats[{reminder_id}]'): # ibid.
                     repeats = form[key]
-                    print(f"Repeater '{form[key]}' added to Reminder {index}")
+                    logger.debug("Repeater '%s' added to Reminder %s", form[key], index)
                 if key.startswith(f'reminder_buzzer[{reminder_id}]'):
                     buzzer = form[key] if 'Buzzer' in options else None
-                    print(f"Buzzer volume '{form[key]}' added to Reminder {index}")
+                    logger.debug("Buzzer volume '%s' added to Reminder %s", form[key], index)
+                if key.startswith(f'reminder_pattern[{reminder_id}]') and form[key].strip():
+                    if parse_pattern(form[key].strip()): # Invalid patterns are dropped, the default rhythm plays instead
+                        pattern = form[key].replace(' ', '')
+                        logger.debug("Pattern '%s' added to Reminder %s", pattern, index)
+                    else:
+                        logger.info("Ignoring invalid pattern '%s' for Reminder %s", form[key], index)
 
             reminder_data = { # Each reminder objects gets mocked as a dictionary
                 'date': reminder_dates[index], # Corresponds submitted date time data to mocked reminder object using the index of the reminder ID in the sorted reminder ID data
@@ -185,14 +313,15 @@ def parse_form_data(form):
                 'options': options,
                 'alarm': alarm,
                 'repeats': repeats,
-                'buzzer': buzzer
+                'buzzer': buzzer,
+                'pattern': pattern
             }
 
-            print(f"Current reminder being processed:\n {reminder_data}")
+            logger.debug("Current reminder being processed: %s", reminder_data)
             reminders.append(reminder_data) # Adds finished reminder object to running list of reminders
-        print(f"Reminders processed:\n {reminders}\n")
+        logger.debug("Reminders processed: %s", reminders)
     except Exception as ex:
-        print(f"Error in parse_form_data.app.py: {ex}\n")
+        logger.error("Error in parse_form_data.app.py: %s", ex)
     return event_title, event_description, reminders # All of the information necessary to create an event-reminder relationship
 
 def add_event_and_reminders(event_title, event_description, reminders_data):
@@ -206,16 +335,16 @@ def add_event_and_reminders(event_title, event_description, reminders_data):
         Returns:
             current_event.id (int), primary key for the event being created, returned for image naming purposes
     '''
-    print(f"\n\nADD_EVENT_AND_REMINDERS.APP.PY: Attempting to add event and reminders for\n Event: {event_title}\n Desc: {event_description}\n Reminders: {reminders_data}")
+    logger.debug("Attempting to add event and reminders for Event: %s Desc: %s Reminders: %s", event_title, event_description, reminders_data)
 
     current_event = Event(title=event_title, description=event_description) # Defines a new Event object
     db.session.add(current_event) # Commits Event to db within the context of the current session
     db.session.flush() # Assigns a primary key ID to current_event so it can be associated w/ reminder objects
     try:
         for reminder_data in reminders_data: # for every mock Reminder dictionary in the reminder_data
-            print(f"Current reminder data: {reminder_data}\n")
+            logger.debug("Current reminder data: %s", reminder_data)
             timepoint = datetime.strptime(f"{reminder_data['date']} {reminder_data['time']}", '%Y-%m-%d %H:%M') # Parses text data into usable datetime objects
-            print(f"Current timepoint: {timepoint}")
+            logger.debug("Current timepoint: %s", timepoint)
             new_reminder = Reminder( # Definition of reminder_lock defaults to False but the remaining attributes are defined here
                 date_time=timepoint,
                 vibration='Vibration' in reminder_data['options'], # Creates a boolean flag depending on whether or not a certain target option is included for the reminder object
@@ -223,16 +352,19 @@ def add_event_and_reminders(event_title, event_description, reminders_data):
                 buzzer=reminder_data['buzzer'],                 
                 alarm=reminder_data['alarm'],
                 repeater=reminder_data['repeats'],
+                pattern=reminder_data.get('pattern'),
                 event=current_event
             )
-            print(f"\nNew reminder: {new_reminder}\n")
+            logger.debug("New reminder: %s", new_reminder)
             db.session.add(new_reminder)
         db.session.commit()
-        print("Reminders added successfully.")
+        unlock_channel.send('reminders') # Wakes the scheduler in rpi_main so the new reminders are picked up immediately
+        tts_cache.prerender(event_phrases(current_event.id, event_title, event_description), get_backend().tts_engine) # Synthesized in the background, long before the alarm is dismissed
+        logger.debug("Reminders added successfully.")
     except Exception as ex:
         db.session.rollback()
-        print(f"An unexpected error occurred in add_event_and_reminder.app.py, {ex}\n")
-    print(f"Returning ID for current event: {current_event.id}\n")
+        logger.error("An unexpected error occurred in add_event_and_reminder.app.py, %s", ex)
+    logger.debug("Returning ID for current event: %s", current_event.id)
     return current_event.id
 
 @app.route('/unlock/<path:key>')
@@ -244,23 +376,23 @@ def key_check(key):
     Returns: 
         Switches alarm.txt content to '' from '1' and wipes unlock.txt
     '''
-    print(f"\n\nKEY_CHECK.APP.PY: Web unlock route attempt with key {key}")
+    logger.debug("Web unlock route attempt with key %s", key)
     try:
         script_directory = os.path.dirname(os.path.abspath(__file__)) # fetches current working directory
         unlock = os.path.join(script_directory, '.unlock', 'unlock.txt') # builds a relative path
-        unlock_key = read_unlock_val(unlock) # Reads in web_unlock key
+        unlock_key = unlock_state['key'] if unlock_state['key'] is not None else read_unlock_val(unlock) # Uses the key pushed by rpi_main, reading the file only when the channel isn't running
         key = key.rstrip()
-        print(f"Actual unlock key: {unlock_key}, Length: {len(unlock_key)}")
-        print(f"Received key: {repr(key)}, Length: {len(key)}")  # Debug representation of the received key
+        logger.debug("Actual unlock key: %s, Length: %s", unlock_key, len(unlock_key))
+        logger.debug("Received key: %s, Length: %s", repr(key), len(key))  # Debug representation of the received key
         if key == unlock_key: # If the value entered in the URL matches the key stored in .unlock
-            print("Web unlock engaged\n")
+            logger.info("Web unlock engaged")
             return clear_web_unlock()  # Call the function to unlock the web_unlock functionality
         else:
-            print("Web unlock failed\n")
+            logger.info("Web unlock failed")
             abort(404)  # Not found if the key is not valid
     except Exception as ex:
         return_string = f"Error in key_check.app.py: {ex}\n"
-        print(return_string)
+        logger.error("%s", return_string)
         return return_string
 
 def clear_web_unlock():
@@ -269,175 +401,216 @@ def clear_web_unlock():
         Sets alarm to ''
         Resets unlock key
     '''
-    print("\n\nCLEAR_WEB_UNLOCK.APP.PY: Attempting to clear web lock")
+    logger.debug("Attempting to clear web lock")
     try:
         script_directory = os.path.dirname(os.path.abspath(__file__)) # fetches current working directory
         unlock = os.path.join(script_directory, '.unlock', 'unlock.txt') # builds a relative path
         alarm = os.path.join(script_directory, '.unlock', 'alarm.txt')
         open(unlock, 'w').close() # Wipes each alarm flag
         open(alarm, 'w').close()
-        print("Web unlock completed successfully\n")
+        if unlock_state['key'] is not None:
+            unlock_state['key'] = ''
+        unlock_channel.send('unlock') # Silences the alarm in rpi_main immediately instead of on its next loop
+        logger.debug("Web unlock completed successfully")
         return "Web unlock completed successfully"
     except Exception as ex:
-        print(f"Error in clear_web_unlock.app.py, {ex}\n")
+        logger.error("Error in clear_web_unlock.app.py, %s", ex)
         return f"Error with web unlock: {ex}"
 
+def handle_channel_message(command, argument):
+    '''
+    Handles messages from rpi_main on the unlock channel's listener thread
+        'key <unlock key>': a web unlock alarm was armed with a new key
+        'clear': the web unlock was cleared
+        'metrics <json>': rpi_main's latest metrics snapshot, served at /metrics
+    '''
+    logger.debug("Received %s", command)
+    if command == 'key':
+        unlock_state['key'] = argument
+    elif command == 'clear':
+        unlock_state['key'] = ''
+    elif command == 'metrics':
+        main_metrics['snapshot'] = argument
+
+def start_unlock_channel():
+    '''
+    Starts listening for messages from rpi_main, then seeds the unlock key from unlock.txt in case an alarm was armed before this server started
+    '''
+    if unlock_channel.start(handle_channel_message) and unlock_state['key'] is None:
+        unlock_state['key'] = read_unlock_val('unlock.txt')
+
+def record_image_variants(event_id, variants):
+    '''
+    Stores the resized images of an event once the image pipeline has written them (runs on a pool thread, outside any request)
+    Args:
+        event_id (int), event the image belongs to
+        variants (dict), variant name -> path relative to static/, from images.render_variants()
+    '''
+    with app.app_context():
+        event = db.session.get(Event, event_id)
+        if event is None: # Deleted while its variants were being made
+            return
+        event.image_thumb_path, event.image_web_path = variants.get('thumb'), variants.get('web')
+        db.session.commit()
+
+def queue_missing_image_variants():
+    '''
+    Queues the images uploaded before variants existed, or while Pillow was missing or the server was down
+    Returns:
+        queued (int), number of events queued
+    '''
+    with app.app_context():
+        pending = db.session.execute(select(Event.id, Event.image_path, Event.image_sha256)
+                                     .where(Event.image_path.is_not(None), Event.image_sha256.is_not(None), Event.image_thumb_path.is_(None))).all()
+    queued = sum(image_pipeline.submit(*row) is not None for row in pending)
+    logger.info("Queued %s event images for resizing", queued)
+    return queued
+
 def read_unlock_val(file):
     '''
     Function: reads relevant unlock keys from file
     Parameters: file, str, filename of stored value
     Returns: string contents of file
     '''
-    print(f"\n\nREAD_UNLOCK_VAL.APP.PY: Attempting to read web unlock key from file for file {file}")
+    logger.debug("Attempting to read web unlock key from file for file %s", file)
     try:
         script_directory = os.path.dirname(os.path.abspath(__file__)) # fetches current working directory
         unlock_file_path = os.path.join(script_directory, '.unlock', file) # builds a relative path
-        print(f"Key file directory: {unlock_file_path}")
-        print("Attempting to read key file")
+        logger.debug("Key file directory: %s", unlock_file_path)
+        logger.debug("Attempting to read key file")
         with open(unlock_file_path, 'r') as file: # reads key from file
             key_content = file.read().rstrip()
-            print(f"Unlock key: {key_content}\n")
+            logger.debug("Unlock key: %s", key_content)
             debug_key_content = repr(key_content)  # Debug representation of the key
-            print(f"Unlock key (raw): {debug_key_content}, Length: {len(key_content)}")
+            logger.debug("Unlock key (raw): %s, Length: %s", debug_key_content, len(key_content))
             return key_content # returns key minus leading white space
     except Exception as ex:
-        print(f"An error occurred in read_unlock_val.app.py: {ex}\n")
+        logger.error("An error occurred in read_unlock_val.app.py: %s", ex)
         return ''
 @app.route('/events')
 def events():
     '''
         Function: events(), route for displaying all active alarms
             Alarms are active when Events.event_lock is False
-            Queries all active events and parses them with relevant_events_filter
-            Pulls all images connected to an active event and adds them to the appropriate event in the query dictionary
+            Queries one page of active events and their reminders with relevant_events_filter, two queries whose cost depends only on the page size
+            Image paths and dimensions come from the Event row, so rendering a page makes no filesystem calls
         Optional args (passed from URL):
-            'desc' --> sorts events by date in descending order
-            '*' --> sorts events by ascending order
+            sort: 'desc' --> sorts events by their latest reminder in descending order, '*' --> by their earliest reminder in ascending order
+            after: the next_after cursor of the previous page, omitted for the first page
+            limit: events per page, EVENTS_PER_PAGE by default, at most MAX_EVENTS_PER_PAGE
         Returns:
             Renders template based on current parameters
     '''
-    print("\n\nEVENTS.APP.PY: /events route triggered by web access, attempting to display events\n")
+    logger.debug("/events route triggered by web access, attempting to display events")
     sort_order = request.args.get('sort', 'desc')  # Looks for a value in the arguments passed in the /events call, default sort order is descending
-    print(f"Events sorting order: {sort_order}")
-    events = Event.query.filter_by(event_lock = False).all() # Pull all events from the database that haven't been deactivated
-    print("Printing query info for active events")
-    for event in events:
-        print(f"\nEvent ID: {event.id}")
-        print(f"Title: {event.title}")
-        print(f"Description: {event.description}")
-        
-        # Print details of each reminder associated with the event
-        for reminder in event.reminders:
-            print(f"  Reminder ID: {reminder.id}")
-            print(f"  Date and Time: {reminder.date_time}")
-            print(f"  Buzzer: {reminder.buzzer}")
-            print(f"  Vibration: {reminder.vibration}")
-            print(f"  Alarm: {reminder.alarm}")
-            print(f"  Repeater: {reminder.repeater}")
-        # Separate each event for clarity
-        print("-" * 30)
-
-    events_with_images = []
+    logger.debug("Events sorting order: %s", sort_order)
+    limit = request.args.get('limit', EVENTS_PER_PAGE, type=int)
+    limit = max(1, min(limit, MAX_EVENTS_PER_PAGE))
+    try:
+        after = parse_event_cursor(request.args.get('after'))
+    except ValueError:
+        abort(400) # Cursors are only ever produced by this route
     events_with_reminders = []
+    next_after = None
     try:
-        events_with_reminders = relevant_events_filter(events) 
-        print(f"Events with reminders: {events_with_reminders}")
-        for event in events_with_reminders:
-            print(event)
-        events_with_images = add_image_filepath_to_event_dictionary(events_with_reminders)
-        print(f"Events with file data: {events_with_images}")
-        for event in events_with_images:
-            print(event)
-        # print(events_with_images)
+        events_with_reminders, next_after = relevant_events_filter(sort_order, after, limit)
+        if logger.isEnabledFor(logging.DEBUG): # The field dicts are only built when they will be emitted
+            for event in events_with_reminders: # Reminders are already loaded, so this costs no queries
+                logger.debug("Active event", extra={'fields': {'id': event['id'], 'title': event['title'], 'description': event['description']}})
+                for reminder in event['reminders']:
+                    logger.debug("Active reminder", extra={'fields': {'event_id': event['id'], 'id': reminder.id, 'date_time': reminder.date_time, 'buzzer': reminder.buzzer,
+                                                                      'vibration': reminder.vibration, 'alarm': reminder.alarm, 'repeater': reminder.repeater}})
     except TypeError as ex:
-        print(f"No events have been created yet (events.app.py): {ex}")
+        logger.debug("No events have been created yet (events.app.py): %s", ex)
     except Exception as ex:
-        print(f"Error in events.app.py, {ex}")
-    if sort_order == 'desc':
-        print("Sorting events in descending order")
-        events_with_images.sort(key=latest_reminder_date, reverse=True) # applies latest_reminder_date to each event entry as a point of comparison between each event so the event with the most recent reminder comes first, then reverses it to be in descending order
-    else:
-        print("Sorting events in ascending order")
-        events_with_images.sort(key=earliest_reminder_date) # sorts so the events with the earliest reminder in ascending order
-    print("Rendering template with pulled events")
-    return render_template('events.html', events=events_with_images, sort_order=sort_order)
-
-def latest_reminder_date(event):
-    '''
-        Function: returns the latest reminder date for an event element in a list of parsed event object dictionaries
-        Args:
-            event (dict), dictionary of the attributes of queried Event objects
-    '''
-    print(f"\n\nLATEST_REMINDER_DATE.APP.PY: Fetching latest reminder from Event {event}, ")
-    print(f"{max(reminder.date_time for reminder in event['reminders'])}\n")
-    return max(reminder.date_time for reminder in event['reminders'])
-
-def earliest_reminder_date(event):
-    '''
-        Function: returns the earliest reminder date for an event element in a list of parsed event object dictionaries
-        Args:
-            event (dict), dictionary of the attributes of queried Event objects
-    '''    
-    print(f"\n\nEARLIEST_REMINDER_DATE.APP.PY: Fetching earilest reminder from Event {event}")
-    print(f"{min(reminder.date_time for reminder in event['reminders'])}")
-    return min(reminder.date_time for reminder in event['reminders'])
+        logger.error("Error in events.app.py, %s", ex)
+    logger.debug("Rendering template with pulled events")
+    return render_template('events.html', events=events_with_reminders, sort_order=sort_order, limit=limit, next_after=next_after)
 
-def add_image_filepath_to_event_dictionary(events_with_reminders):
+def parse_event_cursor(after):
     '''
-        Function: The Event object lacks an attribute that associates the object with an image filepath
-        Args:
-            events_with_reminders (list): contains a series of dictionaries containing the event data for all relevant objects to be displayed
+        Function: Parses an /events page cursor, "<sort key isoformat>_<event id>", or "_<event id>" once the page reached the events without reminders
         Returns:
-            events_with_reminders (list): A modified list containing file paths when relevant, default image is None
+            (sort key (datetime or None), event id (int)), or None for the first page
+        Raises:
+            ValueError if the cursor is malformed
     '''
-    print(f"\n\nADD_IMAGE_FILEPATH_TO_EVENT_DICTIONARY.APP.PY: Attaching available image filepaths to event dictionaries")
-    print("Current events: ")
-    for event_print in events_with_reminders:
-        print(f"{event_print}")
-    try:
-        for event in events_with_reminders:
-            print(f"\nProcessing {event}")
-            event['image_path'] = None # Initialize default image_path 
-            for ext in ['png', 'jpg', 'jpeg', 'gif']:
-                possible_path = os.path.join('static', f"{event['id']}.{ext}") # Tests if the image associated with an alarm ID is valid
-                full_path = os.path.join(app.root_path, possible_path) # Joins that path with the absolute path of the current working directory
-                if os.path.isfile(full_path): # If this path is valid
-                    event['image_path'] = f"{event['id']}.{ext}" # Store the image path in the parsed event object dictionary
-                    print(f"Path found for Event {event} at {full_path}")
-                    break # No need to look any further
-    except Exception as ex:
-        print(f"Error in add_image_filepath_to_event_dictionary.app.py, {ex}\n")
-    print(f"Revised event dictionary with file paths: {events_with_reminders}\n")
-    return events_with_reminders # Return list of parsed event dictionary objects with the added image filepath (if present)
+    if not after:
+        return None
+    key, separator, event_id = after.rpartition('_')
+    if not separator:
+        raise ValueError(f"Malformed cursor {after!r}")
+    return (datetime.fromisoformat(key) if key else None), int(event_id)
 
-def relevant_events_filter(events_query):
+def format_event_cursor(key, event_id):
+    return f"{key.isoformat() if key else ''}_{event_id}"
+
+def relevant_events_filter(sort_order='desc', after=None, limit=EVENTS_PER_PAGE):
     '''
-        Function: Takes an Event Query object and parses the data into a list of dictionaries for interpretation at the scripting level
+        Function: Queries one page of active events and their reminders and parses the data into a list of dictionaries for interpretation at the scripting level
+            Events are ordered by Event.last_reminder descending ('desc') or Event.first_reminder ascending, then by id, and read from the matching partial index
+            Keyset pagination: the page starts right after the (sort key, id) of the previous page's last event, so no rows before it are read or skipped
+            Events without reminders have no sort key and follow all the others, ordered by id
+            all_locked is computed in SQL only for the events on the page, and the page's reminders are loaded with one more query
         Args:
-            events_query (Query), a query containing Event instances
+            sort_order (str), 'desc' or any other value for ascending
+            after (tuple), (sort key, event id) from parse_event_cursor(), None for the first page
+            limit (int), events per page
         Returns:
             events_with_reminders (list), a list of dictionaries containing all the data to be handled by the HTML form
+            next_after (str), cursor of the next page, None on the last page
     '''
-    print("\n\nRELEVANT_EVENTS_FILTER.APP.PY: Converting pulled events to a dictionary")
+    logger.debug("Converting pulled events to a dictionary")
+    descending = sort_order == 'desc'
+    key = Event.last_reminder if descending else Event.first_reminder
+    unlocked = or_(Reminder.reminder_lock == False, Reminder.reminder_lock.is_(None))
+    all_locked = ~exists().where(Reminder.event_id == Event.id, unlocked) # True if every reminder is spent (or there are none), like all()
+    columns = select(Event.id, Event.title, Event.description, Event.image_path, Event.image_width, Event.image_height, Event.image_thumb_path, Event.image_web_path,
+                     key.label('sort_key'), all_locked.label('all_locked')).where(Event.event_lock == False)
+    def ordered(query, *order):
+        return query.order_by(*(column.desc() if descending else column.asc() for column in order))
+    def beyond(column, value): # Comes after value in the page order
+        return column < value if descending else column > value
+
+    rows = []
+    if after is None or after[0] is not None: # Events with reminders, by sort key
+        query = columns.where(key.is_not(None))
+        if after is not None:
+            query = query.where(or_(beyond(key, after[0]), and_(key == after[0], beyond(Event.id, after[1]))))
+        rows = db.session.execute(ordered(query, key, Event.id).limit(limit + 1)).all()
+    if len(rows) <= limit: # Room left on the page for events without reminders
+        query = columns.where(key.is_(None))
+        if after is not None and after[0] is None:
+            query = query.where(beyond(Event.id, after[1]))
+        rows += db.session.execute(ordered(query, Event.id).limit(limit + 1 - len(rows))).all()
+    next_after = format_event_cursor(rows[limit - 1].sort_key, rows[limit - 1].id) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    reminders_by_event = {}
+    if rows:
+        reminders = db.session.scalars(
+            select(Reminder).where(Reminder.event_id.in_([row.id for row in rows])).order_by(Reminder.event_id, Reminder.date_time) # Served by ix_reminder_event_id_date_time
+        )
+        for reminder in reminders:
+            reminders_by_event.setdefault(reminder.event_id, []).append(reminder)
     events_with_reminders = []
-    for event in events_query:
-        print(f"\nProcessing event: {event}")
-        try:
-            reminders = Reminder.query.filter_by(event_id=event.id).all()
-            all_locked = all(reminder.reminder_lock for reminder in reminders) # If all the reminders are spent, tested using a tuple comprehension and the all function
-            event_data = {
-                'id': event.id,
-                'title': event.title,
-                'description': event.description,
-                'reminders': reminders, # These objects can now be readily queries 
-                'all_locked': all_locked # This is used to determine whether or not an entry will be grayed out
-            }
-            print(f"Parsed event: {event_data}")
-            events_with_reminders.append(event_data)
-        except ValueError as e:
-            print(f"No reminders associated with this event, {e}")
-    print(f"Full dictionary of pulled events: {events_with_reminders}\n\n")
-    return events_with_reminders
+    for event in rows:
+        event_data = {
+            'id': event.id,
+            'title': event.title,
+            'description': event.description,
+            'reminders': reminders_by_event.get(event.id, []), # These objects can now be readily queries
+            'all_locked': bool(event.all_locked), # This is used to determine whether or not an entry will be grayed out
+            'image_path': event.image_path, # File name under static/, None without an image
+            'image_width': event.image_width,
+            'image_height': event.image_height,
+            'image_thumb_path': event.image_thumb_path, # Resized copies, None until the image pipeline has made them
+            'image_web_path': event.image_web_path
+        }
+        logger.debug("Parsed event: %s", event_data)
+        events_with_reminders.append(event_data)
+    logger.debug("Full dictionary of pulled events: %s", events_with_reminders)
+    return events_with_reminders, next_after
 
 @app.route('/delete-event/<int:event_id>', methods = ['POST'])
 def delete_event(event_id):
@@ -449,21 +622,22 @@ def delete_event(event_id):
             Redirects to events page with deleted events removed
     '''
     event_to_delete = db.session.query(Event).filter(Event.id == event_id).one_or_none()
-    print(f"\n\nDELETE_EVENT.APP.PY: Route triggered to delete event for {event_to_delete}")
+    logger.debug("Route triggered to delete event for %s", event_to_delete)
     reminders_to_delete = event_to_delete.reminders.all()
     if event_to_delete:
-        print(f"Setting {event_to_delete} event_lock flag to True")
+        logger.debug("Setting %s event_lock flag to True", event_to_delete)
         event_to_delete.event_lock = True
         for reminder in reminders_to_delete:
-            print(f"Disabling reminder {reminder}")
+            logger.debug("Disabling reminder %s", reminder)
             reminder.reminder_lock = True
             try:
-                print("Attempting to commit change to database\n")
+                logger.debug("Attempting to commit change to database")
                 db.session.commit()
                 flash(f"{event_to_delete} deleted successfully")
             except Exception as ex:
                 db.session.rollback()
                 flash(f"Error occurred when deleting {event_to_delete}: {ex}")
+        unlock_channel.send('reminders') # Lets the scheduler in rpi_main drop the disabled reminders
     else:
         flash(f"Event {event_id} does not exist\n")
     return redirect(url_for('events'))
@@ -473,14 +647,14 @@ def get_ip_address():
         Returns local IP address of the RPi at startup
     '''
     try:
-        print("GET_IP_ADDRESS.APP.PY: Attempting to fetch current IP address")
+        logger.debug("Attempting to fetch current IP address")
         # This creates a socket to retrieve the IP address
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # Connects to an external address (does not actually establish a connection)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
-        print(f"Device IP: {ip}")
+        logger.debug("Device IP: %s", ip)
         return ip
     except Exception as ex:
         return f"IP Error: {ex}"
@@ -494,5 +668,8 @@ if __name__ == "__main__":
     #lcd_screen.lcd_display_string(ip_address, 2)
     #time.sleep(15)
     #lcd_screen.lcd_clear()
+    image_pipeline.start() # Starts the workers up front rather than on the first upload
+    queue_missing_image_variants()
+    start_unlock_channel()
     app.run(host = '0.0.0.0', debug=False)
 
@@ -0,0 +1,275 @@
+'''
+Hardware backends for rpi_models, the I2C LCD driver and rpi_main
+    'hardware' (default) drives the real devices through gpiozero, smbus, pygame and pyttsx3, each imported only when a device is created
+    'simulated' replaces every device with an in-memory stand-in that records each transaction with a timestamp, so the full rpi_main loop can run and be profiled on a plain Linux machine
+    The backend is chosen with the PITIME_BACKEND environment variable or set_backend()
+'''
+import os, threading, time
+from log import get_logger
+
+logger = get_logger('backends')
+
+class TransactionLog:
+    def __init__(self):
+        '''
+        Initializes the TransactionLog object
+            Thread safe record of (timestamp, device, action, value) tuples shared by every simulated device of a backend
+            Timestamps come from time.perf_counter() so intervals between transactions can be measured
+        '''
+        self.entries = []
+        self.lock = threading.Lock()
+
+    def record(self, device, action, value=None):
+        with self.lock:
+            self.entries.append((time.perf_counter(), device, action, value))
+
+    def filter(self, device=None, action=None):
+        '''
+        Returns the entries (list) matching the given device and/or action
+        '''
+        with self.lock:
+            return [entry for entry in self.entries
+                    if (device is None or entry[1] == device) and (action is None or entry[2] == action)]
+
+    def count(self, device=None, action=None):
+        return len(self.filter(device, action))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class SimulatedOutputDevice: # Stands in for gpiozero LED/Buzzer
+    def __init__(self, pin, log):
+        self.name = f"gpio{pin}"
+        self.pin = pin
+        self.log = log
+        self.is_active = False
+
+    @property
+    def value(self):
+        return int(self.is_active)
+
+    def on(self):
+        self.is_active = True
+        self.log.record(self.name, 'on')
+
+    def off(self):
+        self.is_active = False
+        self.log.record(self.name, 'off')
+
+    def close(self):
+        self.log.record(self.name, 'close')
+
+class SimulatedButton: # Stands in for gpiozero Button
+    def __init__(self, pin, log):
+        self.name = f"gpio{pin}"
+        self.pin = pin
+        self.log = log
+        self.when_pressed = None
+
+    def press(self):
+        '''
+        Simulates a button press, calling when_pressed on a new thread like gpiozero does
+        '''
+        self.log.record(self.name, 'press')
+        if self.when_pressed:
+            threading.Thread(target=self.when_pressed, daemon=True).start()
+
+class SimulatedSMBus: # Stands in for smbus.SMBus
+    def __init__(self, port, log):
+        self.name = f"i2c{port}"
+        self.log = log
+
+    def write_byte(self, addr, value):
+        self.log.record(self.name, 'write_byte', (addr, value))
+
+    def write_byte_data(self, addr, cmd, value):
+        self.log.record(self.name, 'write_byte_data', (addr, cmd, value))
+
+    def write_block_data(self, addr, cmd, data):
+        self.log.record(self.name, 'write_block_data', (addr, cmd, list(data)))
+
+    def write_i2c_block_data(self, addr, cmd, data):
+        self.log.record(self.name, 'write_i2c_block_data', (addr, cmd, list(data)))
+
+    def read_byte(self, addr):
+        self.log.record(self.name, 'read_byte', addr)
+        return 0
+
+    def read_byte_data(self, addr, cmd):
+        self.log.record(self.name, 'read_byte_data', (addr, cmd))
+        return 0
+
+    def read_block_data(self, addr, cmd):
+        self.log.record(self.name, 'read_block_data', (addr, cmd))
+        return []
+
+class SimulatedMusic: # Stands in for pygame.mixer.music
+    def __init__(self, log):
+        self.log = log
+        self.loaded = None
+        self.busy = False
+        self.volume = 1.0
+
+    def load(self, path):
+        self.loaded = path
+        self.log.record('mixer', 'load', path)
+
+    def play(self, loops=0):
+        self.busy = True
+        self.log.record('mixer', 'play', (self.loaded, loops))
+
+    def stop(self):
+        self.busy = False
+        self.log.record('mixer', 'stop')
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.log.record('mixer', 'set_volume', volume)
+
+    def get_volume(self):
+        return self.volume
+
+    def get_busy(self):
+        return self.busy
+
+class SimulatedSound: # Stands in for pygame.mixer.Sound
+    def __init__(self, path, log):
+        with open(path, 'rb') as source: # Fails like pygame does for a missing file
+            self.size = len(source.read())
+        self.path = path
+        self.log = log
+        self.log.record('mixer', 'sound_decode', path)
+
+    def play(self, loops=0):
+        self.log.record('mixer', 'sound_play', (self.path, loops))
+        return self
+
+    def stop(self):
+        self.log.record('mixer', 'sound_stop', self.path)
+
+    def set_volume(self, volume):
+        self.log.record('mixer', 'sound_set_volume', (self.path, volume))
+
+    def get_length(self):
+        return self.size * 8 / 128000 # As if the file were a 128 kbps MP3
+
+class SimulatedMixer: # Stands in for pygame.mixer
+    def __init__(self, log):
+        self.log = log
+        self.music = SimulatedMusic(log)
+        self.log.record('mixer', 'init')
+
+    def Sound(self, path):
+        return SimulatedSound(path, self.log)
+
+    def get_init(self):
+        return (44100, -16, 2) # (frequency, signed 16 bit samples, stereo), pygame's defaults
+
+class SimulatedTTSEngine: # Stands in for a pyttsx3 engine
+    def __init__(self, log, words_per_minute=0):
+        '''
+        Args:
+            words_per_minute (int), if set, runAndWait() sleeps as long as speaking the queued text would take
+        '''
+        self.log = log
+        self.words_per_minute = words_per_minute
+        self.queue = []
+        self.properties = {'voice': 'simulated', 'rate': 200, 'volume': 1.0}
+
+    def say(self, text):
+        self.queue.append(('say', text, None))
+
+    def save_to_file(self, text, path):
+        self.queue.append(('save', text, path))
+
+    def runAndWait(self):
+        queued, self.queue = self.queue, []
+        for action, text, path in queued:
+            if action == 'save':
+                with open(path, 'wb') as output:
+                    output.write(text.encode('utf-8'))
+            elif self.words_per_minute:
+                time.sleep(len(text.split()) * 60 / self.words_per_minute)
+            self.log.record('tts', action, text)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+class HardwareBackend:
+    '''
+    Creates the real devices, importing each driver only when its first device is created
+    '''
+    name = 'hardware'
+
+    def output(self, pin, kind='led'):
+        from gpiozero import LED, Buzzer
+        return Buzzer(pin) if kind == 'buzzer' else LED(pin)
+
+    def button(self, pin):
+        from gpiozero import Button
+        return Button(pin)
+
+    def i2c_bus(self, port):
+        import smbus
+        return smbus.SMBus(port)
+
+    def mixer(self):
+        import pygame
+        pygame.mixer.init()
+        return pygame.mixer
+
+    def tts_engine(self):
+        import pyttsx3
+        return pyttsx3.init(driverName="espeak")
+
+class SimulatedBackend:
+    '''
+    Creates simulated devices that share one TransactionLog (self.log)
+    '''
+    name = 'simulated'
+
+    def __init__(self):
+        self.log = TransactionLog()
+
+    def output(self, pin, kind='led'):
+        return SimulatedOutputDevice(pin, self.log)
+
+    def button(self, pin):
+        return SimulatedButton(pin, self.log)
+
+    def i2c_bus(self, port):
+        return SimulatedSMBus(port, self.log)
+
+    def mixer(self):
+        return SimulatedMixer(self.log)
+
+    def tts_engine(self):
+        return SimulatedTTSEngine(self.log)
+
+BACKENDS = {'hardware': HardwareBackend, 'simulated': SimulatedBackend}
+_backend = None
+
+def get_backend():
+    '''
+    Returns the process-wide backend, created on first use from PITIME_BACKEND ('hardware' or 'simulated')
+    '''
+    global _backend
+    if _backend is None:
+        name = os.environ.get('PITIME_BACKEND', 'hardware')
+        if name not in BACKENDS:
+            raise ValueError(f"PITIME_BACKEND must be one of {sorted(BACKENDS)}, not {name!r}")
+        _backend = BACKENDS[name]()
+        logger.info("Using %s backend", name)
+    return _backend
+
+def set_backend(backend):
+    '''
+    Replaces the process-wide backend, i.e. with a fresh SimulatedBackend in tests; returns the backend
+    '''
+    global _backend
+    _backend = backend
+    return backend
@@ -0,0 +1,120 @@
+'''
+Start up helpers for rpi_main
+    Replaces the fixed 25 second boot delay with probes that poll each dependency (database, I2C bus, audio device) until it answers, so boot waits only as long as the slowest device actually needs
+    BootTimer records how long each start up phase took and reports the time to the first clock display
+'''
+import time
+from contextlib import contextmanager
+from sqlalchemy import text
+import clock
+from log import get_logger
+
+logger = get_logger('boot')
+
+PROCESS_START = time.perf_counter() # rpi_main imports this module first, so this approximates the start of the process
+BOOT_TIMEOUT = 60 # Seconds to keep probing a device before giving up on it
+PROBE_INTERVAL = 0.05 # First retry delay, doubled after every failure up to MAX_PROBE_INTERVAL
+MAX_PROBE_INTERVAL = 2
+
+class BootTimer:
+    def __init__(self, start=None, registry=None):
+        '''
+        Initializes the BootTimer object
+            Phases are timed with phase(), one-off milestones (i.e. the first clock display) with mark(); both are measured from start
+        Args:
+            start (float), time.perf_counter() value boot is measured from, defaults to when this module was imported
+            registry (metrics.Registry), if given, each phase is also observed in pitime_boot_phase_seconds
+        '''
+        self.start = PROCESS_START if start is None else start
+        self.phases = [] # (name, seconds) in completion order
+        self.marks = {} # name -> seconds since start
+        self.histogram = registry.histogram('pitime_boot_phase_seconds', "Duration of each start up phase", ('phase',),
+                                            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)) if registry else None
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+        if self.histogram:
+            self.histogram.observe(seconds, phase=name)
+        logger.info("Boot phase %s took %.3fs", name, seconds)
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Records the duration of the with block as phase name
+        '''
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark(self, name):
+        '''
+        Records a milestone once, returns its time since start (float)
+        '''
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.start
+            if self.histogram:
+                self.histogram.observe(self.marks[name], phase=name)
+        return self.marks[name]
+
+    def report(self):
+        '''
+        Logs and returns the phase durations and milestones as a multi-line table (str)
+        '''
+        lines = [f"{name:<24}{seconds:>9.3f}s" for name, seconds in self.phases]
+        lines += [f"{name:<24}{seconds:>9.3f}s since start" for name, seconds in self.marks.items()]
+        table = "\n".join(lines)
+        logger.info("Start up timing:\n%s", table)
+        return table
+
+def wait_until_ready(name, probe, timeout=BOOT_TIMEOUT):
+    '''
+    Function: Calls probe until it returns a truthy value without raising, backing off exponentially between attempts
+    Args:
+        name (str), device name for logging
+        probe (callable), returns a truthy value (i.e. the opened device) once the device is ready
+        timeout (float), seconds before giving up
+    Returns:
+        The probe's first truthy result, or None if the device never became ready
+    '''
+    deadline = clock.monotonic() + timeout
+    interval, attempts = PROBE_INTERVAL, 0
+    while True:
+        attempts += 1
+        try:
+            result = probe()
+            if result:
+                logger.info("%s ready after %s attempt(s)", name, attempts)
+                return result
+            error = f"probe returned {result!r}"
+        except Exception as ex:
+            error = ex
+        if clock.monotonic() + interval > deadline:
+            logger.error("%s not ready after %s attempt(s) in %ss: %s", name, attempts, timeout, error)
+            return None
+        logger.debug("%s not ready (%s), retrying in %.2fs", name, error, interval)
+        clock.sleep(interval)
+        interval = min(interval * 2, MAX_PROBE_INTERVAL)
+
+def probe_database(engine):
+    '''
+    Returns True once the database accepts a connection and answers a trivial query
+    '''
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    return True
+
+def probe_i2c(backend, port, address):
+    '''
+    Opens the I2C bus and reads a byte from the device at address, returns the open bus
+        Opening fails until the kernel has created /dev/i2c-<port>, reading fails until the device acknowledges its address
+    '''
+    bus = backend.i2c_bus(port)
+    try:
+        bus.read_byte(address)
+    except Exception:
+        if hasattr(bus, 'close'):
+            bus.close()
+        raise
+    return bus
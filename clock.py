@@ -0,0 +1,91 @@
+'''
+Injectable clock for the reminder engine
+    rpi_main, the scheduler and app.validate_reminders() read the time through now()/today()/sleep()/wait() instead of calling datetime and time directly
+    SystemClock (default) is the wall clock, VirtualClock jumps forward instantly whenever something sleeps, so weeks of scheduler behaviour replay in seconds (see replay.py)
+'''
+import time
+from datetime import datetime, date, timedelta
+
+class SystemClock:
+    '''
+    The real clock, sleeping and waiting actually block
+    '''
+    def now(self):
+        return datetime.now()
+
+    def today(self):
+        return date.today()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, condition, timeout):
+        '''
+        Waits on a held threading.Condition for up to timeout seconds, returns False on timeout
+        '''
+        return condition.wait(timeout)
+
+class VirtualClock:
+    def __init__(self, start=None):
+        '''
+        Initializes the VirtualClock object
+            Time only moves when advance() is called or something sleeps or waits, which returns immediately after moving time forward by the full duration
+            Intended for single-threaded replays: nothing can notify a waiter early, so wait() always times out
+        Args:
+            start (datetime), initial virtual time, defaults to the current wall-clock time
+        '''
+        self.current = start or datetime.now()
+        self.origin = self.current
+        self.slept = 0.0 # Total virtual seconds spent sleeping or waiting
+
+    def now(self):
+        return self.current
+
+    def today(self):
+        return self.current.date()
+
+    def monotonic(self):
+        return (self.current - self.origin).total_seconds()
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.current += timedelta(seconds=seconds)
+            self.slept += seconds
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def wait(self, condition, timeout):
+        self.advance(timeout)
+        return False
+
+_clock = SystemClock()
+
+def get_clock():
+    return _clock
+
+def set_clock(new_clock):
+    '''
+    Replaces the process-wide clock, returns the previous one so it can be restored
+    '''
+    global _clock
+    previous, _clock = _clock, new_clock
+    return previous
+
+def now():
+    return _clock.now()
+
+def today():
+    return _clock.today()
+
+def monotonic():
+    return _clock.monotonic()
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+def wait(condition, timeout):
+    return _clock.wait(condition, timeout)
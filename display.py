@@ -0,0 +1,205 @@
+'''
+Shadow framebuffer for the I2C LCD
+    Keeps a copy of what is on the glass and writes only the cells that differ from the new frame, instead of clearing the display and rewriting every character
+    Cursor moves are skipped when the changed cells are contiguous, since the LCD advances its address after every character
+    The writes of a frame are sent together through the driver's block write path
+    Counts the I2C transactions a full clear and byte by byte redraw would have cost against the ones actually written
+DisplayWorker owns the LCD on a thread of its own, so producers (the clock, the alarm and announcements) only hand it frames and never wait on the bus
+'''
+import threading, time
+from log import get_logger
+
+logger = get_logger('display')
+
+ROWS = 2
+COLUMNS = 16
+SET_ADDRESS = 0x80 # I2C_LCD_driver.LCD_SETDDRAMADDR, the driver isn't imported so this module loads without smbus
+CHARACTER = 0x01 # I2C_LCD_driver.Rs, register select for character data
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54) # DDRAM address of the first cell of each row
+CLOCK, STATUS, UNLOCK = 0, 1, 2 # DisplayWorker priorities: the web unlock key covers the event count, which covers the clock
+MIN_FRAME_INTERVAL = 0.1 # Seconds between frames written by DisplayWorker, frames submitted in between replace each other
+TRANSACTIONS_PER_WRITE = 6 # lcd.lcd_write() sends two nibbles, each as a data write plus an enable strobe (2 writes), one byte per transaction
+TRANSACTIONS_PER_CLEAR = 2 * TRANSACTIONS_PER_WRITE # lcd.lcd_clear() writes clear display and return home
+
+def full_redraw_cost(lines):
+    '''
+    Returns the I2C transactions (int) of the clear and byte by byte rewrite every frame used to cost: a clear, then a cursor move and every character of each line, then the backlight
+    '''
+    return TRANSACTIONS_PER_CLEAR + sum(TRANSACTIONS_PER_WRITE * (1 + len(line)) for line in lines) + 1
+
+class FramebufferLCD:
+    def __init__(self, screen, rows=ROWS, columns=COLUMNS):
+        '''
+        Initializes the FramebufferLCD object
+            screen must have just been initialized (the driver clears the display), so the shadow starts out blank
+        Args:
+            screen (I2C_LCD_driver.lcd), display the frames are written to
+            rows (int), columns (int), size of the display
+        '''
+        self.screen = screen
+        self.rows = rows
+        self.columns = columns
+        self.shadow = [[' '] * columns for _ in range(rows)] # What is on the glass, None where unknown
+        self.cursor = None # (row, column) the next character lands on, None if unknown
+        self.backlight = None
+        self.transactions_written = 0
+        self.transactions_saved = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        '''
+        Forgets what is on the glass so the next frame is drawn in full, i.e. after a failed write left it in an unknown state
+        '''
+        with self.lock:
+            self.shadow = [[None] * self.columns for _ in range(self.rows)]
+            self.cursor = None
+            self.backlight = None
+
+    def fit(self, line):
+        return list(str(line)[:self.columns].ljust(self.columns))
+
+    def show(self, lines, backlight=1):
+        '''
+        Writes the cells of lines that differ from the shadow framebuffer, then the backlight if it changed
+            Blocks for the duration of the I2C writes
+        Args:
+            lines (sequence of str), one string per row, padded with spaces or truncated to the display width
+            backlight (int), 1 = on, 0 = off
+        Returns:
+            written (int), I2C transactions sent for this frame
+        '''
+        with self.lock:
+            writes, shadow, cursor = [], [list(row) for row in self.shadow], self.cursor
+            for row, line in enumerate(lines[:self.rows]):
+                for column, char in enumerate(self.fit(line)):
+                    if shadow[row][column] == char:
+                        continue
+                    if cursor != (row, column):
+                        writes.append((SET_ADDRESS | (ROW_OFFSETS[row] + column), 0))
+                    writes.append((ord(char), CHARACTER))
+                    shadow[row][column] = char
+                    cursor = (row, column + 1)
+            device = self.screen.lcd_device
+            started = device.transactions
+            if writes:
+                try:
+                    self.screen.lcd_write_bulk(writes)
+                except Exception: # Part of the frame may have reached the glass
+                    self.shadow = [[None] * self.columns for _ in range(self.rows)]
+                    self.cursor = None
+                    raise
+                self.shadow, self.cursor = shadow, cursor
+            if backlight != self.backlight or (writes and not backlight): # Every write turns the backlight back on
+                self.screen.backlight(backlight)
+                self.backlight = backlight
+            written = device.transactions - started
+            self.transactions_written += written
+            self.transactions_saved += max(full_redraw_cost(lines[:self.rows]) - written, 0)
+            logger.debug("Frame written in %s I2C transactions, %s saved so far", written, self.transactions_saved)
+            return written
+
+class DisplayWorker:
+    def __init__(self, write, min_interval=MIN_FRAME_INTERVAL):
+        '''
+        Initializes the DisplayWorker object
+            Each priority holds at most one frame; the frame of the highest priority that has one is what the LCD shows
+            A new frame replaces the pending one of its priority, so a producer that outruns the bus only ever costs the latest frame
+        Args:
+            write (callable), writes a (line 1, line 2, backlight) frame to the LCD, only ever called from the worker thread
+            min_interval (float), minimum seconds between two writes
+        '''
+        self.write = write
+        self.min_interval = min_interval
+        self.layers = {} # priority -> frame
+        self.shown = None # Frame last written
+        self.pending = False # True when layers changed since the last write
+        self.writing = False
+        self.frames_written = 0
+        self.frames_dropped = 0 # Frames replaced or cleared before they were ever written
+        self.written_at = float('-inf')
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, name='pitime-display', daemon=True)
+            self.thread.start()
+
+    def close(self, timeout=1):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def top(self):
+        return self.layers[max(self.layers)] if self.layers else None
+
+    def show(self, frame, priority=CLOCK):
+        '''
+        Sets the frame of priority without waiting for the LCD, safe to call from any thread
+        '''
+        with self.condition:
+            replaced = self.layers.get(priority)
+            if replaced is not None and replaced != self.shown:
+                self.frames_dropped += 1
+            self.layers[priority] = frame
+            self.pending = True
+            self.condition.notify_all()
+
+    def clear(self, priority):
+        '''
+        Removes the frame of priority, revealing the one beneath it
+        '''
+        with self.condition:
+            replaced = self.layers.pop(priority, None)
+            if replaced is not None:
+                if replaced != self.shown:
+                    self.frames_dropped += 1
+                self.pending = True
+                self.condition.notify_all()
+
+    def sync(self, timeout=5):
+        '''
+        Blocks until every change has been written, returns False on timeout
+        '''
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not (self.pending or self.closed):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                delay = self.written_at + self.min_interval - time.monotonic()
+                if delay > 0: # Rate limited, anything submitted meanwhile replaces this frame
+                    self.condition.wait(delay)
+                    continue
+                frame = self.top()
+                self.pending = False
+                self.writing = frame is not None and frame != self.shown
+            if self.writing:
+                try:
+                    self.write(frame)
+                    self.frames_written += 1
+                except Exception as ex:
+                    logger.error("Error writing frame %s: %s", frame, ex)
+                    frame = None # Written again if it is still on top at the next change
+                with self.condition:
+                    self.shown = frame
+                    self.written_at = time.monotonic()
+                    self.writing = False
+                    self.condition.notify_all()
+            else:
+                with self.condition:
+                    self.condition.notify_all()
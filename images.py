@@ -0,0 +1,275 @@
+'''
+Metadata and resized variants of the event images saved under static/
+    Uploads are written to disk as they are received and hashed on the way (StagedUpload), then stored once per content under static/images/ however many events use them
+    Dimensions are read from the PNG, GIF or JPEG header and the SHA-256 is computed in chunks, both once when the image is saved, so /events can render images from Event columns without touching the SD card
+    ImagePipeline decodes uploads on a process pool and writes a thumbnail and a web sized JPEG of each, so /events never serves a full size phone photo
+    Pillow is optional: without it no variants are made and /events keeps serving the originals
+'''
+import hashlib, importlib.util, multiprocessing, os, struct, tempfile, threading
+from concurrent.futures import ProcessPoolExecutor
+from log import get_logger
+
+logger = get_logger('images')
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif')
+CHUNK_SIZE = 64 * 1024
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC} # Start of frame markers, which carry the dimensions; C4, C8 and CC are other segments
+VARIANTS = (('thumb', 320, 75), ('web', 1280, 82)) # (name, longest side in pixels, JPEG quality); the thumbnail covers the 300px box on /events
+STORE_DIRECTORY = 'images' # Under static/, images and their variants are named after the hash of the image so identical uploads are stored once
+IMAGE_WORKERS = int(os.environ.get('PITIME_IMAGE_WORKERS', 1)) # Decoding a 12MP photo takes about 100MB, one worker keeps that bounded on a Pi
+
+def image_format(stream):
+    '''
+    Returns the format (str) of an image from its first bytes, 'png', 'gif' or 'jpg', or None if it isn't recognized
+        The stream is read from its current position and left past the header
+    '''
+    header = stream.read(8)
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header.startswith(b'\xff\xd8'):
+        return 'jpg'
+    return None
+
+def image_size(stream):
+    '''
+    Reads the dimensions from an image header without decoding the image
+    Args:
+        stream (file), opened in binary mode at the start of the image
+    Returns:
+        (width, height) (int, int), or (None, None) if the format isn't recognized
+    '''
+    header = stream.read(26)
+    if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', header[6:10])
+    if header.startswith(b'\xff\xd8'):
+        stream.seek(2)
+        while True:
+            marker = stream.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                break
+            if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7: # Markers without a length
+                continue
+            length = stream.read(2)
+            if len(length) < 2:
+                break
+            if marker[1] in JPEG_SOF_MARKERS:
+                frame = stream.read(5)
+                if len(frame) < 5:
+                    break
+                height, width = struct.unpack('>xHH', frame)
+                return width, height
+            stream.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+    return None, None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def image_info(path, sha256=None):
+    '''
+    Returns the metadata stored with an event image (dict): width and height (int or None), sha256 (str)
+        The file is only hashed if sha256 isn't given
+    '''
+    with open(path, 'rb') as file:
+        width, height = image_size(file)
+    if width is None:
+        logger.warning("Couldn't read the dimensions of %s", path)
+    return {'width': width, 'height': height, 'sha256': sha256 or file_sha256(path)}
+
+class StagedUpload:
+    def __init__(self, directory):
+        '''
+        Initializes the StagedUpload object, a temporary file in the image store that hashes everything written to it
+            Used as Werkzeug's file stream for uploads (see app.UploadRequest), so an upload is hashed while it is received and never held in memory
+            Closing it deletes the file unless store_image() has moved it into place
+        Args:
+            directory (str), folder the temporary file is created in, on the same filesystem as the store so storing it is a rename
+        '''
+        os.makedirs(directory, exist_ok=True)
+        handle, self.path = tempfile.mkstemp(suffix='.part', dir=directory)
+        self.file = os.fdopen(handle, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name): # read(), seek(), tell() and the rest go to the file
+        return getattr(self.file, name)
+
+    def close(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError: # Stored
+            pass
+
+def stored_image_path(sha256, extension):
+    '''
+    Returns the path (str) of an uploaded image relative to static/, i.e. images/ab/ab12....png
+        extension should be the detected image_format(), so the same bytes are stored once whatever the upload was named
+    '''
+    extension = extension.lower().lstrip('.')
+    return '/'.join((STORE_DIRECTORY, sha256[:2], f"{sha256}.{'jpg' if extension == 'jpeg' else extension}"))
+
+def store_image(upload, directory, extension):
+    '''
+    Moves a received upload into the content addressed store, or drops it if the same image is already stored
+    Args:
+        upload (StagedUpload), the fully received upload
+        directory (str), static folder holding the store
+        extension (str), file extension of the upload, i.e. 'png', only used if the format isn't recognized from its header
+    Returns:
+        path (str), where the image is stored relative to directory
+        sha256 (str), hex digest of the image
+        stored (bool), False if an identical image was already stored
+    '''
+    upload.file.flush()
+    sha256 = upload.digest.hexdigest()
+    upload.file.seek(0)
+    path = stored_image_path(sha256, image_format(upload.file) or extension)
+    destination = os.path.join(directory, *path.split('/'))
+    stored = not os.path.isfile(destination)
+    if stored:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(upload.path, destination)
+    upload.close()
+    return path, sha256, stored
+
+def find_event_image(directory, event_id):
+    '''
+    Returns the file name (str) of the image saved for event_id before image paths were stored on events, or None
+        Probes every extension, so only for the one-off backfill in migrations.py
+    '''
+    for ext in IMAGE_EXTENSIONS:
+        for name in (f"{event_id}.{ext}", f"{event_id}.{ext.upper()}"):
+            if os.path.isfile(os.path.join(directory, name)):
+                return name
+    return None
+
+def variant_path(sha256, name):
+    '''
+    Returns the path (str) of a variant relative to static/, i.e. images/ab/ab12...-thumb.jpg
+    '''
+    return '/'.join((STORE_DIRECTORY, sha256[:2], f"{sha256}-{name}.jpg"))
+
+def render_variants(source, directory, sha256):
+    '''
+    Writes every variant in VARIANTS of the image at source that doesn't exist yet
+        Runs in an ImagePipeline worker process; Pillow is imported here so the web and scheduler processes never load it
+    Args:
+        source (str), path of the uploaded image
+        directory (str), static folder the variants are written under
+        sha256 (str), hex digest of source, names the variants
+    Returns:
+        variants (dict), variant name -> path relative to directory
+    '''
+    from PIL import Image, ImageOps
+    variants = {}
+    image = None
+    try:
+        for name, size, quality in VARIANTS:
+            variants[name] = variant_path(sha256, name)
+            path = os.path.join(directory, *variants[name].split('/'))
+            if os.path.isfile(path):
+                continue
+            if image is None:
+                image = Image.open(source)
+                image.draft('RGB', (VARIANTS[-1][1], VARIANTS[-1][1])) # Lets JPEG decode at a reduced scale, the bulk of the savings on large photos
+                image = ImageOps.exif_transpose(image) # Phones store rotation as an EXIF tag, which browsers only honour on the original
+                if image.mode != 'RGB':
+                    background = Image.new('RGB', image.size, 'white') # JPEG has no alpha, flatten transparent PNGs and GIFs onto white
+                    rgba = image.convert('RGBA')
+                    background.paste(rgba, mask=rgba.getchannel('A'))
+                    image = background
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.part" # Renamed into place once complete so /events never links half a file
+            variant.save(partial, 'JPEG', quality=quality, optimize=True, progressive=True)
+            os.replace(partial, path)
+    finally:
+        if image is not None:
+            image.close()
+    return variants
+
+def pillow_installed():
+    return importlib.util.find_spec('PIL') is not None
+
+class ImagePipeline:
+    def __init__(self, directory, on_done, workers=IMAGE_WORKERS, render=render_variants):
+        '''
+        Initializes the ImagePipeline object
+            Workers are started by a forkserver (spawn where that is unavailable) rather than forked from the caller, so the pool can be started lazily from a request thread under flask run or gunicorn
+        Args:
+            directory (str), static folder holding the uploads and variants
+            on_done (callable), called as on_done(event_id, variants) on a pool thread once an event's variants are written
+            workers (int), size of the process pool
+            render (callable), picklable function run in the workers, render_variants unless testing
+        '''
+        self.directory = directory
+        self.on_done = on_done
+        self.workers = workers
+        self.render = render
+        self.executor = None
+        self.disabled = False # Set once Pillow was found missing, so the warning is logged once
+        self.lock = threading.Lock()
+
+    def available(self):
+        return pillow_installed()
+
+    def start(self):
+        '''
+        Creates the process pool and starts its workers, returns False if Pillow isn't installed
+        '''
+        if self.disabled or not self.available():
+            if not self.disabled:
+                logger.warning("Pillow isn't installed, event images are served at full size")
+            self.disabled = True
+            return False
+        with self.lock:
+            if self.executor is None:
+                # Forking a multithreaded server can copy a lock held by another thread into the child, where it is never released
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+                self.executor.submit(int).result() # Starts every worker now rather than at the first upload
+        return True
+
+    def submit(self, event_id, image_path, sha256):
+        '''
+        Queues the variants of an event's image and returns immediately
+        Args:
+            event_id (int), event the image belongs to, passed to on_done
+            image_path (str), file name of the upload relative to directory
+            sha256 (str), hex digest of the upload
+        Returns:
+            future (concurrent.futures.Future), or None if Pillow isn't installed
+        '''
+        if self.executor is None and not self.start():
+            return None
+        future = self.executor.submit(self.render, os.path.join(self.directory, image_path), self.directory, sha256)
+        future.add_done_callback(lambda done: self.finish(event_id, done))
+        return future
+
+    def finish(self, event_id, future):
+        try:
+            variants = future.result()
+            self.on_done(event_id, variants)
+            logger.debug("Variants of event %s written: %s", event_id, variants)
+        except Exception as ex:
+            logger.error("Error making image variants for event %s: %s", event_id, ex)
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
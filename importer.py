@@ -0,0 +1,360 @@
+'''
+Bulk import of events and reminders from JSON, NDJSON or iCalendar files, used by app.py's /import route
+    Files are read and validated one row at a time, so memory use depends on BATCH_SIZE rather than the file size
+    Valid rows are inserted in batches (one executemany for each batch's reminders), all in a single transaction; invalid rows are skipped and reported by row number
+
+JSON and NDJSON rows (a top level array, or one object per line) use the Event and Reminder column names:
+    {"title": "Dentist", "description": "Bring forms", "reminders": [
+        {"date_time": "2030-01-02T08:00", "repeater": "Never", "buzzer": "Loud", "vibration": true, "web_unlock": false, "alarm": "Urgent", "pattern": "200,200"}]}
+    Only title and date_time are required
+iCalendar VEVENTs become one event with a reminder at DTSTART and one per VALARM trigger
+    SUMMARY is the title, DESCRIPTION the description, RRULE's FREQ the repeater; times are converted to the Pi's local time
+    An RRULE with other parts (INTERVAL, COUNT, UNTIL, BYDAY...) cannot be expressed as a repeater, so the VEVENT is reported as an invalid row
+'''
+import io, json, re, time
+from datetime import datetime, time as time_of_day, timedelta, timezone
+from sqlalchemy import insert
+from models import Event, Reminder
+from alarm_state import URGENCY_COMPARATOR
+from recurrence import next_occurrence
+from rpi_models import parse_pattern, PATTERNS
+from log import get_logger
+
+try: # zoneinfo needs Python 3.9 and the system tz database, TZID times are taken as local time without it
+    from zoneinfo import ZoneInfo
+except ImportError:
+    ZoneInfo = None
+
+logger = get_logger('importer')
+
+FORMATS = ('json', 'ndjson', 'ics')
+FORMAT_CONTENT_TYPES = {'application/json': 'json', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson', 'text/calendar': 'ics'}
+REPEATERS = ('Never', 'Hourly', 'Daily', 'Weekly', 'Monthly', 'Yearly')
+ICS_FREQUENCIES = {'HOURLY': 'Hourly', 'DAILY': 'Daily', 'WEEKLY': 'Weekly', 'MONTHLY': 'Monthly', 'YEARLY': 'Yearly'}
+ICS_WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+BUZZER_VOLUMES = tuple(PATTERNS) # The named buzzer settings, each plays its pattern
+URGENCIES = tuple(urgency for urgency in URGENCY_COMPARATOR if urgency not in (None, 'None'))
+MAX_TITLE = 120 # Lengths of Event.title and Event.description
+MAX_DESCRIPTION = 500
+ALL_DAY_TIME = time_of_day(9, 0) # Reminder time of all day iCalendar events, which have a date but no time
+BATCH_SIZE = 500 # Events validated before each batch is inserted
+MAX_REPORTED_ERRORS = 100 # Row errors listed in the report, the rest are only counted
+READ_SIZE = 64 * 1024
+ICS_DURATION = re.compile(r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+class ImportFormatError(ValueError):
+    '''
+    Raised when a file can't be read any further (i.e. a truncated JSON array), the whole import is rolled back
+    '''
+
+def detect_format(requested=None, content_type=None):
+    '''
+    Returns the import format (str) from an explicit ?format= or the request's content type, or None if neither names one
+    '''
+    if requested:
+        return requested.lower() if requested.lower() in FORMATS else None
+    return FORMAT_CONTENT_TYPES.get((content_type or '').split(';')[0].strip().lower())
+
+def text_stream(stream):
+    '''
+    Decodes a binary stream lazily as UTF-8, dropping a byte order mark
+    '''
+    return io.TextIOWrapper(stream if isinstance(stream, io.BufferedIOBase) else io.BufferedReader(stream, READ_SIZE), encoding='utf-8-sig')
+
+def iter_json_array(text):
+    '''
+    Yields (row, value) for every element of a top level JSON array, decoding one element at a time
+    Raises:
+        ImportFormatError if the file isn't a JSON array or ends before the array does
+    '''
+    decoder = json.JSONDecoder()
+    buffer, position, finished = '', 0, False
+    def fill(): # Reads more of the file, returns False at the end
+        nonlocal buffer, position, finished
+        chunk = text.read(READ_SIZE)
+        buffer, position = buffer[position:] + chunk, 0
+        finished = not chunk
+        return bool(chunk)
+    def next_character(): # Skips whitespace, returns the next character without consuming it or '' at the end
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                return buffer[position:position + 1]
+    if next_character() != '[':
+        raise ImportFormatError("JSON imports must be an array of events")
+    position += 1
+    row = 0
+    if next_character() == ']':
+        return
+    while True:
+        next_character() # raw_decode() doesn't skip leading whitespace
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as ex:
+                if fill():
+                    continue
+                raise ImportFormatError(f"Malformed JSON after row {row}: {ex.msg}")
+            if end == len(buffer) and not finished and fill(): # A number or literal may continue in the next chunk
+                continue
+            break
+        position = end
+        row += 1
+        yield row, value
+        separator = next_character()
+        position += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ImportFormatError(f"Malformed JSON after row {row}: expected ',' or ']'")
+
+def iter_ndjson(text):
+    '''
+    Yields (row, value) for every line holding a JSON value, row being the line number; a line that doesn't parse is yielded as its ValueError
+    '''
+    for row, line in enumerate(text, 1):
+        if line.strip():
+            try:
+                yield row, json.loads(line)
+            except ValueError as ex:
+                yield row, ValueError(f"Malformed JSON: {ex}")
+
+def unescape_ics(value):
+    return re.sub(r'\\([\\;,nN])', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+def parse_ics_datetime(value, parameters):
+    '''
+    Returns a naive local datetime from an iCalendar DATE or DATE-TIME value
+    Args:
+        value (str), i.e. '20300102T080000Z', '20300102T080000' or '20300102'
+        parameters (dict), property parameters, VALUE and TZID are used
+    '''
+    if parameters.get('VALUE') == 'DATE' or len(value) == 8:
+        return datetime.combine(datetime.strptime(value, '%Y%m%d').date(), ALL_DAY_TIME)
+    moment = datetime.strptime(value.rstrip('Z'), '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        return moment.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    if 'TZID' in parameters and ZoneInfo is not None:
+        try:
+            return moment.replace(tzinfo=ZoneInfo(parameters['TZID'].strip('"'))).astimezone().replace(tzinfo=None)
+        except (KeyError, ValueError): # Unknown zone, i.e. a Windows zone name from Outlook
+            logger.debug("Unknown TZID %s, using local time", parameters['TZID'])
+    return moment # Floating time
+
+def parse_ics_duration(value):
+    match = ICS_DURATION.match(value)
+    if not match or not any(match.groups()[1:]):
+        raise ValueError(f"unsupported duration {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+def ics_event(properties, alarms):
+    '''
+    Converts the properties of a VEVENT to an import row (dict) in the JSON layout
+    Args:
+        properties (dict), name -> (parameters, value) of the VEVENT's properties
+        alarms (list of dict), properties of its VALARMs
+    '''
+    if 'DTSTART' not in properties:
+        raise ValueError("VEVENT has no DTSTART")
+    parameters, value = properties['DTSTART']
+    start = parse_ics_datetime(value, parameters)
+    repeater = 'Never'
+    if 'RRULE' in properties:
+        rule = dict(part.split('=', 1) for part in properties['RRULE'][1].split(';') if '=' in part)
+        if rule.get('FREQ') not in ICS_FREQUENCIES:
+            raise ValueError(f"unsupported RRULE frequency {rule.get('FREQ')}")
+        if rule.get('INTERVAL') == '1':
+            del rule['INTERVAL']
+        if rule['FREQ'] == 'WEEKLY' and rule.get('BYDAY') == ICS_WEEKDAYS[start.weekday()]: # What most calendars export for a plain weekly event
+            del rule['BYDAY']
+        unsupported = sorted(set(rule) - {'FREQ', 'WKST'})
+        if unsupported: # A reminder repeats at a fixed frequency only, so INTERVAL, COUNT, UNTIL, BYDAY etc. cannot be kept
+            raise ValueError(f"unsupported RRULE parts {', '.join(unsupported)}")
+        repeater = ICS_FREQUENCIES[rule['FREQ']]
+    reminders = [{'date_time': start, 'repeater': repeater}]
+    for alarm in alarms:
+        if 'TRIGGER' in alarm:
+            parameters, value = alarm['TRIGGER']
+            when = parse_ics_datetime(value, parameters) if parameters.get('VALUE') == 'DATE-TIME' else start + parse_ics_duration(value)
+            reminders.append({'date_time': when, 'repeater': repeater})
+    return {'title': unescape_ics(properties.get('SUMMARY', ({}, ''))[1]),
+            'description': unescape_ics(properties.get('DESCRIPTION', ({}, ''))[1]),
+            'reminders': reminders}
+
+def iter_ics(text):
+    '''
+    Yields (row, value) for every VEVENT, row being the line of its BEGIN:VEVENT; an event that can't be converted is yielded as its ValueError
+        Lines are unfolded as they are read, only the current event is kept in memory
+    Raises:
+        ImportFormatError if the file isn't an iCalendar file or ends inside an event
+    '''
+    def unfolded():
+        current, start = None, 0
+        for number, line in enumerate(text, 1):
+            line = line.rstrip('\r\n')
+            if line[:1] in (' ', '\t') and current is not None: # Folded continuation of the previous line
+                current += line[1:]
+                continue
+            if current is not None:
+                yield start, current
+            current, start = line, number
+        if current is not None:
+            yield start, current
+    row, properties, alarms, alarm, seen_calendar = None, None, None, None, False
+    for number, line in unfolded():
+        if not line.strip():
+            continue
+        name, _, value = line.partition(':')
+        name, *parameter_list = name.split(';')
+        name = name.upper()
+        parameters = dict(parameter.split('=', 1) for parameter in parameter_list if '=' in parameter)
+        if name == 'BEGIN' and value.upper() == 'VCALENDAR':
+            seen_calendar = True
+        elif not seen_calendar:
+            raise ImportFormatError("iCalendar imports must start with BEGIN:VCALENDAR")
+        elif name == 'BEGIN' and value.upper() == 'VEVENT':
+            row, properties, alarms = number, {}, []
+        elif name == 'BEGIN' and value.upper() == 'VALARM' and properties is not None:
+            alarm = {}
+        elif name == 'END' and value.upper() == 'VALARM' and alarm is not None:
+            alarms.append(alarm)
+            alarm = None
+        elif name == 'END' and value.upper() == 'VEVENT' and properties is not None:
+            try:
+                yield row, ics_event(properties, alarms)
+            except ValueError as ex:
+                yield row, ValueError(str(ex))
+            properties = None
+        elif alarm is not None:
+            alarm.setdefault(name, (parameters, value))
+        elif properties is not None:
+            properties.setdefault(name, (parameters, value))
+    if properties is not None:
+        raise ImportFormatError(f"iCalendar file ends inside the VEVENT starting on line {row}")
+
+def read_rows(stream, import_format):
+    '''
+    Yields (row, value) from a binary stream in the given format, see iter_json_array(), iter_ndjson() and iter_ics()
+    '''
+    text = text_stream(stream)
+    if import_format == 'json':
+        return iter_json_array(text)
+    if import_format == 'ndjson':
+        return iter_ndjson(text)
+    return iter_ics(text)
+
+def parse_date_time(value):
+    if isinstance(value, datetime):
+        return value
+    if not isinstance(value, str):
+        raise ValueError("date_time must be an ISO 8601 string")
+    try:
+        moment = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        raise ValueError(f"date_time {value!r} is not an ISO 8601 date and time")
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment # Reminders are stored in the Pi's local time
+
+def validate_event(data, now):
+    '''
+    Checks an import row against the rules of the submission form and converts it to table rows
+        Reminders in the past are rejected like in validate_reminders(), unless they repeat, in which case they start at their next occurrence
+    Args:
+        data (dict), import row in the JSON layout
+        now (datetime), current time
+    Returns:
+        event (dict), Event columns
+        reminders (list of dict), Reminder columns, without event_id
+    Raises:
+        ValueError describing the first problem found
+    '''
+    if not isinstance(data, dict):
+        raise ValueError("row must be an object")
+    title, description = data.get('title'), data.get('description') or ''
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("title is required")
+    if len(title) > MAX_TITLE or not isinstance(description, str) or len(description) > MAX_DESCRIPTION:
+        raise ValueError(f"title must be at most {MAX_TITLE} characters and description at most {MAX_DESCRIPTION}")
+    reminders_data = data.get('reminders') or []
+    if not isinstance(reminders_data, list):
+        raise ValueError("reminders must be a list")
+    reminders = []
+    for index, reminder in enumerate(reminders_data, 1):
+        if not isinstance(reminder, dict):
+            raise ValueError(f"reminder {index} must be an object")
+        date_time = parse_date_time(reminder.get('date_time'))
+        repeater = reminder.get('repeater') or 'Never'
+        if repeater not in REPEATERS:
+            raise ValueError(f"reminder {index} repeater must be one of {', '.join(REPEATERS)}")
+        if date_time <= now:
+            if repeater == 'Never':
+                raise ValueError(f"reminder {index} is set in the past")
+            date_time, _ = next_occurrence(date_time, repeater, now)
+        buzzer, alarm, pattern = reminder.get('buzzer'), reminder.get('alarm'), reminder.get('pattern')
+        if buzzer is not None and buzzer not in BUZZER_VOLUMES:
+            raise ValueError(f"reminder {index} buzzer must be one of {', '.join(BUZZER_VOLUMES)}")
+        if alarm is not None and alarm not in URGENCIES:
+            raise ValueError(f"reminder {index} alarm must be one of {', '.join(URGENCIES)}")
+        if pattern is not None and not (isinstance(pattern, str) and parse_pattern(pattern.strip())):
+            raise ValueError(f"reminder {index} pattern is invalid")
+        reminders.append({'date_time': date_time, 'buzzer': buzzer, 'vibration': bool(reminder.get('vibration')),
+                          'web_unlock': bool(reminder.get('web_unlock')), 'reminder_lock': False, 'alarm': alarm,
+                          'repeater': repeater, 'pattern': pattern.replace(' ', '') if pattern else None})
+    return {'title': title.strip(), 'description': description, 'event_lock': False}, reminders
+
+def insert_batch(session, batch):
+    '''
+    Inserts a batch of validated (event, reminders): the events one statement each, the reminders with one executemany
+        Each event's id is taken from its own insert (the cursor's lastrowid, so no RETURNING is needed on older SQLite), which doesn't assume rowids are handed out contiguously
+    Returns:
+        reminders (int), number of reminders inserted
+    '''
+    event_ids = [session.execute(insert(Event).values(event)).inserted_primary_key[0] for event, _ in batch]
+    reminder_rows = [dict(reminder, event_id=event_id) for event_id, (_, reminders) in zip(event_ids, batch) for reminder in reminders]
+    if reminder_rows:
+        session.execute(insert(Reminder), reminder_rows)
+    return len(reminder_rows)
+
+def import_events(session, stream, import_format, now, batch_size=BATCH_SIZE):
+    '''
+    Reads, validates and inserts every event in stream within the session's transaction, without committing it
+    Args:
+        session (Session), database session, the caller commits on success and rolls back on ImportFormatError
+        stream (binary file), the import file
+        import_format (str), one of FORMATS
+        now (datetime), current time, reminders must be after it
+        batch_size (int), events per batch
+    Returns:
+        report (dict): rows read, events and reminders inserted, error_count and the first MAX_REPORTED_ERRORS errors as {'row', 'error'}, seconds taken and rows_per_second
+    Raises:
+        ImportFormatError if the file can't be read to the end
+    '''
+    started = time.perf_counter()
+    report = {'format': import_format, 'rows': 0, 'events': 0, 'reminders': 0, 'error_count': 0, 'errors': []}
+    batch = []
+    for row, value in read_rows(stream, import_format):
+        report['rows'] += 1
+        try:
+            if isinstance(value, ValueError):
+                raise value
+            batch.append(validate_event(value, now))
+        except ValueError as ex:
+            report['error_count'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': row, 'error': str(ex)})
+            continue
+        if len(batch) >= batch_size:
+            report['reminders'] += insert_batch(session, batch)
+            report['events'] += len(batch)
+            batch = []
+    if batch:
+        report['reminders'] += insert_batch(session, batch)
+        report['events'] += len(batch)
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_second'] = round(report['rows'] / report['seconds']) if report['seconds'] else None
+    logger.info("Imported %s events and %s reminders from %s %s rows in %ss, %s rows rejected",
+                report['events'], report['reminders'], report['rows'], import_format, report['seconds'], report['error_count'])
+    return report
@@ -0,0 +1,91 @@
+import os, socket, threading
+from log import get_logger
+
+logger = get_logger('ipc')
+
+SOCKET_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.unlock') # Shares the folder holding the web unlock files
+MAIN_SOCKET = os.path.join(SOCKET_DIRECTORY, 'rpi_main.sock') # Listened to by rpi_main: 'unlock', 'reminders'
+APP_SOCKET = os.path.join(SOCKET_DIRECTORY, 'app.sock') # Listened to by app.py: 'key <unlock key>', 'clear', 'metrics <json>'
+MAX_MESSAGE = 65536 # Largest datagram received and sent, metrics snapshots are the biggest messages
+
+class Channel:
+    def __init__(self, path, peer_path):
+        '''
+        Initializes the Channel object
+            A Unix domain datagram socket pair between app.py and rpi_main, used to pass web unlock state and change notifications without polling files
+            Each process binds its own path and sends to its peer's, so either side can restart independently
+        Args:
+            path (str), socket path this process listens on
+            peer_path (str), socket path of the other process
+        '''
+        self.path = path
+        self.peer_path = peer_path
+        self.socket = None
+        self.thread = None
+        self.listening = False
+
+    def start(self, handler):
+        '''
+        Binds the socket and starts a daemon thread that calls handler(command, argument) for every message received
+            handler runs on the listener thread, so it must be thread safe
+        Returns:
+            True if the channel is listening, False if the socket could not be bound (callers fall back to the .unlock files)
+        '''
+        try:
+            if os.path.exists(self.path): # Left behind by a process that didn't shut down cleanly
+                os.remove(self.path)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.bind(self.path)
+            self.listening = True
+            self.thread = threading.Thread(target=self.listen, args=(handler,), daemon=True)
+            self.thread.start()
+            logger.info("Listening on %s", self.path)
+        except Exception as ex:
+            logger.error("Error in Channel.start for %s: %s", self.path, ex)
+            self.listening = False
+        return self.listening
+
+    def listen(self, handler):
+        '''
+        Receives messages until the socket is closed, each datagram is one 'command argument' message
+        '''
+        while self.listening:
+            try:
+                message = self.socket.recv(MAX_MESSAGE).decode('utf-8')
+            except OSError: # Socket closed by close()
+                break
+            command, _, argument = message.partition(' ')
+            try:
+                handler(command, argument)
+            except Exception as ex:
+                logger.error("Error in Channel handler for %r: %s", message, ex)
+
+    def send(self, command, argument=''):
+        '''
+        Sends a message to the peer without blocking
+        Returns:
+            True if delivered, False if the peer isn't running (no socket), its queue is full or the message is larger than MAX_MESSAGE
+        '''
+        message = f"{command} {argument}".rstrip().encode('utf-8')
+        if len(message) > MAX_MESSAGE: # The listener would read a truncated datagram and drop it as garbage
+            logger.error("%s message of %s bytes exceeds the %s byte limit, not sent", command, len(message), MAX_MESSAGE)
+            return False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+                sender.setblocking(False)
+                sender.sendto(message, self.peer_path)
+            return True
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError) as ex:
+            logger.debug("%s not delivered to %s: %s", command, self.peer_path, ex)
+            return False
+
+    def close(self):
+        '''
+        Stops the listener thread and removes the socket file
+        '''
+        self.listening = False
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
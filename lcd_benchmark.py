@@ -0,0 +1,75 @@
+'''
+Throughput of the I2C LCD driver on the simulated bus
+    Writes full 16x2 frames through the byte by byte path (one SMBus.write_byte per byte with the driver's sleeps, as lcd_display_string() used to) and through the block write path (lcd_write_bulk())
+    Reports characters per second as measured on this machine, the bus transactions per character, and an estimate that adds the wire time of a real bus
+    The simulated bus returns instantly, so the measured rate is bounded by the driver's sleeps and Python overhead; the wire estimate assumes 9 bit times per byte plus start, address and stop per transaction
+
+Usage:
+    python lcd_benchmark.py --frames 50
+    python lcd_benchmark.py --bus-hz 400000 # A Pi with dtparam=i2c_arm_baudrate=400000
+'''
+import argparse, sys, time
+
+from backends import SimulatedBackend
+from I2C_LCD_driver import lcd, Rs
+
+LINES = ("07:15 AM  ALARM!", "October 18, '26 ")
+ROW_ADDRESSES = (0x80, 0xC0)
+
+def write_bytewise(screen, lines):
+    for address, line in zip(ROW_ADDRESSES, lines):
+        screen.lcd_write(address)
+        for char in line:
+            screen.lcd_write(ord(char), Rs)
+
+def write_block(screen, lines):
+    writes = []
+    for address, line in zip(ROW_ADDRESSES, lines):
+        writes += [(address, 0)] + [(ord(char), Rs) for char in line]
+    screen.lcd_write_bulk(writes)
+
+def wire_seconds(log, bus_hz):
+    '''
+    Returns the estimated time (float) the logged writes would spend on a bus clocked at bus_hz
+    '''
+    bits = 0
+    for _, _, action, value in log.filter('i2c1'):
+        payload = 1 if action == 'write_byte' else 1 + len(value[2])
+        bits += 1 + 9 + 9 * payload + 1 # Start, address and ack, a byte and ack each, stop
+    return bits / bus_hz
+
+def measure(name, write, frames, bus_hz):
+    '''
+    Writes frames frames with write, returns a dict of the results
+    '''
+    backend = SimulatedBackend()
+    screen = lcd(bus=backend.i2c_bus(1))
+    backend.log.clear()
+    started_transactions = screen.lcd_device.transactions
+    started = time.perf_counter()
+    for _ in range(frames):
+        write(screen, LINES)
+    elapsed = time.perf_counter() - started
+    characters = frames * sum(len(line) for line in LINES)
+    transactions = screen.lcd_device.transactions - started_transactions
+    wire = wire_seconds(backend.log, bus_hz)
+    return {'name': name, 'characters': characters, 'transactions': transactions, 'elapsed': elapsed, 'wire': wire,
+            'chars_per_second': characters / elapsed, 'chars_per_second_on_bus': characters / (elapsed + wire)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=20, help="full 16x2 frames written per path")
+    parser.add_argument('--bus-hz', type=int, default=100000, help="I2C clock used for the wire time estimate")
+    arguments = parser.parse_args(argv)
+
+    results = [measure('byte', write_bytewise, arguments.frames, arguments.bus_hz),
+               measure('block', write_block, arguments.frames, arguments.bus_hz)]
+    for result in results:
+        print(f"{result['name']:<6} {result['chars_per_second']:>10,.0f} chars/s measured, "
+              f"{result['chars_per_second_on_bus']:>8,.0f} chars/s at {arguments.bus_hz / 1000:g} kHz, "
+              f"{result['transactions'] / result['characters']:.2f} transactions/char")
+    print(f"Block writes are {results[1]['chars_per_second_on_bus'] / results[0]['chars_per_second_on_bus']:.1f}x faster at {arguments.bus_hz / 1000:g} kHz")
+    return results
+
+if __name__ == '__main__':
+    sys.exit(main() and 0)
@@ -0,0 +1,115 @@
+'''
+Logging for PiTime, replacing print() in rpi_main and app.py
+    Loggers are named pitime.<module> and filtered per module, so a suppressed message costs a single level check: arguments are only formatted once a record is actually emitted
+    Levels come from the environment:
+        PITIME_LOG_LEVEL: default level for every module (WARNING if unset)
+        PITIME_LOG_LEVELS: per module overrides, i.e. "rpi_main=DEBUG,app=INFO"
+    Emitted records are also kept in a fixed-size ring buffer that can be dumped after a crash, with their message and fields captured as they were when logged
+'''
+import copy, logging, os, sys, threading
+from collections import deque
+
+RING_BUFFER_SIZE = int(os.environ.get('PITIME_LOG_BUFFER', 1000))
+FORMAT = '%(asctime)s %(levelname)s %(name)s.%(funcName)s: %(message)s'
+
+class StructuredFormatter(logging.Formatter):
+    '''
+    Appends key=value pairs passed as extra={'fields': {...}} to the formatted message
+    '''
+    def format(self, record):
+        message = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        return message
+
+class CapturedRepr(str):
+    '''
+    Text of a value's repr() taken when a record was buffered, formatted back verbatim by StructuredFormatter
+    '''
+    def __repr__(self):
+        return str(self)
+
+class RingBufferHandler(logging.Handler):
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        '''
+        Initializes the RingBufferHandler object
+            Holds the most recent records, laid out with the formatter only when the buffer is inspected
+            The message and fields are rendered as each record is buffered, since they may refer to live objects (i.e. the AlarmState) that will have changed by the time of a dump
+        Args:
+            capacity (int), number of records kept, older ones are discarded
+        '''
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        captured = copy.copy(record) # Other handlers still get the original record
+        captured.msg, captured.args = record.getMessage(), None
+        fields = getattr(record, 'fields', None)
+        if fields:
+            captured.fields = {key: CapturedRepr(repr(value)) for key, value in fields.items()}
+        self.records.append(captured)
+
+    def recent(self, count=None):
+        '''
+        Returns the formatted text (list of str) of the last count records, all of them by default
+        '''
+        records = list(self.records)[-count:] if count else list(self.records)
+        return [self.format(record) for record in records]
+
+    def dump(self, stream=None, count=None):
+        '''
+        Writes the buffered records to stream (stderr by default) for post-mortem inspection
+        '''
+        stream = stream or sys.stderr
+        for line in self.recent(count):
+            stream.write(line + '\n')
+        stream.flush()
+
+ring_buffer = RingBufferHandler()
+_configured = False
+_configure_lock = threading.Lock()
+
+def parse_levels(spec):
+    '''
+    Parses a PITIME_LOG_LEVELS string ("rpi_main=DEBUG,app=INFO") into a {module: level} dict, ignoring malformed entries
+    '''
+    levels = {}
+    for entry in (spec or '').split(','):
+        module, _, level = entry.partition('=')
+        if module.strip() and level.strip():
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+def configure(default_level=None, levels=None):
+    '''
+    Function: Attaches the stream and ring buffer handlers to the pitime logger and applies per module levels
+        Called automatically by get_logger(), calling it again re-applies the levels
+    Args:
+        default_level (str), level for modules without an override, defaults to PITIME_LOG_LEVEL or WARNING
+        levels (dict), {module: level} overrides, defaults to PITIME_LOG_LEVELS
+    '''
+    global _configured
+    with _configure_lock:
+        root = logging.getLogger('pitime')
+        if not _configured:
+            stream_handler = logging.StreamHandler()
+            formatter = StructuredFormatter(FORMAT)
+            stream_handler.setFormatter(formatter)
+            ring_buffer.setFormatter(formatter)
+            root.addHandler(stream_handler)
+            root.addHandler(ring_buffer)
+            root.propagate = False
+            _configured = True
+        root.setLevel(default_level or os.environ.get('PITIME_LOG_LEVEL', 'WARNING').upper())
+        overrides = levels if levels is not None else parse_levels(os.environ.get('PITIME_LOG_LEVELS'))
+        for module, level in overrides.items():
+            logging.getLogger(f'pitime.{module}').setLevel(level)
+
+def get_logger(module):
+    '''
+    Returns the pitime.<module> logger, configuring logging on first use
+    '''
+    if not _configured:
+        configure()
+    return logging.getLogger(f'pitime.{module}')
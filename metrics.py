@@ -0,0 +1,271 @@
+'''
+In-process counters and histograms rendered in the Prometheus text exposition format
+    app.py serves its own registry and the latest snapshot published by rpi_main at /metrics
+    rpi_main publishes registry.snapshot() as JSON over the ipc Channel, so app.py never has to call into the alarm process while it is being scraped
+'''
+import json, threading, time
+from contextlib import contextmanager
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DELAY_BUCKETS = (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 3600) # Reminder due-to-fire delays, from scheduler jitter to missed minutes
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        '''
+        Initializes the Counter object
+            A monotonically increasing value per combination of label values
+        Args:
+            name (str), metric name, ending in _total by convention
+            documentation (str), HELP text
+            labels (tuple), label names, values are passed to inc() as keyword arguments
+        '''
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {} # label values (tuple) -> count
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def load(self, values):
+        with self.lock:
+            self.values = {tuple(key): value for key, value in values}
+
+    def samples(self, constant=()):
+        '''
+        Yields (name, label names, label values, value) for each exposed sample
+        '''
+        names = tuple(name for name, _ in constant) + self.labels
+        fixed = tuple(value for _, value in constant)
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, names, fixed + key, value
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        '''
+        Initializes the Histogram object
+            Counts observations into fixed upper bounds, plus their sum and count, per combination of label values
+        Args:
+            name (str), metric name, ending in the unit (i.e. _seconds) by convention
+            documentation (str), HELP text
+            labels (tuple), label names, values are passed to observe() as keyword arguments
+            buckets (tuple), ascending upper bounds, +Inf is implied
+        '''
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # label values (tuple) -> [per-bucket counts (list, last is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        '''
+        Observes the wall time spent in the with block
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self.lock:
+            series = self.values.get(self.key(labels))
+            return series[2] if series else 0
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), [list(series[0]), series[1], series[2]]] for key, series in self.values.items()]
+
+    def load(self, values):
+        with self.lock:
+            self.values = {tuple(key): [list(series[0]), series[1], series[2]] for key, series in values}
+
+    def samples(self, constant=()):
+        names = tuple(name for name, _ in constant) + self.labels
+        fixed = tuple(value for _, value in constant)
+        with self.lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", names + ('le',), fixed + key + (format_value(bound),), cumulative
+            yield f"{self.name}_sum", names, fixed + key, total
+            yield f"{self.name}_count", names, fixed + key, count
+
+class Registry:
+    def __init__(self, **constant_labels):
+        '''
+        Initializes the Registry object
+            Holds every metric of one process; counter() and histogram() return the existing metric when called again with the same name
+        Args:
+            constant_labels, labels added to every sample on render, i.e. process='rpi_main' so both processes can share metric names
+        '''
+        self.metrics = {}
+        self.constant_labels = tuple(sorted(constant_labels.items()))
+        self.lock = threading.Lock()
+
+    def register(self, metric_type, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_type(name, *args, **kwargs)
+            elif not isinstance(metric, metric_type):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram, name, documentation, labels, buckets)
+
+    def snapshot(self):
+        '''
+        Returns a JSON serializable copy of every metric, the inverse of from_snapshot()
+        '''
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {'labels': dict(self.constant_labels),
+                'metrics': [{'type': metric.kind, 'name': metric.name, 'help': metric.documentation,
+                             'labels': list(metric.labels), 'buckets': list(getattr(metric, 'buckets', ())),
+                             'values': metric.snapshot()} for metric in metrics]}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), separators=(',', ':'))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        '''
+        Rebuilds a read-only copy of another process's registry from its snapshot() (dict) or to_json() (str)
+        '''
+        if isinstance(snapshot, str):
+            snapshot = json.loads(snapshot)
+        registry = cls(**snapshot.get('labels', {}))
+        for entry in snapshot.get('metrics', []):
+            if entry['type'] == 'histogram':
+                metric = registry.histogram(entry['name'], entry['help'], entry['labels'], entry['buckets'])
+            else:
+                metric = registry.counter(entry['name'], entry['help'], entry['labels'])
+            metric.load(entry['values'])
+        return registry
+
+    def render(self):
+        '''
+        Returns every metric in the Prometheus text exposition format (str)
+        '''
+        return render(self)
+
+def render(*registries):
+    '''
+    Renders one or more registries as a single exposition, merging metrics that share a name (i.e. database latency from both processes)
+    '''
+    families = {}
+    for registry in registries:
+        with registry.lock:
+            metrics = list(registry.metrics.values())
+        for metric in metrics:
+            families.setdefault(metric.name, []).append((metric, registry.constant_labels))
+    lines = []
+    for name in sorted(families):
+        first = families[name][0][0]
+        lines.append(f"# HELP {name} {first.documentation}")
+        lines.append(f"# TYPE {name} {first.kind}")
+        for metric, constant in families[name]:
+            for sample, names, values, value in metric.samples(constant):
+                lines.append(f"{sample}{format_labels(names, values)} {format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+def instrument_database(registry, engine, session):
+    '''
+    Records the latency of every SQL statement executed on engine and every commit of session through SQLAlchemy events
+        pitime_db_query_seconds{statement="SELECT"|"UPDATE"|...}, pitime_db_commit_seconds
+    Args:
+        registry (Registry), engine (sqlalchemy.Engine), session (Session or scoped_session)
+    '''
+    queries = registry.histogram('pitime_db_query_seconds', "SQL statement execution time", ('statement',))
+    commits = registry.histogram('pitime_db_commit_seconds', "Session commit time")
+    query_key, commit_key = ('pitime_query_start', id(queries)), ('pitime_commit_start', id(commits)) # Per registry, so two registries can instrument one engine
+
+    # Start times are keyed on the statement's execution context, so a failed statement can't leave one behind for the next to pick up
+    def before_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault(query_key, {})[id(context or cursor)] = time.perf_counter()
+
+    def after_execute(connection, cursor, statement, parameters, context, executemany):
+        start = connection.info.get(query_key, {}).pop(id(context or cursor), None)
+        if start is not None:
+            queries.observe(time.perf_counter() - start, statement=statement.lstrip().split(None, 1)[0].upper())
+
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None:
+            connection.info.get(query_key, {}).pop(id(exception_context.execution_context or exception_context.cursor), None)
+
+    def before_commit(session):
+        session.info[commit_key] = time.perf_counter()
+
+    def after_commit(session):
+        start = session.info.pop(commit_key, None)
+        if start is not None:
+            commits.observe(time.perf_counter() - start)
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    event.listen(engine, 'after_cursor_execute', after_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    event.listen(session, 'before_commit', before_commit)
+    event.listen(session, 'after_commit', after_commit)
@@ -0,0 +1,102 @@
+'''
+Versioned schema migrations for alarm-reminder.db
+    db.create_all() only creates missing tables and never alters existing ones, so changes to the schema of an existing database are applied here
+    The schema version is stored in SQLite's PRAGMA user_version, every migration above it is applied in order, each in its own transaction
+    Every statement must be idempotent because a freshly created database already has the current schema from db.create_all()
+'''
+import os
+from sqlalchemy import text
+from models import REMINDER_SPAN_TRIGGERS
+from images import image_info, find_event_image
+from log import get_logger
+
+logger = get_logger('migrations')
+
+IMAGE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static') # app.config['UPLOAD_FOLDER']
+
+def add_column(table, column, definition):
+    '''
+    Returns a migration statement that adds a column unless the table already has it (SQLite has no ADD COLUMN IF NOT EXISTS)
+    '''
+    def statement(connection):
+        columns = [row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))]
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    return statement
+
+def backfill_event_images(directory=IMAGE_DIRECTORY):
+    '''
+    Returns a migration statement that records the images uploaded before their paths were stored on events, probing the disk once per event instead of on every /events request
+    '''
+    def statement(connection):
+        event_ids = connection.execute(text("SELECT id FROM event WHERE image_path IS NULL")).scalars().all()
+        for event_id in event_ids:
+            name = find_event_image(directory, event_id)
+            if name:
+                info = image_info(os.path.join(directory, name))
+                connection.execute(text("UPDATE event SET image_path = :path, image_width = :width, image_height = :height, image_sha256 = :sha256 WHERE id = :id"),
+                                   {'path': name, 'id': event_id, **info})
+    return statement
+
+MIGRATIONS = [ # (version, description, statements), append new migrations to the end and never edit applied ones
+    (1, "Index reminders by due time and event, index active events", [
+        "CREATE INDEX IF NOT EXISTS ix_reminder_active_date_time ON reminder (date_time) WHERE reminder_lock = 0",
+        "CREATE INDEX IF NOT EXISTS ix_reminder_event_id_date_time ON reminder (event_id, date_time)",
+        "CREATE INDEX IF NOT EXISTS ix_event_active_id ON event (id) WHERE event_lock = 0",
+    ]),
+    (2, "Add custom buzzer/vibration patterns to reminders", [
+        add_column('reminder', 'pattern', 'VARCHAR(200)'),
+    ]),
+    (3, "Store each event's first and last reminder time for paging /events", [
+        add_column('event', 'first_reminder', 'DATETIME'),
+        add_column('event', 'last_reminder', 'DATETIME'),
+        "UPDATE event SET first_reminder = (SELECT min(date_time) FROM reminder WHERE event_id = event.id), "
+        "last_reminder = (SELECT max(date_time) FROM reminder WHERE event_id = event.id)",
+        "CREATE INDEX IF NOT EXISTS ix_event_active_first_reminder ON event (first_reminder, id) WHERE event_lock = 0",
+        "CREATE INDEX IF NOT EXISTS ix_event_active_last_reminder ON event (last_reminder, id) WHERE event_lock = 0",
+    ] + REMINDER_SPAN_TRIGGERS),
+    (4, "Store event image paths, dimensions and hashes", [
+        add_column('event', 'image_path', 'VARCHAR(255)'),
+        add_column('event', 'image_width', 'INTEGER'),
+        add_column('event', 'image_height', 'INTEGER'),
+        add_column('event', 'image_sha256', 'VARCHAR(64)'),
+        backfill_event_images(),
+    ]),
+    (5, "Store the paths of resized event images", [
+        add_column('event', 'image_thumb_path', 'VARCHAR(255)'),
+        add_column('event', 'image_web_path', 'VARCHAR(255)'),
+    ]),
+]
+
+def schema_version(connection):
+    '''
+    Returns the schema version (int) recorded in the database
+    '''
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+def run_migrations(engine):
+    '''
+    Function: Applies every migration newer than the database's schema version
+        Each migration and its version bump are committed together, so an interrupted run resumes from the last completed migration
+    Args:
+        engine (Engine), the SQLAlchemy engine bound to the database, i.e. db.engine
+    Returns:
+        applied (list), versions of the migrations applied during this call
+    '''
+    applied = []
+    with engine.connect() as connection:
+        current_version = schema_version(connection)
+        connection.rollback() # Ends the implicit transaction opened by the PRAGMA read
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            logger.info("Applying migration %s: %s", version, description)
+            with connection.begin():
+                for statement in statements:
+                    if callable(statement): # Data migrations that can't be expressed as a single statement
+                        statement(connection)
+                    else:
+                        connection.execute(text(statement))
+                connection.execute(text(f"PRAGMA user_version = {int(version)}"))
+            applied.append(version)
+    return applied
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, DDL
 
 db = SQLAlchemy()
 
@@ -9,13 +10,32 @@ class Event(db.Model): # Objects are not being stored in memory and thus do not
         Event.title (str), the event title
         Event.description (str), the event description
         Event.reminders (key), backreferences all connected Event objects which is linked by the Event.id value
+        Event.first_reminder, Event.last_reminder (datetime), earliest and latest date_time of the event's reminders, None without reminders
+            Maintained by the triggers in REMINDER_SPAN_TRIGGERS so /events can page through events in reminder order on an index
+        Event.image_path (str), file name of the uploaded image under static/, None without an image
+        Event.image_width, Event.image_height (int), image dimensions in pixels, Event.image_sha256 (str), hex digest of the file; all set with image_path by app.submit()
+        Event.image_thumb_path, Event.image_web_path (str), resized JPEGs of the image under static/, None until images.ImagePipeline has written them
     '''
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     description = db.Column(db.String(500))
     event_lock = db.Column(db.Boolean, default = False)
+    first_reminder = db.Column(db.DateTime)
+    last_reminder = db.Column(db.DateTime)
+    image_path = db.Column(db.String(255))
+    image_width = db.Column(db.Integer)
+    image_height = db.Column(db.Integer)
+    image_sha256 = db.Column(db.String(64))
+    image_thumb_path = db.Column(db.String(255))
+    image_web_path = db.Column(db.String(255))
     reminders = db.relationship('Reminder', backref='event', lazy='dynamic') # Enables a 1 event to many reminders configuration
 
+    __table_args__ = (
+        db.Index('ix_event_active_id', 'id', sqlite_where=db.text('event_lock = 0')), # Partial index covering /events, which only lists active events
+        db.Index('ix_event_active_first_reminder', 'first_reminder', 'id', sqlite_where=db.text('event_lock = 0')), # /events?sort=asc pages
+        db.Index('ix_event_active_last_reminder', 'last_reminder', 'id', sqlite_where=db.text('event_lock = 0')), # /events?sort=desc pages
+    )
+
     def __repr__(self):
         return f"<Event(id='{self.id}', title='{self.title}')>"
 
@@ -29,6 +49,7 @@ class Reminder(db.Model):
         Reminder.vibration (bool), flag for vibration activity 
         Reminder.alarm (str), selected alarm urgency
         Reminder.repeater (str), the frequency with which an alarm is set to repeat, date_time adjusted at each trigger by interval repeater
+        Reminder.pattern (str), custom buzzer/vibration rhythm in milliseconds alternating on and off, i.e. "200,200,200,1000"
         Reminder.event_id (int), the foreign key from the associated event object (event.id)
     '''
     # Uniquely identify record in the database, set internally
@@ -44,10 +65,30 @@ class Reminder(db.Model):
     reminder_lock = db.Column(db.Boolean, default = False)
     alarm = db.Column(db.String(120))  # Indicates urgency of the alarm required for this reminder. Hereafter referred to as 'urgency'
     repeater = db.Column(db.String(50)) # String reminder repeat
+    pattern = db.Column(db.String(200)) # Overrides the default buzzer/vibration rhythm, see rpi_models.parse_pattern()
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'), nullable=False) # Implicit connection to some event object
 
+    __table_args__ = (
+        db.Index('ix_reminder_active_date_time', 'date_time', sqlite_where=db.text('reminder_lock = 0')), # Unspent reminders by due time, used by the scheduler and fetch_active_reminders
+        db.Index('ix_reminder_event_id_date_time', 'event_id', 'date_time'), # Reminders per event, ordered, used by /events
+    )
+
     def __repr__(self):
         optional_flags = f"buzzer={self.buzzer}, vibration={self.vibration}, web_unlock={self.web_unlock}, reminder_lock={self.reminder_lock}"
         return f"<Reminder(id='{self.id}', event_id='{self.event_id}', date_time='{self.date_time}', alarm='{self.alarm}', repeater='{self.repeater}')\n   Optional Flags: {optional_flags}>"
 
 
+def span_update(event_id):
+    return (f"UPDATE event SET first_reminder = (SELECT min(date_time) FROM reminder WHERE event_id = {event_id}), "
+            f"last_reminder = (SELECT max(date_time) FROM reminder WHERE event_id = {event_id}) WHERE id = {event_id}")
+
+# Keep Event.first_reminder/last_reminder in step with every write to reminder, including rpi_main's bulk updates and writes from either process
+# Each recomputation reads two ends of ix_reminder_event_id_date_time, so it costs the same however many reminders an event has
+REMINDER_SPAN_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS tr_reminder_span_insert AFTER INSERT ON reminder BEGIN {span_update('NEW.event_id')}; END",
+    f"CREATE TRIGGER IF NOT EXISTS tr_reminder_span_update AFTER UPDATE OF date_time, event_id ON reminder BEGIN "
+    f"{span_update('NEW.event_id')}; {span_update('OLD.event_id')} AND OLD.event_id != NEW.event_id; END",
+    f"CREATE TRIGGER IF NOT EXISTS tr_reminder_span_delete AFTER DELETE ON reminder BEGIN {span_update('OLD.event_id')}; END",
+]
+for statement in REMINDER_SPAN_TRIGGERS: # Databases created by db.create_all(), existing ones get them from migration 3
+    event.listen(Reminder.__table__, 'after_create', DDL(statement))
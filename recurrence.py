@@ -0,0 +1,118 @@
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+
+try: # NumPy is optional, catch_up_batch falls back to a per-reminder loop without it
+    import numpy as np
+except ImportError:
+    np = None
+
+FIXED_INTERVALS = { # Repeaters with a constant length, caught up with plain division
+    "Hourly": timedelta(hours=1),
+    "Daily": timedelta(days=1),
+    "Weekly": timedelta(weeks=1),
+}
+CALENDAR_INTERVALS = { # Repeaters whose length depends on the calendar, in months per step
+    "Monthly": 1,
+    "Yearly": 12,
+}
+MAX_CALENDAR_STEPS = 2 # The month estimate is never more than one step behind, one extra step is slack
+
+def next_occurrence(original_datetime, repeater, now):
+    '''
+        Function: Jumps a recurring reminder straight to its first occurrence after now, rather than one interval at a time like rpi_main.reminder_looper()
+            Occurrences are counted from the original date_time (original + k intervals), so a reminder set on the 31st keeps returning to the 31st of long months
+        Args:
+            original_datetime (datetime), the due date_time of the reminder
+            repeater (str), from reminder object
+            now (datetime), the current time
+        Returns:
+            next_datetime (datetime), first occurrence strictly after now (original_datetime unchanged for "Never")
+            skipped (int), number of missed occurrences between the one being fired and next_datetime
+    '''
+    if repeater == "Never":
+        return original_datetime, 0
+    if repeater in FIXED_INTERVALS:
+        step = FIXED_INTERVALS[repeater]
+        steps = max((now - original_datetime) // step + 1, 1)
+        return original_datetime + steps * step, steps - 1
+    if repeater in CALENDAR_INTERVALS:
+        months = CALENDAR_INTERVALS[repeater]
+        elapsed_months = (now.year - original_datetime.year) * 12 + now.month - original_datetime.month
+        steps = max(elapsed_months // months, 1) # Lands in or before now's month, so at most one step behind
+        for _ in range(MAX_CALENDAR_STEPS):
+            next_datetime = original_datetime + relativedelta(months=steps * months)
+            if next_datetime > now:
+                break
+            steps += 1
+        return original_datetime + relativedelta(months=steps * months), steps - 1
+    raise ValueError("Repeater value must be in the legal Repeater set")
+
+def catch_up_batch(date_times, repeaters, now):
+    '''
+        Function: Applies next_occurrence() to many reminders at once, vectorized with NumPy datetime64 arithmetic when NumPy is installed
+        Args:
+            date_times (list), due date_time (datetime) of each reminder
+            repeaters (list), repeater (str) of each reminder, in the same order
+            now (datetime), the current time
+        Returns:
+            next_date_times (list), next occurrence (datetime) per reminder, None where the repeater is illegal
+            skipped (list), number of missed occurrences (int) per reminder, 0 where the repeater is illegal
+    '''
+    if np is None or not date_times:
+        next_date_times, skipped = [], []
+        for date_time, repeater in zip(date_times, repeaters):
+            try:
+                next_date_time, skip = next_occurrence(date_time, repeater, now)
+            except ValueError:
+                next_date_time, skip = None, 0
+            next_date_times.append(next_date_time)
+            skipped.append(skip)
+        return next_date_times, skipped
+
+    originals = np.array(date_times, dtype='datetime64[us]')
+    current = np.datetime64(now, 'us')
+    repeaters = np.array(repeaters, dtype=object)
+    next_date_times = originals.copy()
+    skipped = np.zeros(len(originals), dtype=np.int64)
+    legal = repeaters == "Never"
+
+    for repeater, step in FIXED_INTERVALS.items():
+        mask = repeaters == repeater
+        if mask.any():
+            step = np.timedelta64(step, 'us')
+            steps = np.maximum((current - originals[mask]) // step + 1, 1)
+            next_date_times[mask] = originals[mask] + steps * step
+            skipped[mask] = steps - 1
+            legal |= mask
+
+    for repeater, months in CALENDAR_INTERVALS.items():
+        mask = repeaters == repeater
+        if mask.any():
+            next_date_times[mask], skipped[mask] = _calendar_catch_up(originals[mask], months, current)
+            legal |= mask
+
+    results = next_date_times.astype(object).tolist() # datetime64[us] converts back to datetime objects
+    return [result if ok else None for result, ok in zip(results, legal)], np.where(legal, skipped, 0).tolist()
+
+def _calendar_catch_up(originals, months, current):
+    '''
+    Vectorized next_occurrence() for month-based repeaters: the day of month is clamped to the target month's length, matching relativedelta
+    '''
+    original_months = originals.astype('datetime64[M]')
+    day_offsets = originals.astype('datetime64[D]') - original_months.astype('datetime64[D]')
+    times_of_day = originals - originals.astype('datetime64[D]')
+    elapsed_months = (current.astype('datetime64[M]') - original_months).astype(np.int64)
+    steps = np.maximum(elapsed_months // months, 1)
+
+    def occurrence(steps):
+        target_months = original_months + (steps * months).astype('timedelta64[M]')
+        month_starts = target_months.astype('datetime64[D]')
+        month_lengths = (target_months + np.timedelta64(1, 'M')).astype('datetime64[D]') - month_starts
+        return month_starts + np.minimum(day_offsets, month_lengths - np.timedelta64(1, 'D')) + times_of_day
+
+    for _ in range(MAX_CALENDAR_STEPS):
+        behind = occurrence(steps) <= current
+        if not behind.any():
+            break
+        steps = np.where(behind, steps + 1, steps)
+    return occurrence(steps), steps - 1
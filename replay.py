@@ -0,0 +1,141 @@
+'''
+Accelerated replay of the reminder engine on virtual time
+    Seeds a database with random reminders, then drives rpi_main's scheduling lane (scheduler.wait() followed by process_event_reminders()) through weeks of virtual time in seconds
+    Hardware is simulated and every alarm is dismissed as soon as it fires
+    Reports how late reminders fired relative to their due time, plus the number of queries and commits the engine issued
+    Due times and the start time are not minute aligned, so neither mode can hit a due time just by stepping on whole minutes
+
+Usage:
+    python replay.py --reminders 500 --days 28 --seed 7
+    python replay.py --mode poll --poll-interval 5 # The fixed-interval polling loop the scheduler replaced, for comparison
+'''
+import argparse, os, random, statistics, sys, time
+from datetime import datetime, timedelta
+
+import clock
+
+REPEATERS = ["Never", "Hourly", "Daily", "Weekly", "Monthly", "Yearly"]
+URGENCIES = [None, 'Not at all', 'Somewhat', 'Urgent', 'Very', 'Extremely']
+
+def load_engine(start):
+    '''
+    Imports rpi_main on a virtual clock with simulated hardware and a private in-memory database
+        Must run before anything else imports rpi_main, since its database is configured at import time
+    Returns:
+        rpi_main (module)
+    '''
+    clock.set_clock(clock.VirtualClock(start))
+    os.environ.setdefault('PITIME_BACKEND', 'simulated')
+    os.environ['PITIME_DATABASE_URI'] = 'sqlite:///:memory:'
+    import rpi_main
+    return rpi_main
+
+def seed_reminders(rpi_main, count, days, rng):
+    '''
+    Creates one event per reminder with due times spread uniformly over the replay window, with random repeaters and urgencies
+    '''
+    start = clock.now()
+    for index in range(count):
+        event = rpi_main.Event(title=f"Replay event {index}", description="Seeded by replay.py")
+        due = start + timedelta(seconds=rng.uniform(1, days * 86400))
+        reminder = rpi_main.Reminder(date_time=due,
+                                     repeater=rng.choice(REPEATERS), alarm=rng.choice(URGENCIES),
+                                     buzzer=rng.choice([None, '1']), vibration=rng.random() < 0.5, event=event)
+        rpi_main.db.session.add_all([event, reminder])
+    rpi_main.db.session.commit()
+
+class Counters:
+    def __init__(self, engine, session):
+        '''
+        Initializes the Counters object
+            Counts statements executed on the engine (by leading SQL keyword) and commits on the session through SQLAlchemy events
+        '''
+        from sqlalchemy import event
+        self.statements = {}
+        self.commits = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+        event.listen(session, 'after_commit', self.on_commit)
+
+    def on_execute(self, connection, cursor, statement, parameters, context, executemany):
+        keyword = statement.lstrip().split(None, 1)[0].upper()
+        self.statements[keyword] = self.statements.get(keyword, 0) + 1
+
+    def on_commit(self, session):
+        self.commits += 1
+
+    def reset(self):
+        self.statements.clear()
+        self.commits = 0
+
+def replay(rpi_main, days, mode='scheduler', poll_interval=5):
+    '''
+    Function: Runs the scheduling lane until the virtual clock has moved days forward
+        'scheduler' mode sleeps on the ReminderScheduler like AlarmRuntime.scheduling_lane()
+        'poll' mode queries on a fixed interval like the loop the scheduler replaced
+        The virtual clock has no wake-up latency, so scheduler mode shows whether the scheduler wakes at the right due time, and poll mode shows the lag of the interval
+    Returns:
+        errors (list), seconds between each reminder's due time and the moment process_event_reminders() fetched it, one per reminder row processed
+    '''
+    scheduler = rpi_main.scheduler
+    end = clock.now() + timedelta(days=days)
+    errors = []
+    fetch_due_reminder_rows = rpi_main.fetch_due_reminder_rows
+
+    def recording_fetch(): # Measures the rows the real processing path handles, not what the scheduler expected to be due
+        rows = fetch_due_reminder_rows()
+        now = clock.now()
+        errors.extend((now - row.date_time).total_seconds() for row in rows)
+        return rows
+
+    rpi_main.fetch_due_reminder_rows = recording_fetch
+    try:
+        while clock.now() < end:
+            if mode == 'scheduler':
+                due = scheduler.wait(rpi_main.seconds_until_next_minute())
+            else:
+                clock.sleep(poll_interval)
+                due = True
+            if not due:
+                continue
+            rpi_main.process_event_reminders(rpi_main.urgency_comparator)
+            scheduler.notify()
+            rpi_main.initialize_globals() # Dismisses the alarm immediately
+    finally:
+        rpi_main.fetch_due_reminder_rows = fetch_due_reminder_rows
+    return errors
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reminders', type=int, default=200, help="number of seeded reminders")
+    parser.add_argument('--days', type=float, default=28, help="virtual days to replay")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the reminder database")
+    parser.add_argument('--mode', choices=['scheduler', 'poll'], default='scheduler')
+    parser.add_argument('--poll-interval', type=float, default=5, help="seconds between queries in poll mode")
+    arguments = parser.parse_args(argv)
+
+    rpi_main = load_engine(datetime(2024, 1, 1, 8, 0) + timedelta(seconds=random.Random(arguments.seed).uniform(0, 60))) # Off the minute, like a real boot
+    with rpi_main.app.app_context():
+        rpi_main.db.create_all()
+        seed_reminders(rpi_main, arguments.reminders, arguments.days, random.Random(arguments.seed))
+        rpi_main.initialize_globals()
+        counters = Counters(rpi_main.db.engine, rpi_main.db.session)
+        counters.reset()
+        started = time.perf_counter()
+        errors = replay(rpi_main, arguments.days, arguments.mode, arguments.poll_interval)
+        elapsed = time.perf_counter() - started
+
+    print(f"Replayed {arguments.days:g} virtual days in {elapsed:.2f}s ({arguments.days * 86400 / max(elapsed, 1e-9):,.0f}x), mode={arguments.mode}")
+    print(f"Reminders fired: {len(errors)}")
+    if errors:
+        print(f"Fire-time error (s): mean {statistics.mean(errors):.3f}, p50 {percentile(errors, 0.5):.3f}, "
+              f"p95 {percentile(errors, 0.95):.3f}, max {max(errors):.3f}")
+    print(f"Queries: {sum(counters.statements.values())} {dict(sorted(counters.statements.items()))}")
+    print(f"Commits: {counters.commits}")
+    return errors, counters
+
+if __name__ == '__main__':
+    sys.exit(main() and 0)
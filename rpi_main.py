@@ -1,62 +1,78 @@
-import os, random, string, textwrap, pyttsx3
-from I2C_LCD_driver import lcd
-from gpiozero import Button
+from boot import BootTimer, wait_until_ready, probe_database, probe_i2c # First, so boot timing includes the imports below
+import os, random, string, textwrap, asyncio, time
+from I2C_LCD_driver import lcd, I2CBUS, ADDRESS as LCD_ADDRESS
+from display import FramebufferLCD, DisplayWorker, CLOCK, STATUS, UNLOCK
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from models import db, Event, Reminder
+from sqlalchemy import select, update
 from rpi_models import Speaker, Buzzer, Vibration
-from time import sleep
-from datetime import datetime, date
+from alarm_state import AlarmState, URGENCY_COMPARATOR as urgency_comparator
+from scheduler import ReminderScheduler
+from migrations import run_migrations
+from recurrence import catch_up_batch
+from ipc import Channel, MAIN_SOCKET, APP_SOCKET
+from log import get_logger, ring_buffer
+from metrics import Registry, instrument_database, DELAY_BUCKETS
+from backends import get_backend
+from tts_cache import TTSCache, event_phrases, count_phrase, configure_engine
+import clock # Every read of the time goes through the injectable clock so replays can run on virtual time
+from concurrent.futures import ThreadPoolExecutor
 from dateutil.relativedelta import relativedelta # Adjusts time accurately based on timezones / variable month lengths to ensure consistency in repeater functionality
 
-sleep(25)
+logger = get_logger('rpi_main')
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///alarm-reminder.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('PITIME_DATABASE_URI', 'sqlite:///alarm-reminder.db')
 db.init_app(app)
 
-# Hardware objects
-lcd_screen = lcd()
-snooze_button = Button(23)
+# Hardware objects, real or simulated depending on PITIME_BACKEND, opened by init_devices() once they answer their readiness probes
+backend = get_backend()
+lcd_screen = None # FramebufferLCD over the driver, only cells that changed since the last frame are written
+snooze_button = None
 
-def snooze_button_press(): # Function to be called when the snooze button is pressed (gpiozero)
-    print("Snooze button pressed")
-    global alarm_trigger
-    if alarm_trigger:
-        print("Setting alarm_trigger to False")
-    alarm_trigger = False
+runtime = None # AlarmRuntime started by main()
+state = AlarmState(on_change=lambda: notify_state_changed()) # Triggered reminders, shared with the button callback and unlock channel threads
+scheduler = ReminderScheduler() # Sleeps until the next reminder is due instead of polling the database
+unlock_channel = Channel(MAIN_SOCKET, APP_SOCKET) # Receives web unlocks and reminder changes from the Flask server
+web_unlock_armed = False # In-memory copy of alarm.txt, cleared by the 'unlock' message from app.py
+web_unlock_key = ''
+
+metrics = Registry(process='rpi_main') # Published to app.py's /metrics over unlock_channel every METRICS_INTERVAL seconds
+METRICS_INTERVAL = 15
+RETRY_MIN_SECONDS = 1 # Pause before a lane retries after an error; the scheduling lane doubles it on each failure in a row
+RETRY_MAX_SECONDS = 60
+reminder_delay = metrics.histogram('pitime_reminder_fire_delay_seconds', "Seconds between a reminder's due time and its processing", buckets=DELAY_BUCKETS)
+reminders_fired = metrics.counter('pitime_reminders_fired_total', "Reminders processed")
+reminder_batch_time = metrics.histogram('pitime_reminder_batch_seconds', "Time to process one batch of due reminders")
+lane_iteration_time = metrics.histogram('pitime_lane_iteration_seconds', "Time to run one pass of an AlarmRuntime lane after it wakes up", ('lane',))
+lcd_write_time = metrics.histogram('pitime_lcd_write_seconds', "Time to write one frame to the LCD")
+lcd_transactions = metrics.counter('pitime_lcd_i2c_transactions_total', "I2C transactions sent to the LCD")
+lcd_frames_dropped = metrics.counter('pitime_lcd_frames_dropped_total', "Frames replaced by a newer frame before the display thread wrote them")
+lcd_transactions_saved = metrics.counter('pitime_lcd_i2c_transactions_saved_total', "I2C transactions avoided by writing only the changed cells instead of clearing and redrawing")
+alarm_start_time = metrics.histogram('pitime_alarm_start_seconds', "Time from starting an alarm sound to it playing", ('preloaded',))
+snooze_latency = metrics.histogram('pitime_snooze_silence_seconds', "Time from a snooze button press to the buzzer, vibration motor and alarm sound being silenced",
+                                   buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+audio_command_time = metrics.histogram('pitime_audio_command_seconds', "Time from queueing an audio command to the audio worker applying it", ('command',))
+ANNOUNCEMENT_DUCK = 0.2 # Alarm volume while events are read out, in case a new alarm starts mid announcement
+boot_timer = BootTimer(registry=metrics) # Start up phases, reported once the first clock is displayed
+tts_cache = TTSCache() # Announcement clips, rendered by app.py on submission and by the tts lane while an alarm sounds
 
-snooze_button.when_pressed = snooze_button_press
+def snooze_button_press(): # Function to be called when the snooze button is pressed (gpiozero)
+    logger.info("Snooze button pressed")
+    if state.snooze() and runtime is not None: # Also wakes the alarm lane through notify_state_changed()
+        logger.debug("Alarm trigger cleared")
+        runtime.silence() # Straight from the button thread, without waiting for the alarm lane
 
 def initialize_globals():
     '''
-        Function: Initializes global variables for use in the main script
-            alarm_trigger (bool), True if there is an active alarm, False if not
-            options_dict (dict), current aggregate options to operate control structures that create relevant alarm device objects
-                buzzer (bool), intermittent beeping if True
-                vibration (bool), intermittent vibration if True
-                web_unlock (bool), if True, the alarm requires the user to visit a custom URL to deactivate
-                alarm (set), a set of all alarm urgencies currently triggered
-            current_events_dict (dict)
-                key: event.id (str) ID for each unique event triggered
-                val: tuple
-                    event.title (str), the title of the event
-                    event.description (str), the description of the event
-            current_urgency (str), the current maximum urgency of the triggered alarms, used to keep track of changes in urgency to control whether or not a new Speaker object is declared
-    '''
-    print("\n\nRPI_MAIN.initialize_globals: Intializing globals")
-    global alarm_trigger, options_dict, current_events_dict, current_urgency, web_unlock_key_set
-    try:
-        alarm_trigger = False
-        options_dict = {'buzzer': False, # Global dictionary for keeping track of triggered functions
-                        'vibration': False,
-                        'web_unlock': False,
-                        'alarm': {'None'}}
-        current_events_dict = {}
-        current_urgency = 'None'
-        web_unlock_key_set = False
-    except Exception as ex:
-        print(f"Error initializing globals in rpi_main: {ex}\n")
+        Function: Returns the alarm state (AlarmState) to idle for use in the main script
+            state.trigger (bool), True if there is an active alarm, False if not
+            state.options (dict), current aggregate options to operate control structures that create relevant alarm device objects
+            state.events (dict), event.id -> (event.title, event.description) of every triggered event
+            state.urgency (str), the current maximum urgency of the triggered alarms
+    '''
+    logger.debug("Intializing alarm state")
+    state.reset()
 
 def reminder_looper(original_datetime, repeater):
     '''
@@ -69,7 +85,7 @@ def reminder_looper(original_datetime, repeater):
         Returns:
             New datetime postponed by value corresponding to repeater (datetime)
     '''
-    print(f"\n\nRPI_MAIN.reminder_looper: Trying to loop {original_datetime} by {repeater}")
+    logger.debug("Trying to loop %s by %s", original_datetime, repeater)
     time_additions = {
             "Never": relativedelta(),  # No addition
             "Hourly": relativedelta(hours=1),
@@ -83,7 +99,7 @@ def reminder_looper(original_datetime, repeater):
     if type(repeater) != str: # If the repeater value is not a string
         raise TypeError("Repeater must be a string") # Raise an error
     addition = time_additions.get(repeater, relativedelta())  # Default to no addition if the string is not found
-    print(f"Revised date_time: {original_datetime+addition}")
+    logger.debug("Revised date_time: %s", original_datetime+addition)
     return original_datetime + addition # Return the new datetime
 
 def fetch_active_reminders():
@@ -96,17 +112,15 @@ def fetch_active_reminders():
         Returns:
             Query object containing all relevant Reminder objects
     '''
-    print(f"\n\nRPI_MAIN.fetch_active_reminders: Fetching active reminders")
+    logger.debug("Fetching active reminders")
     try:
-        current_time = datetime.now()
+        current_time = clock.now()
         query_object = Reminder.query.join(Event).filter(Reminder.reminder_lock == False)\
             .filter(Reminder.date_time <= current_time).all()
-        print(f"Active reminders found")
-        for reminders in query_object:
-            print(f"{reminders}")
+        logger.debug("Active reminders found: %s", query_object)
         return query_object
     except Exception as ex:
-        print(f"An error occurred with rpi_main.fetch_active_reminders, {ex}")
+        logger.error("An error occurred with rpi_main.fetch_active_reminders, %s", ex)
 
 def update_reminder(reminder):
     '''
@@ -115,145 +129,139 @@ def update_reminder(reminder):
         Args:
             reminder (Reminder): representing a row in the Reminder table of the database
     '''
-    print(f"\n\nRPI_MAIN.update_reminder: Trying to update reminder {reminder}")
+    logger.debug("Trying to update reminder %s", reminder)
     initial_reminder = reminder
     try:
-        print(f"Reminder {reminder.id} set to repeat {reminder.repeater}")
+        logger.debug("Reminder %s set to repeat %s", reminder.id, reminder.repeater)
         reminder.date_time = reminder_looper(reminder.date_time, reminder.repeater)
-        print(f"New reminder datettime: {reminder.date_time}")
+        logger.debug("New reminder datettime: %s", reminder.date_time)
         if reminder.repeater == "Never":
-            print("Reminder terminated")
+            logger.debug("Reminder terminated")
             reminder.reminder_lock = True
         try: # Ask for forgiveness
-            print(f"Revised reminder: {reminder}")
-            print("Trying to commit to database...")
+            logger.debug("Revised reminder: %s", reminder)
+            logger.debug("Trying to commit to database...")
             db.session.commit() # Add floating entries to database
         except Exception as e: # Generic error message
             db.session.rollback() # Deletes current floating session instead of committing it
-            print(f"An error occurred in committing update_reminder to database for {reminder.id} from event {reminder.event.id} ({reminder.event.title}): {e}")
-    except Exception as e:
-        print(f"An error occurred in update_reminder for {reminder.id} from event {reminder.event.id} ({reminder.event.title}): {e}")
-    print(f"{initial_reminder} successfully updated to {reminder}")
-
-def update_options_dict(reminder):
-    '''
-        Function: adds options from Reminder object to running conglomerate of options for all active alarms
-            'buzzer', 'vibration', 'web_unlock' (bool): aforementioned flags for various alarm functionalities
-            'alarm': a list of all urgencies from currently active alarms
-        Args:
-            reminder (Reminder): representing a row in the Reminder table of the database
-    '''
-    global options_dict
-    print(f"\n\nRPI_MAIN.update_options_dict: updating options dict for reminder {reminder}")
-    print(f"Initial options_dict: {options_dict}\n")
-    try:
-        options_dict['buzzer'] = options_dict['buzzer'] or reminder.buzzer # OR logic makes it so additional True or False calls will only yield True given at least one True assignment
-        options_dict['vibration'] = options_dict['vibration'] or reminder.vibration
-        options_dict['web_unlock'] = options_dict['web_unlock'] or reminder.web_unlock
-        options_dict['alarm'].add(reminder.alarm) # Adds urgency to set so that only original entries are stored
-        print(f"Final options_dict: {options_dict}")
+            logger.error("An error occurred in committing update_reminder to database for %s from event %s (%s): %s", reminder.id, reminder.event.id, reminder.event.title, e)
     except Exception as e:
-        print(f"An error occurred in update_options_dict for {reminder.id} from {reminder.event.id} ({reminder.event.title}): {e}")
-    print(f"Final options_dict: {options_dict}")
+        logger.error("An error occurred in update_reminder for %s from event %s (%s): %s", reminder.id, reminder.event.id, reminder.event.title, e)
+    logger.debug("%s successfully updated to %s", initial_reminder, reminder)
 
-def update_current_events_dict(reminder):
+def fetch_due_reminder_rows():
     '''
-        Function: adds the Event object associated with the Reminder object to a running dictionary of events connected to the alarm
-            Relies on event.id for keys so multiple events with repetitive event.title and event.description content get logged separately
-            This dictionary is used to read the current events when the alarm is deactivated
-        Args:
-            reminder (Reminder): representing a row in the Reminder table of the database
+        Function: Fetches the columns needed to raise an alarm for every due, unlocked reminder in a single joined query
+            Unlike fetch_active_reminders(), no ORM objects are built: each row is a lightweight named tuple
+        Returns:
+            rows (list), Row objects with the Reminder columns plus event_title and event_description from the owning Event
     '''
-    global current_events_dict
-    print(f"\n\nRPI_MAIN.update_current_events_dict: Trying to update current_events_dict\n")
-    print(f"Current current_events_dict: {current_events_dict}\n")
-    try:
-        current_events_dict[reminder.event.id] = (reminder.event.title, reminder.event.description)
-        print(f"Updated current_events_dict: {current_events_dict}\n")    
-    except Exception as e:
-        print(f"An error occurred in update_current_events for {reminder.id} from event {reminder.event.id} ({reminder.event.title}): {e}")
+    logger.debug("Fetching due reminder rows")
+    current_time = clock.now()
+    query = select(Reminder.id, Reminder.date_time, Reminder.repeater, Reminder.buzzer, Reminder.vibration,
+                   Reminder.web_unlock, Reminder.alarm, Reminder.pattern, Reminder.event_id,
+                   Event.title.label('event_title'), Event.description.label('event_description'))\
+        .join(Event).where(Reminder.reminder_lock == False, Reminder.date_time <= current_time)\
+        .order_by(Reminder.date_time)
+    return db.session.execute(query).all()
 
-def update_urgency(urgency_comparator):
+def advance_reminders(rows, catch_up=True):
     '''
-        Function: checks all current urgencies listed in options_dict['Alarm'] and replaces current_urgency with the new maximal urgency if new urgency is higher. Otherwise does nothing.
-            This is called after every Reminder database query to check if a more urgent reminder has been triggered
-            If a more urgent reminder is present upon starting a new cycle, the control structure in the main loop will instantiate a new Speaker object with the revised urgency
+        Function: Advances or locks a batch of due reminders and commits them in one transaction
+            With catch_up, each recurring reminder jumps straight to its next future occurrence (recurrence.catch_up_batch) so a reminder overdue by many intervals fires once instead of once per interval
+            Without catch_up, reminders advance by exactly one interval using reminder_looper()
+            A bad row (i.e. an illegal repeater) doesn't stop the batch; that row is locked instead so it can't refire forever
+            The batch is written with a single executemany UPDATE keyed on primary key; if it fails, rows are retried one statement at a time within the same transaction
         Args:
-            urgency_comparator (dict), associates urgency values with a finite score  
+            rows (list), Row objects from fetch_due_reminder_rows()
+            catch_up (bool), skip missed occurrences of overdue recurring reminders
+        Returns:
+            locked (list), IDs of the reminders that could not be advanced and were locked instead
+            unwritten (list), IDs of the reminders whose update wasn't committed, so they are still due
+            skipped (int), total number of missed occurrences skipped by catch_up
     '''
-    global current_urgency, options_dict
-    print(f"\n\nRPI_MAIN.update_urgency: Trying to update current alarm urgency")
-    print(f"Current urgency: {current_urgency}")
+    logger.debug("Advancing %s due reminders, catch_up=%s", len(rows), catch_up)
+    updates, locked, unwritten = [], [], []
+    if catch_up:
+        next_date_times, skipped_counts = catch_up_batch([row.date_time for row in rows], [row.repeater for row in rows], clock.now())
+    else:
+        next_date_times, skipped_counts = [], [0] * len(rows)
+        for row in rows:
+            try:
+                next_date_times.append(reminder_looper(row.date_time, row.repeater))
+            except (ValueError, TypeError):
+                next_date_times.append(None)
+    for row, new_date_time, skipped in zip(rows, next_date_times, skipped_counts):
+        if new_date_time is None:
+            logger.warning("Reminder %s from event %s (%s) could not be advanced, locking it: illegal repeater %s", row.id, row.event_id, row.event_title, row.repeater)
+            updates.append({'id': row.id, 'date_time': row.date_time, 'reminder_lock': True})
+            locked.append(row.id)
+            continue
+        if skipped:
+            logger.info("Reminder %s from event %s (%s) skipped %s missed %s occurrences", row.id, row.event_id, row.event_title, skipped, row.repeater)
+        updates.append({'id': row.id, 'date_time': new_date_time, 'reminder_lock': row.repeater == "Never"})
+    skipped = sum(skipped_counts)
+    if not updates:
+        return locked, unwritten, skipped
     try:
-        for urgencies in options_dict['alarm']:
-            if urgency_comparator[urgencies] > urgency_comparator[current_urgency]:
-                print(f"Higher urgency found: {urgencies}")
-                current_urgency = urgencies
-            print(f"Updated urgency: {current_urgency}")
+        db.session.execute(update(Reminder), updates) # ORM bulk UPDATE by primary key, one executemany
+        db.session.commit()
     except Exception as ex:
-        print(f"Error in rpi_main.update_urgency(): {ex}")
+        db.session.rollback()
+        logger.warning("Batch update failed, retrying row by row: %s", ex)
+        for params in updates:
+            try:
+                db.session.execute(update(Reminder).where(Reminder.id == params['id'])
+                                   .values(date_time=params['date_time'], reminder_lock=params['reminder_lock']))
+            except Exception as row_ex:
+                logger.error("An error occurred updating reminder %s: %s", params['id'], row_ex)
+                unwritten.append(params['id'])
+        try:
+            db.session.commit()
+        except Exception as commit_ex:
+            db.session.rollback()
+            logger.error("An error occurred committing advance_reminders: %s", commit_ex)
+            unwritten = [params['id'] for params in updates]
+    locked = [row_id for row_id in locked if row_id not in unwritten]
+    logger.info("Reminders advanced", extra={'fields': {'advanced': len(updates) - len(locked) - len(unwritten), 'locked': locked, 'unwritten': unwritten, 'skipped': skipped}})
+    return locked, unwritten, skipped
 
 def process_event_reminders(urgency_comparator):
     '''
-        Function: Parses reminder objects using fetch_active_reminders(), update_reminder(), update_options_dict(), update_current_event_dict(), and update_urgency()
-            Pulls active alarms and uses the data from each Reminder to update bookkeeping global variables + update triggered reminder objects
-            Updates alarm_trigger based on results
+        Function: Parses due reminders using fetch_due_reminder_rows(), AlarmState.add_reminders() and advance_reminders()
+            Pulls active alarms and merges the data from each Reminder into the alarm state in one locked step, then advances the whole batch in a single transaction
+            Triggers the alarm if any reminder was due; an alarm that is already sounding is never cleared here
         Args:
             urgency_comparator (dict), associates urgency values with a finite score
+        Returns:
+            True if every due reminder was advanced or locked, False if some are still due (i.e. the commit failed) and processing should back off
     '''
-    global alarm_trigger, options_dict, current_events_dict, current_urgency
-    print(f"\n\nRPI_MAIN.process_event_reminders(): Trying to process event reminders")
-    print(f"Current alarm trigger: {alarm_trigger}")
-    print(f"Current options_dict: {options_dict}")
-    print(f"Current events_dict: {current_events_dict}")
-    print(f"Current urgency: {current_urgency}")
+    logger.debug("Trying to process event reminders", extra={'fields': {'alarm_state': state}}) # Copied by AlarmState.__repr__ when a handler emits the record, not when it is suppressed
     try:
-        print(f"Current alarm trigger: {alarm_trigger}")
-        active_reminders = fetch_active_reminders()
+        active_reminders = fetch_due_reminder_rows()
+        fired_at = clock.now()
+        _, unwritten, _ = advance_reminders(active_reminders) # One commit for the whole batch instead of one per reminder
         for reminder in active_reminders:
-            print("Updating global variables")
-            print(f"Current reminder: {reminder}")
-            update_options_dict(reminder)
-            update_current_events_dict(reminder)
-            update_urgency(urgency_comparator)
-            update_reminder(reminder)
-            print(f"Updated reminder: {reminder}\n")
-        print("Revised globals:")
-        print(f"Options dict: {options_dict}")
-        print(f"Current events dict: {current_events_dict}")
-        print(f"Urgency: {current_urgency}")
-        alarm_trigger = len(list(active_reminders)) > 0 or alarm_trigger # So process_event_reminders doesn't deactivate the alarm when checking for new events
-        print(f"Updated alarm trigger: {alarm_trigger}")
+            if reminder.id not in unwritten: # Unwritten rows are fetched again on the retry and counted then
+                reminder_delay.observe((fired_at - reminder.date_time).total_seconds())
+                reminders_fired.inc()
+        state.add_reminders(active_reminders, urgency_comparator) # Wakes the alarm lane
+        logger.debug("Revised alarm state", extra={'fields': {'due': len(active_reminders), 'alarm_state': state}})
+        return not unwritten
     except Exception as ex:
-        print(f"Error in rpi_main.process_event_reminders: {ex}")
+        logger.error("Error in rpi_main.process_event_reminders: %s", ex)
+        return False
 
 def reset():
     '''
-    Resets global bookkeeping variables to default states
+    Resets the alarm state to its defaults and clears the web unlock
     '''
-    global options_dict, alarm_trigger, current_events_dict, current_urgency, web_unlock_key_set
-    alarm_trigger = False
-    print("\n\nRPI_MAIN: Trying to reset default values")
-    print(f"Current options dict: {options_dict}\n")
-    print(f"Current events dictionary: {current_events_dict}\n")
-    print(f"Current urgency: {current_urgency}")
-    print(f"Current web_unlock_key_set: {web_unlock_key_set}")
+    logger.debug("Trying to reset default values", extra={'fields': {'alarm_state': state}})
     try:
-        options_dict = {'buzzer':False,
-                        'vibration':False,
-                        'spoken':False,
-                        'web_unlock':False,
-                        'alarm':{'None'}} # Only original entries are retained to simplify parsing
-        current_events_dict = {}
-        current_urgency = 'None'
-        web_unlock_key_set = False
+        state.reset()
         set_web_unlock(False)
-        print(f"Reset options dict: {options_dict}")
-        print(f"Reset current events dict: {current_events_dict}")
-        print(f"Reset urgency: {current_urgency}")
-        print(f"Reset web_unlock_key_set: {web_unlock_key_set}")
     except Exception as ex:
-        print(f"An error occurred in rpi_main.reset(): {ex}")
+        logger.error("An error occurred in rpi_main.reset(): %s", ex)
 
 def write_to_file(file, val):
     '''
@@ -261,16 +269,16 @@ def write_to_file(file, val):
         File: str, filename within .unlock
         Val: str, new value 
     '''
-    print(f"\n\nRPI_MAIN.write_to_file: Trying to write {val} to {file}")
+    logger.debug("Trying to write %s to %s", val, file)
     try:
         script_directory = os.path.dirname(os.path.abspath(__file__)) # fetches current working directory
         new_path = os.path.join(script_directory, '.unlock', file) # builds a relative path
-        print(f"File path: {new_path}")
+        logger.debug("File path: %s", new_path)
         with open(new_path, 'w') as alarm_flag:
             alarm_flag.write(val)
-            print(f"{val} successfully written to {file}")
+            logger.debug("%s successfully written to %s", val, file)
     except Exception as ex:
-        print(f"An error occurred in rpi_main.write_to_file(): {ex}")
+        logger.error("An error occurred in rpi_main.write_to_file(): %s", ex)
 
 def get_from_file(file):
     '''
@@ -278,196 +286,483 @@ def get_from_file(file):
         file: str, filename
     Returns str file contents
     '''
-    print(f"\n\nRPI_MAIN.get_from_file: Trying to get contents {file}")
+    logger.debug("Trying to get contents %s", file)
     try:
         script_directory = os.path.dirname(os.path.abspath(__file__)) # fetches current working directory
         new_path = os.path.join(script_directory, '.unlock', file) # builds a relative path
         with open(new_path, 'r') as alarm_flag:
             file_contents = str(alarm_flag.read()).strip()
-            print(f"Contents found: {file_contents}")
+            logger.debug("Contents found: %s", file_contents)
             return file_contents
     except Exception as ex:
-        print(f"Error at rpi_main.get_from_file(): {ex}")
+        logger.error("Error at rpi_main.get_from_file(): %s", ex)
+
+def handle_channel_message(command, argument):
+    '''
+    Handles messages from app.py on the unlock channel's listener thread
+        'unlock': the web unlock key was entered, the alarm loop is woken so the alarm stops immediately
+        'reminders': events or reminders were added or removed, the scheduler reloads its heap
+    '''
+    global web_unlock_armed
+    logger.debug("Received %s", command)
+    if command == 'unlock':
+        web_unlock_armed = False
+        notify_state_changed()
+    elif command == 'reminders':
+        scheduler.notify()
+
+def start_unlock_channel():
+    '''
+    Starts listening for messages from app.py, then seeds the in-memory web unlock state from the .unlock files so an alarm left armed before a restart stays armed
+    '''
+    global web_unlock_armed, web_unlock_key
+    if unlock_channel.start(handle_channel_message):
+        web_unlock_armed = bool(get_from_file('alarm.txt'))
+        web_unlock_key = get_from_file('unlock.txt') or ''
 
 def get_web_unlock():
     '''
-    The web_unlock flag is partially determined by the state of a text file containing either '1' or ''
-    This is because deactivating the web_unlock is performed on the other Flask server by manipulating 'alarm.txt'
-    Returns web_unlock flag from file (bool)
+    The web_unlock flag is set by this script and cleared by the Flask server when the unlock key is entered
+        When the unlock channel is listening, the flag is held in memory and cleared by an 'unlock' message, so no file is read
+        Otherwise it falls back to the state of a text file containing either '1' or ''
+    Returns web_unlock flag (bool)
         '1': web_unlock is active
         '': web_unlock is inactive
     '''
-    print("\n\nRPI_MAIN.get_web_unlock: Trying to retrieve web_unlock flag from file")
+    if unlock_channel.listening:
+        return web_unlock_armed
+    logger.debug("Trying to retrieve web_unlock flag from file")
     try:
         flag = get_from_file('alarm.txt')
-        print(f"Flag pulled from file: {flag}")
+        logger.debug("Flag pulled from file: %s", flag)
         if bool(flag):
-            print("Web unlock flag file: True")
+            logger.debug("Web unlock flag file: True")
             return True
-        print("Web unlock flag file: False")
+        logger.debug("Web unlock flag file: False")
         return False
     except Exception as ex:
-        print(f"Error at rpi_main.get_web_unlock(): {ex}")
+        logger.error("Error at rpi_main.get_web_unlock(): %s", ex)
     
 def set_web_unlock(flag):
     '''
     Sets the web unlock flag to be recognized by the Flask server, generates a random value for the web unlock key if flag = True
     if flag = False, then the alarm flag is cleared.
+        The files are kept as persistent state for a Flask server that starts later, the key itself is pushed over the unlock channel
         flag: bool
     Args:
-        flag (bool), determined by options_dict['web_unlock'], indicates that web unlock has been enabled for this reminder
+        flag (bool), determined by state.options['web_unlock'], indicates that web unlock has been enabled for this reminder
     Returns:
         random_string (str) 32 random characters to be used for the web unlock
     '''
-    global options_dict, web_unlock_key_set
-    print(f'\n\nRPI_MAIN.set_web_unlock: Setting web unlock file flag to {flag}')
+    global web_unlock_armed, web_unlock_key
+    logger.debug("Setting web unlock file flag to %s", flag)
     try:
         if flag:
-            print("Setting alarm.txt to True, writing '1' to file")
+            logger.debug("Setting alarm.txt to True, writing '1' to file")
             write_to_file('alarm.txt', '1')
             chars = string.ascii_letters + string.digits
             random_string = ''.join(random.choice(chars) for i in range(32))
-            print(f"Generated unlock key in unlock.txt: {random_string}")
+            logger.debug("Generated unlock key in unlock.txt: %s", random_string)
             write_to_file('unlock.txt', random_string)
-            web_unlock_key_set = True
+            state.set_web_unlock_key(True)
+            web_unlock_armed = True
+            web_unlock_key = random_string
+            unlock_channel.send('key', random_string)
             return random_string
         else:
-            print("Setting web_unlock state to False")
+            logger.debug("Setting web_unlock state to False")
             write_to_file('alarm.txt', '')
             write_to_file('unlock.txt', '')  # Clear the unlock key as well
-            options_dict['web_unlock'] = False
-            web_unlock_key_set = False
+            state.set_web_unlock_key(False)
+            web_unlock_armed = False
+            web_unlock_key = ''
+            unlock_channel.send('clear')
             return None
     except Exception as ex:
-        print(f"Error at rpi_main.set_web_unlock(): {ex}")
+        logger.error("Error at rpi_main.set_web_unlock(): %s", ex)
+
+def seconds_until_next_minute():
+    '''
+    Returns the number of seconds until the clock display next needs refreshing (the start of the next minute)
+    '''
+    now = clock.now()
+    return 60 - now.second - now.microsecond / 1_000_000
 
 def speak(speech, engine):
     '''
         Text to speech engine,
     '''
-    print(f"SPEAK.APP.PY: speaking {speech}")
+    logger.debug("Speaking %s", speech)
     engine.say(speech)
     engine.runAndWait()
 
+class AlarmRuntime:
+    def __init__(self, buzzer, vibration, speaker, voice_engine=None):
+        '''
+        Initializes the AlarmRuntime object
+            Replaces the single blocking main loop with asyncio tasks ("lanes") for scheduling, alarm control, the clock, audio/TTS and GPIO actuation
+            Every blocking driver or database call runs on its lane's own single-thread executor, so a slow device (i.e. a long announcement) can't stall reminder processing or the other devices
+            The LCD is owned by a DisplayWorker thread; lanes hand it prioritized frames and never wait for the I2C bus
+            Lanes talk to each other through asyncio queues and events; other threads (button callbacks, the unlock channel) wake the alarm lane with notify()
+        Args:
+            buzzer (Buzzer), vibration (Vibration), speaker (Speaker): rpi_models alarm devices
+            voice_engine (pyttsx3.Engine): text to speech engine used for event announcements, created on the tts lane at the first announcement if omitted
+        '''
+        self.buzzer = buzzer
+        self.vibration = vibration
+        self.speaker = speaker
+        self.voice_engine = voice_engine
+        self.executors = {lane: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pitime-{lane}")
+                          for lane in ('db', 'audio', 'tts', 'io')}
+        self.display = DisplayWorker(self.draw)
+        self.frames_dropped = 0 # Part of display.frames_dropped already added to lcd_frames_dropped
+        self.loop = None
+        self.alarm_active = False # True while the alarm lane is handling an alarm
+
+    def run_blocking(self, lane, function, *args):
+        '''
+        Runs a blocking call on the given lane's executor and returns an awaitable for its result
+        '''
+        return self.loop.run_in_executor(self.executors[lane], function, *args)
+
+    def run_db(self, function, *args):
+        '''
+        Runs a blocking database call on the db lane within an application context, which doesn't carry over to executor threads
+        '''
+        def call():
+            with app.app_context():
+                return function(*args)
+        return self.run_blocking('db', call)
+
+    def get_voice_engine(self):
+        '''
+        Returns the text to speech engine, initializing it on first use (runs on the tts executor, so the boot path never waits for pyttsx3)
+        '''
+        if self.voice_engine is None:
+            with boot_timer.phase('tts'):
+                self.voice_engine = configure_engine(backend.tts_engine())
+        return self.voice_engine
+
+    def say(self, phrase):
+        '''
+        Plays phrase from the TTS cache, falling back to live synthesis if it was never rendered (runs on the tts executor)
+        '''
+        path = tts_cache.lookup(phrase)
+        if path:
+            try:
+                clock.sleep(self.speaker.play_clip(path).result()) # Played by the audio worker, waited out here so phrases don't overlap
+                return
+            except Exception as ex:
+                logger.warning("Couldn't play cached clip %s, speaking live: %s", path, ex)
+        speak(phrase, self.get_voice_engine())
+
+    def prerender(self, events):
+        '''
+        Queues the announcement of events for rendering on the tts lane, so it is cached by the time the alarm is dismissed
+        '''
+        phrases = [count_phrase(len(events))]
+        for event_id, (title, description) in events.items():
+            phrases += event_phrases(event_id, title, description)
+        self.run_blocking('tts', tts_cache.render_missing, phrases, self.get_voice_engine)
+
+    def prepare_audio(self):
+        '''
+        Waits for the sound card in the background, then decodes the alarm sounds into memory and starts watching the alarm folder, so the first alarm doesn't pay for any of it
+        '''
+        with boot_timer.phase('audio'):
+            mixer = wait_until_ready("Audio device", lambda: self.speaker.mixer)
+        if mixer:
+            with boot_timer.phase('alarm_preload'):
+                self.speaker.preload().result() # Decoded by the audio worker, which owns the mixer
+        self.speaker.library.start_watcher()
+
+    def notify(self):
+        '''
+        Wakes the alarm lane to re-evaluate the alarm state, safe to call from any thread
+        '''
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.state_changed.set)
+
+    async def run(self):
+        '''
+        Starts every lane and runs until cancelled
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.state_changed = asyncio.Event() # Alarm globals changed: reminders processed, snooze pressed or web unlock entered
+        self.audio_queue = asyncio.Queue() # ('urgency', str) or ('announce', dict) commands
+        self.actuation_queue = asyncio.Queue() # ('buzzer' | 'vibration', bool, pattern or None) commands
+        self.run_blocking('audio', self.prepare_audio) # Queued ahead of any urgency change on the audio lane
+        self.display.start()
+        try:
+            await asyncio.gather(self.scheduling_lane(), self.alarm_lane(), self.clock_lane(),
+                                 self.audio_lane(), self.actuation_lane(), self.metrics_lane())
+        finally:
+            scheduler.wake() # Releases the db lane if it is blocked in scheduler.wait()
+            self.display.close()
+            for executor in self.executors.values():
+                executor.shutdown(wait=False)
+
+    async def scheduling_lane(self):
+        '''
+        Sleeps on the scheduler until a reminder is due (or the minute changes, to notice writes from the Flask server), then processes the due batch
+            Backs off if the batch couldn't be advanced, since its reminders stay due and scheduler.wait() would return at once
+        '''
+        retry_delay = RETRY_MIN_SECONDS
+        while True:
+            due = await self.run_db(scheduler.wait, seconds_until_next_minute())
+            if not due:
+                continue
+            with lane_iteration_time.time(lane='scheduling'):
+                logger.debug("Processing reminders")
+                with reminder_batch_time.time():
+                    advanced = await self.run_db(process_event_reminders, urgency_comparator) # Wakes the alarm lane through the alarm state
+                scheduler.notify() # Processed reminders were advanced or locked, so the heap is stale
+            if advanced:
+                retry_delay = RETRY_MIN_SECONDS
+            else:
+                logger.warning("Due reminders weren't all advanced, retrying in %s s", retry_delay)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, RETRY_MAX_SECONDS)
+
+    async def alarm_lane(self):
+        '''
+        Re-evaluates the alarm whenever the alarm globals change and forwards commands to the display, audio and actuation lanes
+            Mirrors the former alarm loop: runs while the alarm is triggered or the web unlock flag is set, then disengages every device and announces the events
+        '''
+        while True:
+            await self.state_changed.wait()
+            self.state_changed.clear()
+            with lane_iteration_time.time(lane='alarm'):
+                current = state.snapshot()
+                try:
+                    if current.trigger or get_web_unlock():
+                        self.alarm_active = True
+                        await self.update_alarm(current)
+                    elif self.alarm_active:
+                        self.alarm_active = False
+                        await self.end_alarm(current)
+                except Exception as ex: # An escaping error would end asyncio.gather() and with it every lane, silencing all alarms
+                    logger.error("Error in the alarm lane, retrying in %s s: %s", RETRY_MIN_SECONDS, ex)
+                    self.loop.call_later(RETRY_MIN_SECONDS, self.state_changed.set)
+
+    async def update_alarm(self, current):
+        '''
+        Applies a snapshot of the alarm state: arms the web unlock, escalates the speaker and starts the buzzer and vibration
+        '''
+        options = current.options
+        logger.info("Alarm update", extra={'fields': {'trigger': current.trigger, 'web_unlock': get_web_unlock(), 'urgency': current.urgency}})
+        if options["web_unlock"] and not current.web_unlock_key_set:
+            logger.info("Web lock enabled, generating new web unlock key")
+            random_string = await self.run_blocking('io', set_web_unlock, True)
+            if random_string is None: # set_web_unlock() logged the error, the key is generated again on the next pass
+                self.loop.call_later(RETRY_MIN_SECONDS, self.state_changed.set)
+            else:
+                split_strings = textwrap.wrap(random_string, 16)
+                self.display.show((split_strings[0], split_strings[1], 0), UNLOCK) # Backlight off so the key has to be read closely
+        if current.web_unlock_key_set and not get_web_unlock(): # Only clears state once, after the key was entered
+            logger.debug("Disabling web unlock in file")
+            await self.run_blocking('io', set_web_unlock, False)
+        if current.urgency != 'None' and current.urgency != None:
+            if urgency_comparator[current.urgency] > urgency_comparator[self.speaker.urgency]:
+                logger.info("Updating speaker urgency to %s", current.urgency)
+                self.audio_queue.put_nowait(('urgency', current.urgency))
+        if options['buzzer']:
+            self.actuation_queue.put_nowait(('buzzer', True, options['pattern'] or options['buzzer'])) # A custom pattern, else the named pattern of the buzzer setting
+        if options['vibration']:
+            self.actuation_queue.put_nowait(('vibration', True, options['pattern']))
+        if current.events:
+            self.prerender(current.events)
+
+    async def end_alarm(self, current):
+        '''
+        Disengages all active devices, shows and announces the triggered events, then resets the alarm state
+            The devices were normally already silenced by silence() from the snooze button thread, stopping them again is harmless
+        '''
+        events = current.events
+        logger.info("Alarm terminated, %s events triggered", len(events))
+        self.actuation_queue.put_nowait(('vibration', False, None))
+        self.actuation_queue.put_nowait(('buzzer', False, None))
+        self.audio_queue.put_nowait(('urgency', 'None'))
+        self.display.clear(UNLOCK)
+        if events:
+            self.display.show((f"{len(events)} Events", '', 1), STATUS)
+            self.audio_queue.put_nowait(('announce', events))
+        await self.run_blocking('io', reset)
+
+    def silence(self):
+        '''
+        Stops the buzzer, vibration motor and alarm sound from the snooze button's callback thread after a press cleared the trigger, then records the press to silence latency
+            Skipped while the web unlock key still has to be entered, since both are needed to stop such an alarm
+            The pins are switched off synchronously by the PatternEngine; the speaker's halt is waited for on its audio worker, which applies it within milliseconds
+        '''
+        pressed_at = state.take_press()
+        if pressed_at is None or get_web_unlock():
+            return
+        self.buzzer.stop()
+        self.vibration.stop()
+        self.speaker.update_urgency('None')
+        if self.speaker.sync(timeout=1):
+            latency = time.perf_counter() - pressed_at
+            snooze_latency.observe(latency)
+            logger.info("Alarm silenced %.1fms after the snooze press", latency * 1000)
+
+    async def clock_lane(self):
+        '''
+        Updates the current time and date at every minute boundary
+            The clock is the lowest priority frame, so it stays current underneath the web unlock key and the event count and reappears as soon as they are cleared
+        '''
+        while True:
+            with lane_iteration_time.time(lane='clock'):
+                today = clock.today()
+                current_time = clock.now().strftime("%I:%M %p")
+                current_date = today.strftime("%B %d, '%y")
+                logger.debug("Current time: %s, current date: %s", current_time, current_date)
+                self.display.show((current_time, current_date, 1), CLOCK)
+            await asyncio.sleep(seconds_until_next_minute())
+
+    def draw(self, frame):
+        '''
+        Writes a frame to the LCD, called by the display thread only
+        '''
+        write_frame(frame)
+        dropped = self.display.frames_dropped
+        lcd_frames_dropped.inc(dropped - self.frames_dropped)
+        self.frames_dropped = dropped
+        if 'first_clock_display' not in boot_timer.marks:
+            boot_timer.mark('first_clock_display')
+            boot_timer.report()
+
+    async def audio_lane(self):
+        '''
+        Hands alarm sound changes to the speaker's audio worker and speaks announcements on the tts executor
+        '''
+        while True:
+            command, argument = await self.audio_queue.get()
+            with lane_iteration_time.time(lane='audio'):
+                if command == 'urgency':
+                    self.speaker.update_urgency(argument) # Only queues the change for the audio worker
+                elif command == 'announce':
+                    await self.announce(argument)
+
+    async def announce(self, events):
+        '''
+        Reads out the number of triggered events and the details of each, then hands the display back to the clock
+        '''
+        self.speaker.duck(ANNOUNCEMENT_DUCK)
+        await self.run_blocking('tts', self.say, count_phrase(len(events)))
+        for event_id, (title, description) in events.items():
+            for phrase in event_phrases(event_id, title, description):
+                await self.run_blocking('tts', self.say, phrase)
+            await asyncio.sleep(3)
+        self.speaker.duck(1.0)
+        self.display.clear(STATUS)
+
+    async def actuation_lane(self):
+        '''
+        Starts, re-patterns and stops the buzzer and vibration motor
+            Called directly on the event loop: the PatternEngine only toggles a pin and wakes its timer thread, so this never blocks
+        '''
+        devices = {'buzzer': self.buzzer, 'vibration': self.vibration}
+        while True:
+            device, on, pattern = await self.actuation_queue.get()
+            with lane_iteration_time.time(lane='actuation'):
+                if on:
+                    devices[device].start(pattern)
+                else:
+                    devices[device].stop()
+
+    async def metrics_lane(self):
+        '''
+        Publishes a snapshot of the metrics registry to app.py, which serves it at /metrics
+            A single non-blocking datagram, dropped if the Flask server isn't running
+        '''
+        while True:
+            with lane_iteration_time.time(lane='metrics'):
+                unlock_channel.send('metrics', metrics.to_json())
+            await asyncio.sleep(METRICS_INTERVAL)
+
+def write_frame(frame):
+    '''
+    Writes a (line 1, line 2, backlight) frame to the LCD, blocking for the duration of the I2C writes
+        Only the cells that differ from the previous frame are sent; a failed write makes the next frame redraw everything
+        Does nothing if the LCD never answered its readiness probe
+    '''
+    if lcd_screen is None:
+        return
+    line_1, line_2, backlight = frame
+    saved = lcd_screen.transactions_saved
+    with lcd_write_time.time():
+        try:
+            written = lcd_screen.show((line_1, line_2), backlight)
+        except Exception:
+            lcd_screen.invalidate()
+            raise
+    lcd_transactions.inc(written)
+    lcd_transactions_saved.inc(lcd_screen.transactions_saved - saved)
+
+def record_alarm_start(latency, preloaded):
+    '''
+    Speaker.on_started callback, records the time from starting an alarm sound to it playing
+    '''
+    alarm_start_time.observe(latency, preloaded=preloaded)
+    logger.info("Alarm sound started in %.1fms (preloaded: %s)", latency * 1000, preloaded)
+
+def record_audio_command(command, latency):
+    '''
+    Speaker.on_command callback, records how long each audio command waited for and took on the audio worker
+    '''
+    audio_command_time.observe(latency, command=command)
+
+def notify_state_changed():
+    '''
+    Wakes the alarm lane of the running AlarmRuntime, if any, from any thread
+    '''
+    if runtime is not None:
+        runtime.notify()
+
+def init_devices():
+    '''
+    Function: Opens the LCD as soon as the I2C bus answers, then the snooze button, buzzer and vibration motor
+        Without an LCD the alarm still runs, with the display disabled
+    Returns:
+        buzzer (Buzzer), vibration (Vibration)
+    '''
+    global lcd_screen, snooze_button
+    with boot_timer.phase('i2c'):
+        bus = wait_until_ready("I2C bus", lambda: probe_i2c(backend, I2CBUS, LCD_ADDRESS))
+        if bus:
+            lcd_screen = FramebufferLCD(lcd(bus=bus))
+        else:
+            logger.error("LCD unavailable, running without a display")
+    with boot_timer.phase('gpio'):
+        snooze_button = backend.button(23)
+        snooze_button.when_pressed = snooze_button_press
+        return Buzzer(backend=backend), Vibration(backend=backend)
+
 def main():
     '''
-    Tentative looping event/reminder checker that queries active events at regular intervals and triggers alarms if the events are active and at least one of the reminders is in the past.
-        It accumulates the flags of all of the triggered reminders as new ones are discovered and only pulls down the flags when the alarm unlock conditions are met
+    Initializes the database, alarm globals and devices, then runs the AlarmRuntime lanes until interrupted
+        Each dependency is probed until it is ready instead of sleeping for a fixed time; audio and text to speech are initialized in the background
+        The runtime accumulates the flags of all of the triggered reminders as new ones are discovered and only pulls down the flags when the alarm unlock conditions are met
     '''
-    with app.app_context(): # Manually create app context in the absence of Flask routes so that the app doesn't have to be destroyed and recreated for every check
-        print("\n\n\nINITIALIZING MAIN SCRIPT")
+    global runtime
+    boot_timer.mark('imports')
+    with boot_timer.phase('database'), app.app_context(): # Executor threads push their own contexts, this one covers start up
+        logger.info("Initializing main script")
+        wait_until_ready("Database", lambda: probe_database(db.engine))
+        db.create_all()
+        run_migrations(db.engine) # The Flask server may not have started yet, so the schema is brought up to date here too
+        instrument_database(metrics, db.engine, db.session)
         initialize_globals()
-        urgency_comparator = { None : 0,
-                            'None' : 0, #  Means of quantifying/comparing urgency
-                            'Not at all' : 1,
-                            'Somewhat' : 2,
-                            'Urgent' : 3,
-                            'Very' : 4,
-                            'Extremely' : 5}
-        buzzer = Buzzer()
-        speaker = Speaker('None')
-        vibration = Vibration() # Preemptively create objects associated with each alarm function so that they can be used in the control structures of the loop before being declared as rpi_models objects
-        voice_engine = pyttsx3.init(driverName="espeak")
-        while True:
-            # Displaying current date and time on LCD
-            lcd_screen.lcd_clear()
-            lcd_screen.backlight(1)
-            today = date.today()
-            time = datetime.now()
-            current_time = str(time.strftime("%I:%M %p"))
-            print(f"CURRENT TIME: {current_time}")
-            current_date = str(today.strftime("%B %d, '%y"))
-            print(f"CURRENT DATE {current_date}")
-            lcd_screen.lcd_display_string(current_time, 1)
-            lcd_screen.lcd_display_string(current_date, 2)
-            
-            # Initiating main loop
-            print("MAIN LOOP START")
-            print("PROCESSING REMINDERS")
-            process_event_reminders(urgency_comparator) # Process event reminders and adjust event dictionary
-            while alarm_trigger or get_web_unlock():               
-                print("ALARM LOOP START")
-                today = date.today()
-                time = datetime.now()
-                current_time = str(time.strftime("%I:%M %p"))
-                print(f"CURRENT TIME: {current_time}")
-                current_date = str(today.strftime("%B %d, '%y"))
-                print(f"CURRENT DATE: {current_date}")
-
-                # Time/date pauses on screen as long as alarm is going off
-                print(f"CURRENT ALARM_TRIGGER: {alarm_trigger}")
-                print(f"CURRENT WEB_UNLOCK FLAG: {get_web_unlock()}")
-                # Web unlock handling
-
-                print("CHECKING WEB UNLOCK")
-                if options_dict["web_unlock"]:
-                    if not web_unlock_key_set:
-                        print("WEB LOCK ENABLED")
-                        print("GENERATING NEW WEB UNLOCK KEY")
-                        set_web_unlock(True)
-                        print(f"WEB UNLOCK KEY: {get_from_file('unlock.txt')}")
-                        print("PROCESSING EVENT REMINDERS")
-                        process_event_reminders(urgency_comparator)
-                        random_string = set_web_unlock(options_dict['web_unlock'])
-                        split_strings = textwrap.wrap(random_string, 16)
-                        lcd_screen.lcd_display_string(split_strings[0], 1)
-                        lcd_screen.lcd_display_string(split_strings[1], 2)
-                        lcd_screen.backlight(0)
-                        web_unlock_key_set
-                    print(f"CURRENT WEB_UNLOCK KEY: {get_from_file('unlock.txt')}")
-                if not get_web_unlock():
-                    print("NO LOCK FOUND")
-                    print("DISABLING WEB UNLOCK IN FILE")
-                    set_web_unlock(False)
-                # Audio alarm handling
-                print("CHECKING FOR CURRENT URGENCY")
-                if current_urgency != 'None' and current_urgency != None:
-                    print(f"CURRENT URGENCY: {current_urgency}")
-                    if urgency_comparator[current_urgency] > urgency_comparator[speaker.urgency]:
-                        print(f"CURRENT URGENCY {current_urgency} GREATER THAN SPEAKER URGENCY {speaker.urgency}")
-                        print(f"UPDATING CURRENT URGENCY TO {current_urgency}")
-                        speaker.update_urgency(current_urgency)
-                
-                # Buzzer handling
-                print("CHECKING FOR BUZZER")
-                if options_dict['buzzer']:
-                    print("BUZZER OPTION ENABLED")
-                    buzzer.start()
-
-                # Vibration handling    
-                print("CHECKING FOR VIBRATION")
-                if options_dict['vibration']:
-                    print("VIBRATION ENABLED")
-                    vibration.start()
-
-                # Processing event reminders before next loop
-                print("PROCESSING EVENT REMINDERS")
-                process_event_reminders(urgency_comparator)
-                
-                # Sleep statement between checks
-                print("WAITING FOR LOOP")
-                sleep(15)
-                print("END OF ALARM LOOP")
-            else:
-                # Disengage all active devices/protocols
-                print("ALARM LOOP TERMINATED")
-                vibration.stop()
-                buzzer.stop()
-                speaker.update_urgency('None')
-                number_of_events = len(current_events_dict)
-                lcd_screen.backlight(1)
-                if number_of_events > 0:
-                    lcd_screen.lcd_clear()
-                    lcd_screen.lcd_display_string(f"{number_of_events} Events" , 1)
-                    speak(f'You have {number_of_events} events currently', voice_engine)
-                    print(f"DISPLAYING: {number_of_events} # Number of events")
-                    for keys in current_events_dict:
-                        speak(f"Event number {keys}", voice_engine)
-                        speak(str(current_events_dict[keys][0]), voice_engine)
-                        speak(str(current_events_dict[keys][1]), voice_engine)
-                        sleep(3)
-                reset()
-            sleep(5)
+        start_unlock_channel()
+    buzzer, vibration = init_devices()
+    runtime = AlarmRuntime(buzzer, vibration, Speaker('None', backend=backend, on_started=record_alarm_start, on_command=record_audio_command))
+    try:
+        asyncio.run(runtime.run())
+    except BaseException:
+        logger.critical("Main loop stopped, dumping recent log records", exc_info=True)
+        ring_buffer.dump() # Post-mortem: the records leading up to the failure
+        raise
 
 if __name__ == '__main__':
     main()
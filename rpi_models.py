@@ -1,196 +1,386 @@
-import os, random, time, pygame, threading
-from gpiozero import LED, Buzzer as GPIOBuzzer
+import queue, time, threading
+from concurrent.futures import Future
+from backends import get_backend
+from alarm_library import AlarmLibrary
+from log import get_logger
 
-class Buzzer: # active piezoelectric buzzer for droning alarm sound
+logger = get_logger('rpi_models')
+
+DEFAULT_PATTERN = (1.0, 1.5) # Seconds on, seconds off, the original buzz/vibrate rhythm
+PATTERNS = { # Named patterns, keyed by the buzzer setting submitted with a reminder
+    'Quiet': (0.1, 1.9),
+    'Moderate': (0.5, 1.0),
+    'Loud': (1.0, 0.25),
+    'Ascending': (0.1, 1.0, 0.25, 0.75, 0.5, 0.5, 1.0, 0.25),
+}
+MAX_PATTERN_STEPS = 32
+
+def parse_pattern(spec):
+    '''
+    Function: Converts a pattern into alternating on/off durations
+    Args:
+        spec (str | tuple | None), a PATTERNS name, comma separated milliseconds alternating on and off ("500,250,500,1000"), or durations in seconds
+    Returns:
+        pattern (tuple) of seconds with an even number of steps, or None if spec is empty or invalid
+    '''
+    if not spec:
+        return None
+    if isinstance(spec, str):
+        if spec in PATTERNS:
+            return PATTERNS[spec]
+        try:
+            spec = tuple(int(step) / 1000 for step in spec.replace(' ', '').split(','))
+        except ValueError:
+            return None
+    pattern = tuple(spec)
+    if not pattern or len(pattern) % 2 or len(pattern) > MAX_PATTERN_STEPS or any(step <= 0 for step in pattern):
+        return None
+    return pattern
+
+class PatternEngine:
     def __init__(self):
+        '''
+        Initializes the PatternEngine object
+            Plays looping on/off patterns on any number of output devices from a single timer thread
+            The thread sleeps on a condition variable until the next scheduled toggle, so start() and stop() wake it immediately instead of waiting out a sleep
+            stop() switches the device off on the caller's thread before returning
+        '''
+        self.channels = {} # name -> [device, pattern, step index, time of the next toggle]
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def play(self, name, device, pattern):
+        '''
+        Starts (or switches to) pattern on device under name, the first step takes effect before returning
+        '''
+        with self.condition:
+            channel = self.channels.get(name)
+            if channel and channel[1] == pattern:
+                return
+            device.on()
+            self.channels[name] = [device, pattern, 0, time.monotonic() + pattern[0]]
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='pitime-gpio', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def stop(self, name):
+        '''
+        Stops the pattern playing under name and switches its device off before returning
+        '''
+        with self.condition:
+            channel = self.channels.pop(name, None)
+            if channel:
+                channel[0].off()
+                self.condition.notify()
+
+    def active(self, name):
+        with self.condition:
+            return name in self.channels
+
+    def run(self):
+        '''
+        Timer thread, toggles each device whose step has elapsed then sleeps until the earliest next toggle
+        '''
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                for channel in self.channels.values():
+                    device, pattern, index, due = channel
+                    while due <= now: # Catches up if the thread was delayed, without replaying missed toggles
+                        index = (index + 1) % len(pattern)
+                        due += pattern[index]
+                    if index != channel[2]:
+                        try:
+                            if index % 2 == 0: # Even steps are on, odd steps off
+                                device.on()
+                            else:
+                                device.off()
+                        except Exception as ex:
+                            logger.error("Error in PatternEngine toggling %s: %s", device, ex)
+                        channel[2] = index
+                    channel[3] = due # Also when whole cycles were skipped and the step is unchanged, or the wait below never sleeps
+                timeout = min((channel[3] for channel in self.channels.values()), default=now + 3600) - now
+                self.condition.wait(max(timeout, 0))
+
+_engine = None
+
+def get_engine():
+    '''
+    Returns the PatternEngine shared by every Buzzer and Vibration in the process
+    '''
+    global _engine
+    if _engine is None:
+        _engine = PatternEngine()
+    return _engine
+
+class Buzzer: # active piezoelectric buzzer for droning alarm sound
+    def __init__(self, pin=17, backend=None, engine=None):
         '''
         Initializes Buzzer object
             Utilizes gpiozero driver for an active piezoelectric buzzer to add a beeping sound to the alarm
-            Utilizes threading to permit background control and a lock for thread safety
+            The beeping rhythm is played by the shared PatternEngine, so starting and stopping never blocks on a sleeping thread
         Args:
-            pin (int), GPIO pin number assigned to the vibration module        
+            pin (int), GPIO pin number assigned to the buzzer
+            backend (HardwareBackend | SimulatedBackend), device factory, defaults to backends.get_backend()
+            engine (PatternEngine), defaults to get_engine()
         '''
-        self.buzzer = GPIOBuzzer(17)
-        self.buzzing = False
-        self.thread = None
-        self.lock = threading.Lock()
+        self.buzzer = (backend or get_backend()).output(pin, 'buzzer')
+        self.engine = engine or get_engine()
+        self.name = f"buzzer{pin}"
 
-    def start(self):
+    @property
+    def buzzing(self):
+        return self.engine.active(self.name)
+
+    def start(self, pattern=None):
         '''
-        Starts buzzing sequence, self.buzz in its own thread
-            Initializes thread then starts self.vibrate function
+        Starts buzzing with pattern (see parse_pattern()), or switches to it if already buzzing
         '''
-        with self.lock:
-            try:
-                if not self.buzzing:
-                    self.buzzing = True
-                    self.thread = threading.Thread(target=self.buzz) # Opens buzz function in its own thread
-                    self.thread.start()
-            except Exception as ex:
-                print(f"Error in Buzzer start method: {ex}")
+        try:
+            self.engine.play(self.name, self.buzzer, parse_pattern(pattern) or DEFAULT_PATTERN)
+        except Exception as ex:
+            logger.error("Error in Buzzer start method: %s", ex)
 
     def stop(self):
         '''
-        Stops buzzing sequence
-            Closes thread and takes down buzzing flag
-        '''        
-        with self.lock:
-            try:
-                if self.buzzing:
-                    self.buzzing = False
-                    self.buzzer.off()
-                    self.thread.join() # Terminates all current threads related to this object
-            except Exception as ex:
-                print(f"Error in Buzzer stop method: {ex}")
-
-    def buzz(self):
-        while self.buzzing:
-            self.buzzer.on()
-            # print("BUZZING ON")
-            time.sleep(1)
-            self.buzzer.off()
-            # print("BUZZING OFF")
-            time.sleep(1.5)
+        Stops buzzing, the buzzer is off when this returns
+        '''
+        try:
+            self.engine.stop(self.name)
+        except Exception as ex:
+            logger.error("Error in Buzzer stop method: %s", ex)
 
 class Vibration: # 5V vibration module driven by a transistor and 3.3V logic
-    def __init__(self):
+    def __init__(self, pin=25, backend=None, engine=None):
         '''
-        Initializes the Vibration object
+        Initializes Vibration object
             Sets up a gpiozero LED instance that triggers a high power mosfet to activate a 5V ERM vibration motor
-            Utilizes threading to permit background control and a lock for thread safety
+            The vibration rhythm is played by the shared PatternEngine, so starting and stopping never blocks on a sleeping thread
         Args:
             pin (int), GPIO pin number assigned to the vibration module
+            backend (HardwareBackend | SimulatedBackend), device factory, defaults to backends.get_backend()
+            engine (PatternEngine), defaults to get_engine()
         '''
-        self.vibration = LED(25)
-        self.vibrating = False
-        self.thread = None
-        self.lock = threading.Lock()
+        self.vibration = (backend or get_backend()).output(pin, 'led')
+        self.engine = engine or get_engine()
+        self.name = f"vibration{pin}"
 
-    def start(self):
-        '''
-        Starts vibration sequence, self.vibrate in its own thread
-            Initializes thread then starts self.vibrate function
-        '''
-        with self.lock:
-            try:
-                if not self.vibrating:
-                    self.vibrating = True
-                    self.thread = threading.Thread(target=self.vibrate)
-                    self.thread.start()
-            except Exception as ex:
-                print(f"Error in Vibration start method: {ex}")
+    @property
+    def vibrating(self):
+        return self.engine.active(self.name)
 
-    def stop(self):
+    def start(self, pattern=None):
         '''
-        Stops vibration sequence
-            Closes thread and takes down vibrating flag
+        Starts vibrating with pattern (see parse_pattern()), or switches to it if already vibrating
         '''
-        with self.lock:
-            try:
-                if self.vibrating:
-                    self.vibrating = False
-                    self.thread.join()
-                    self.vibration.off()
-            except Exception as ex:
-                print(f"Error in Vibration.stop method: {ex}")
+        try:
+            self.engine.play(self.name, self.vibration, parse_pattern(pattern) or DEFAULT_PATTERN)
+        except Exception as ex:
+            logger.error("Error in Vibration start method: %s", ex)
 
-    def vibrate(self):
+    def stop(self):
         '''
-        Controls gpiozero driver, turning vibration motor on and off as long as self.vibrating is True
+        Stops vibrating, the motor is off when this returns
         '''
-        while self.vibrating:
-            self.vibration.on()
-            # print("VIBRATING ON")
-            time.sleep(1)
-            self.vibration.off()
-            # print("VIBRATING OFF")
-            time.sleep(1.5)
+        try:
+            self.engine.stop(self.name)
+        except Exception as ex:
+            logger.error("Error in Vibration.stop method: %s", ex)
 
 class Speaker:
-    def __init__(self, urgency='None'):
+    def __init__(self, urgency='None', backend=None, library=None, on_started=None, on_command=None):
         """
-        Initializes the Speaker object. Originally used Sound object but switched to music for mp3 compatibility
+        Initializes the Speaker object. Plays alarms preloaded as decoded Sound objects by the AlarmLibrary, streaming with music (mp3 compatible) the ones that didn't fit its memory budget
+        Every mixer call happens on one long-lived worker thread that applies play/stop/escalate/duck/clip commands from a queue in order, so callers never block on the mixer or race each other for it
         Args:
             urgency (str): The urgency level for which to select a random alarm, the default of which is None.
+            backend (HardwareBackend | SimulatedBackend): device factory, defaults to backends.get_backend()
+            library (AlarmLibrary): index of the alarm sounds, a new one over alarms/ by default
+            on_started (callable): called with (latency in seconds, preloaded) each time an alarm starts playing
+            on_command (callable): called with (command, latency in seconds) once each command has been applied
         """
-        pygame.mixer.init()
-        self.playing = False
+        self.backend = backend or get_backend()
+        self._mixer = None # Initialized on first use, see the mixer property
+        self.mixer_lock = threading.Lock()
+        self.library = library or AlarmLibrary()
+        self.on_started = on_started
+        self.on_command = on_command
+        self.playing = False # State as last requested by the caller, the worker catches up in order
         self.urgency = urgency
+        self.volume = 1.0 # Alarm volume, lowered by duck()
+        self.sound = None # Decoded Sound currently looping, None while streaming with music (worker thread only)
+        self.latency = None # Seconds from the last play/escalate command to the alarm playing
+        self.commands = queue.Queue() # (command, argument, time.perf_counter() when queued, Future or None)
         self.thread = None
         self.lock = threading.Lock()
 
-    def start(self):
+    @property
+    def mixer(self):
         """
-        Starts playing a random alarm from the specified urgency level.
-        Initializes thread and sets self.playing flag to True.
+        pygame.mixer, initialized the first time it is needed so pygame isn't loaded until audio is actually used
+            Raises while the sound card isn't ready yet; the next access tries again
+        """
+        with self.mixer_lock:
+            if self._mixer is None:
+                self._mixer = self.backend.mixer()
+            return self._mixer
+
+    def submit(self, command, argument=None, future=None):
+        """
+        Queues a command for the worker thread, starting the thread on first use. Never blocks.
         """
         with self.lock:
-            if self.urgency != 'None':
-                if not self.playing:
-                    try:
-                        self.playing = True
-                        self.thread = threading.Thread(target=self.play_loop)
-                        self.thread.start()
-                    except Exception as ex:
-                        print(f"Error in Speaker.start: {ex}")
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, name='pitime-audio', daemon=True)
+                self.thread.start()
+        self.commands.put((command, argument, time.perf_counter(), future))
+        return future
 
-    def play_loop(self):
+    def start(self):
         """
-        Plays the selected alarm sound in a loop.
-        Can be disengaged at any time within a 0.1 second interval if the call to close the thread is made.
+        Starts playing a random alarm from the specified urgency level.
         """
-        try:
-            alarm_file = self.select_random_alarm()
-            print(f"\n\n\n ATTEMPTING TO PLAY: {alarm_file} \n\n\n")
-            if alarm_file:
-                pygame.mixer.music.load(alarm_file)
-                pygame.mixer.music.play(-1)  # Set the number of repeats to -1 for indefinite looping
-        except Exception as ex:
-            print(f"Error in Speaker.play_loop: {ex}")
+        with self.lock:
+            if self.urgency == 'None' or self.playing:
+                return
+            self.playing = True
+        self.submit('play', self.urgency)
 
     def stop(self):
         """
         Stops the currently playing sound.
-        Closes thread and takes down self.playing flag.
         """
-        try:
-            with self.lock:
-                if self.playing:
-                    print("\n\n\n HALTING PLAYBACK \n\n\n")
-                    pygame.mixer.music.stop()
-                    self.playing = False
-                    if self.thread:
-                        self.thread.join()
-        except Exception as ex:
-            print(f"Error in Speaker.stop: {ex}")
+        with self.lock:
+            if not self.playing:
+                return
+            self.playing = False
+        self.submit('stop')
 
-    def select_random_alarm(self):
+    def update_urgency(self, new_urgency):
         """
-        Selects a random alarm file from the directory associated with the alarm's urgency.
+        Switches to a sound of the new urgency in a single command, silencing the alarm for 'None'.
+        """
+        with self.lock:
+            self.urgency = new_urgency
+            self.playing = new_urgency not in (None, 'None')
+        self.submit('escalate', new_urgency)
 
+    def duck(self, level):
+        """
+        Sets the alarm volume to level (0.0 to 1.0) of full volume, i.e. while an announcement plays; duck(1.0) restores it.
+        """
+        self.submit('duck', level)
+
+    def play_clip(self, path):
+        """
+        Plays a short clip (i.e. a cached announcement) over any alarm
         Returns:
-            str: The path to the selected alarm file, or None if no valid alarm is found.
+            Future resolving to the clip's length in seconds once it has started
         """
-        try:
-            script_directory = os.path.dirname(os.path.abspath(__file__))
-            alarm_dir = os.path.join(script_directory, 'alarms', self.urgency)
-            print(f"\n\n\nFolder for {self.urgency} playback selected: {alarm_dir}\n\n\n")
-            if os.path.isdir(alarm_dir):
-                alarm_files = os.listdir(alarm_dir)
-                if alarm_files:
-                    print(f"\n\n\nRETURNING ALARM PATH: {os.path.join(alarm_dir, random.choice(alarm_files))}\n\n\n")
-                    return os.path.join(alarm_dir, random.choice(alarm_files))
-            
-            return None
-        except Exception as ex:
-            print(f"Error in Speaker.select_random_alarm: {ex}")
-    
-    def update_urgency(self, new_urgency):
+        return self.submit('clip', path, Future())
+
+    def preload(self):
+        """
+        Decodes the library's sounds into memory on the worker thread, and again whenever the library notices its folders changed
+        Returns:
+            Future resolving to the bytes of decoded audio held (int)
+        """
+        self.library.decoder = lambda: self.submit('preload')
+        return self.submit('preload', None, Future())
+
+    def sync(self, timeout=None):
         """
-        Updates the urgency and starts playing the new audio.
+        Blocks until every command queued so far has been applied, for tests and shutdown.
+        """
+        done = threading.Event()
+        self.submit('sync', done)
+        return done.wait(timeout)
+
+    def close(self):
+        """
+        Stops the alarm and ends the worker thread after the commands already queued.
         """
         self.stop()
-        self.urgency = new_urgency
-        self.start()
+        if self.thread is not None:
+            self.submit('close')
+            self.thread.join()
+            self.thread = None
+
+    def work(self):
+        """
+        Worker thread, applies commands in the order they were queued and reports how long each waited plus ran.
+        """
+        while True:
+            command, argument, queued, future = self.commands.get()
+            try:
+                if command == 'close':
+                    return
+                elif command == 'sync':
+                    argument.set()
+                elif command in ('play', 'escalate'):
+                    self.halt()
+                    if argument not in (None, 'None'):
+                        self.play_alarm(argument, queued)
+                elif command == 'stop':
+                    self.halt()
+                elif command == 'duck':
+                    self.volume = argument
+                    if self.sound is not None:
+                        self.sound.set_volume(argument)
+                    else:
+                        self.mixer.music.set_volume(argument)
+                elif command == 'preload':
+                    decoded_bytes = self.library.preload(self.mixer)
+                    if future is not None:
+                        future.set_result(decoded_bytes)
+                elif command == 'clip':
+                    clip = self.mixer.Sound(argument)
+                    clip.play()
+                    future.set_result(clip.get_length())
+                if self.on_command and command != 'sync':
+                    self.on_command(command, time.perf_counter() - queued)
+            except Exception as ex:
+                logger.error("Error in Speaker.work applying %s: %s", command, ex)
+                if future is not None and not future.done():
+                    future.set_exception(ex)
 
+    def play_alarm(self, urgency, queued):
+        """
+        Loops a sound for urgency (worker thread only). A preloaded sound starts without touching the disk; otherwise the file is streamed with music, which has to open and decode it first.
+        """
+        alarm_file, sound = self.library.choose(urgency)
+        logger.debug("Playing %s (preloaded: %s)", alarm_file, sound is not None)
+        if sound is not None:
+            sound.set_volume(self.volume)
+            sound.play(loops=-1)  # Set the number of repeats to -1 for indefinite looping
+            self.sound = sound
+        elif alarm_file:
+            self.mixer.music.load(alarm_file)
+            self.mixer.music.set_volume(self.volume)
+            self.mixer.music.play(-1)
+        if alarm_file:
+            self.latency = time.perf_counter() - queued
+            if self.on_started:
+                self.on_started(self.latency, sound is not None)
+
+    def halt(self):
+        """
+        Stops whatever alarm is playing (worker thread only).
+        """
+        if self.sound is not None:
+            logger.debug("Halting playback")
+            self.sound.stop()
+            self.sound = None
+        elif self._mixer is not None and self._mixer.music.get_busy():
+            logger.debug("Halting playback")
+            self._mixer.music.stop()
 
+    def select_random_alarm(self):
+        """
+        Selects a random alarm file for the speaker's urgency from the library index, without listing the folder.
+
+        Returns:
+            str: The path to the selected alarm file, or None if no valid alarm is found.
+        """
+        return self.library.choose(self.urgency)[0]
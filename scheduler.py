@@ -0,0 +1,125 @@
+import heapq, os, threading
+import clock
+from models import db, Reminder
+from log import get_logger
+
+logger = get_logger('scheduler')
+
+class ReminderScheduler:
+    def __init__(self, horizon=64, resync_interval=300):
+        '''
+        Initializes the ReminderScheduler object
+            Keeps the upcoming reminders in a min-heap keyed on Reminder.date_time so the main loop can sleep until the earliest one is due instead of polling the database
+            Utilizes a condition variable so other threads (button callbacks, listeners) can wake the scheduler early when reminders are added or removed
+        Args:
+            horizon (int), maximum number of upcoming reminders held in the heap at once
+            resync_interval (int), seconds after which the heap is reloaded even if no change has been detected
+        '''
+        self.horizon = horizon
+        self.resync_interval = resync_interval
+        self.heap = [] # (date_time, reminder.id) tuples, earliest reminder at heap[0]
+        self.dirty = True # Forces a load on the first call to wait()
+        self.last_sync = None
+        self.last_token = None
+        self.condition = threading.Condition()
+
+    def reload(self):
+        '''
+        Rebuilds the heap from the database using a single ordered query limited to the scheduling horizon
+            Must be called within an application context
+        '''
+        token = self.change_token() # Taken before the query so a write landing mid-query is picked up next time
+        rows = db.session.query(Reminder.date_time, Reminder.id)\
+            .filter(Reminder.reminder_lock == False)\
+            .order_by(Reminder.date_time).limit(self.horizon).all()
+        heap = [(row.date_time, row.id) for row in rows]
+        heapq.heapify(heap)
+        with self.condition:
+            self.heap = heap
+            self.dirty = False
+            self.last_sync = clock.now()
+            self.last_token = token
+        logger.debug("%s upcoming reminders, next due %s", len(heap), heap[0][0] if heap else None)
+
+    def change_token(self):
+        '''
+        Returns a cheap fingerprint of the SQLite database file (mtime and size of the file and its journal) used to notice writes made by the Flask server process
+            Returns None for in-memory databases, in which case only notify() and resync_interval apply
+        '''
+        path = db.engine.url.database
+        if not path or path == ':memory:':
+            return None
+        token = []
+        for candidate in (path, f"{path}-wal", f"{path}-journal"):
+            try:
+                stat = os.stat(candidate)
+                token.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                token.append(None)
+        return tuple(token)
+
+    def needs_reload(self):
+        '''
+        Determines if the heap is stale: flagged by notify(), past the resync interval, or the database file changed on disk
+        '''
+        if self.dirty or self.last_sync is None:
+            return True
+        if (clock.now() - self.last_sync).total_seconds() >= self.resync_interval:
+            return True
+        return self.change_token() != self.last_token
+
+    def notify(self):
+        '''
+        Marks the heap as stale and wakes any waiting thread, called whenever reminders are added, removed or advanced
+            Thread safe, does not touch the database
+        '''
+        with self.condition:
+            self.dirty = True
+            self.condition.notify_all()
+
+    def wake(self):
+        '''
+        Wakes any waiting thread without invalidating the heap, i.e. when the snooze button is pressed
+        '''
+        with self.condition:
+            self.condition.notify_all()
+
+    def next_due(self):
+        '''
+        Returns the date_time of the earliest upcoming reminder, or None if nothing is scheduled
+        '''
+        with self.condition:
+            return self.heap[0][0] if self.heap else None
+
+    def is_due(self, now=None):
+        '''
+        Returns True if the earliest reminder in the heap is due at the given time (defaults to now)
+        '''
+        now = now or clock.now()
+        next_due = self.next_due()
+        return next_due is not None and next_due <= now
+
+    def wait(self, timeout=None):
+        '''
+        Blocks until the earliest reminder is due, notify()/wake() is called, or timeout seconds pass
+            Reloads the heap before and after sleeping if it has gone stale
+            Must be called within an application context
+        Args:
+            timeout (float), maximum number of seconds to sleep, None to sleep until the next reminder or resync
+        Returns:
+            True if a reminder is due on return, False otherwise
+        '''
+        if self.needs_reload():
+            self.reload()
+        with self.condition:
+            if not self.dirty:
+                delay = self.resync_interval # Never sleep past the next forced resync
+                if timeout is not None:
+                    delay = min(delay, timeout)
+                if self.heap:
+                    delay = min(delay, (self.heap[0][0] - clock.now()).total_seconds())
+                if delay > 0:
+                    clock.wait(self.condition, delay) # Returns instantly on a VirtualClock
+        if self.needs_reload():
+            self.reload()
+        return self.is_due()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import wave
+from alarm_library import AlarmLibrary
+from backends import SimulatedBackend
+from rpi_models import Speaker
+
+class AlarmLibraryTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.add('Urgent', 'small.mp3', 16000) # 1 second at 128 kbps, 176400 bytes decoded by the simulated mixer
+        self.add('Urgent', 'large.mp3', 160000)
+        self.add('Very', 'only.mp3', 16000)
+        self.add('Very', 'notes.txt', 10)
+        self.backend = SimulatedBackend()
+        self.mixer = self.backend.mixer()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, urgency, name, size):
+        os.makedirs(os.path.join(self.directory, urgency), exist_ok=True)
+        with open(os.path.join(self.directory, urgency, name), 'wb') as file:
+            file.write(b'\0' * size)
+
+    def test_index_lists_audio_files_once(self):
+        library = AlarmLibrary(self.directory)
+        self.assertEqual(sorted(library.sounds), ['Urgent', 'Very'])
+        self.assertEqual(len(library.sounds['Urgent']), 2)
+        self.assertEqual(len(library.sounds['Very']), 1)
+        self.assertEqual(library.choose('Extremely'), (None, None))
+
+    def test_preload_respects_budget(self):
+        library = AlarmLibrary(self.directory, budget=400000)
+        used = library.preload(self.mixer)
+        self.assertLessEqual(used, 400000)
+        self.assertEqual(sorted(os.path.basename(path) for path in library.decoded), ['only.mp3', 'small.mp3'])
+        path, sound = library.choose('Urgent')
+        self.assertEqual(os.path.basename(path), 'small.mp3')
+        self.assertIsNotNone(sound)
+        self.assertEqual(self.backend.log.count('mixer', 'sound_decode'), 2) # large.mp3 was skipped on its file size, never decoded
+
+    def test_wav_length_is_read_from_the_header(self):
+        os.makedirs(os.path.join(self.directory, 'Extremely'))
+        with wave.open(os.path.join(self.directory, 'Extremely', 'tone.wav'), 'wb') as tone:
+            tone.setnchannels(1)
+            tone.setsampwidth(1)
+            tone.setframerate(8000)
+            tone.writeframes(b'\x80' * 8000) # One second, 176400 bytes once decoded to the mixer's 44.1 kHz stereo
+        library = AlarmLibrary(self.directory, budget=100000)
+        library.preload(self.mixer)
+        self.assertNotIn('tone.wav', [os.path.basename(path) for path in library.decoded])
+        self.assertNotIn(os.path.join(self.directory, 'Extremely', 'tone.wav'), [entry[3] for entry in self.backend.log.filter('mixer', 'sound_decode')])
+
+    def test_check_reindexes_after_change(self):
+        library = AlarmLibrary(self.directory)
+        speaker = Speaker(backend=self.backend, library=library)
+        threads = []
+        preload = library.preload
+        def record_thread(mixer):
+            threads.append(threading.current_thread().name)
+            return preload(mixer)
+        library.preload = record_thread
+        self.assertGreater(speaker.preload().result(timeout=5), 0)
+        self.assertFalse(library.check())
+        self.add('Extremely', 'new.mp3', 16000)
+        self.assertTrue(library.check())
+        speaker.sync()
+        self.assertEqual(threads, ['pitime-audio', 'pitime-audio']) # Decoded by the worker that owns the mixer, never by the watcher
+        speaker.close()
+        path, sound = library.choose('Extremely')
+        self.assertEqual(os.path.basename(path), 'new.mp3')
+        self.assertIsNotNone(sound)
+
+    def test_speaker_plays_preloaded_sound_and_reports_latency(self):
+        library = AlarmLibrary(self.directory, budget=400000)
+        library.preload(self.mixer)
+        started = []
+        speaker = Speaker('Very', backend=self.backend, library=library, on_started=lambda latency, preloaded: started.append((latency, preloaded)))
+        speaker.start()
+        speaker.sync()
+        self.assertEqual(len(started), 1)
+        self.assertTrue(started[0][1])
+        self.assertGreaterEqual(speaker.latency, 0)
+        self.assertEqual(self.backend.log.count('mixer', 'load'), 0) # Nothing streamed from disk
+        speaker.stop()
+        speaker.sync()
+        self.assertEqual(self.backend.log.count('mixer', 'sound_stop'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
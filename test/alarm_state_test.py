@@ -0,0 +1,69 @@
+import threading
+import unittest
+from collections import namedtuple
+from alarm_state import AlarmState, default_options
+
+Row = namedtuple('Row', ['buzzer', 'vibration', 'web_unlock', 'alarm', 'pattern', 'event_id', 'event_title', 'event_description'])
+
+class AlarmStateTests(unittest.TestCase):
+    def setUp(self):
+        self.changes = []
+        self.state = AlarmState(on_change=lambda: self.changes.append(self.state.snapshot()))
+
+    def test_starts_idle(self):
+        current = self.state.snapshot()
+        self.assertFalse(current.trigger)
+        self.assertEqual(current.options, default_options())
+        self.assertEqual(current.events, {})
+        self.assertEqual(current.urgency, 'None')
+
+    def test_add_reminders_merges_a_batch(self):
+        self.state.add_reminders([Row('Loud', False, False, 'Somewhat', None, 1, 'Dentist', 'Teeth'),
+                                  Row(False, True, True, 'Very', '200,200', 2, 'Bins', 'Out')])
+        current = self.state.snapshot()
+        self.assertTrue(current.trigger)
+        self.assertEqual(current.options['buzzer'], 'Loud')
+        self.assertTrue(current.options['vibration'] and current.options['web_unlock'])
+        self.assertEqual(current.options['pattern'], '200,200')
+        self.assertEqual(current.urgency, 'Very')
+        self.assertEqual(current.events, {1: ('Dentist', 'Teeth'), 2: ('Bins', 'Out')})
+        self.assertEqual(len(self.changes), 1) # One wake up per batch, after it was applied in full
+
+    def test_urgency_never_drops(self):
+        self.state.add_reminders([Row(False, False, False, 'Extremely', None, 1, 'A', '')])
+        self.state.add_reminders([Row(False, False, False, 'Somewhat', None, 2, 'B', '')])
+        self.assertEqual(self.state.snapshot().urgency, 'Extremely')
+
+    def test_snapshot_is_a_copy(self):
+        current = self.state.snapshot()
+        current.options['alarm'].add('Very')
+        current.events[1] = ('A', '')
+        self.assertEqual(self.state.snapshot().options['alarm'], {'None'})
+        self.assertEqual(self.state.snapshot().events, {})
+
+    def test_snooze_clears_trigger_and_wakes(self):
+        self.state.add_reminders([Row(False, False, False, 'Urgent', None, 1, 'A', '')])
+        self.changes.clear()
+        pressed = threading.Thread(target=self.state.snooze)
+        pressed.start()
+        pressed.join()
+        self.assertEqual(len(self.changes), 1) # on_change ran on the button thread
+        self.assertFalse(self.changes[0].trigger)
+        self.assertFalse(self.state.snapshot().trigger)
+        self.assertIsNotNone(self.state.take_press())
+        self.assertIsNone(self.state.take_press()) # Each press is measured once
+
+    def test_repr_is_a_snapshot(self):
+        # Loggers take the state itself as a field, so the copy is only made if the record is emitted
+        self.state.add_reminders([Row(False, False, False, 'Urgent', None, 1, 'A', '')])
+        self.assertEqual(repr(self.state), repr(self.state.snapshot()))
+
+    def test_clearing_web_unlock_key_drops_option(self):
+        self.state.add_reminders([Row(False, False, True, 'Urgent', None, 1, 'A', '')])
+        self.state.set_web_unlock_key(True)
+        self.assertTrue(self.state.snapshot().web_unlock_key_set)
+        self.state.set_web_unlock_key(False)
+        self.assertFalse(self.state.snapshot().options['web_unlock'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,23 @@
+import hashlib, io, json, os, re, shutil, struct, tempfile
 import unittest
-from app import app, db, Event, Reminder
+from unittest import mock
+os.environ['PITIME_DATABASE_URI'] = 'sqlite:///:memory:' # Read when app.py calls init_app() at import, setting app.config afterwards has no effect
+import app as app_module
+from app import app, db, Event, Reminder, handle_channel_message, parse_event_cursor, record_image_variants, queue_missing_image_variants
 from datetime import datetime
 
+PNG = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', 640, 480) + b'\x08\x02\x00\x00\x00'
+
 class FlaskAppTests(unittest.TestCase):
     def setUp(self):
         # Set up a test client and create a testing environment
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  # Use in-memory database
         self.app = app.test_client()
+        tts_directory = tempfile.TemporaryDirectory() # Submitted events prerender their announcements, kept out of the repo's .tts_cache
+        self.addCleanup(tts_directory.cleanup)
+        self.addCleanup(setattr, app_module.tts_cache, 'directory', app_module.tts_cache.directory)
+        self.addCleanup(self.wait_for_prerender) # Runs first, before the directory is restored and removed
+        app_module.tts_cache.directory = tts_directory.name
         with app.app_context():
             db.create_all()
 
@@ -17,6 +27,10 @@ class FlaskAppTests(unittest.TestCase):
             db.session.remove()
             db.drop_all()
 
+    def wait_for_prerender(self):
+        if app_module.tts_cache.queue is not None:
+            app_module.tts_cache.queue.join()
+
     def test_index_route(self):
         # Test the index route
         response = self.app.get('/')
@@ -41,5 +55,241 @@ class FlaskAppTests(unittest.TestCase):
             db.session.commit()
             self.assertIsNotNone(Event.query.filter_by(title='Test Event').first())
 
+    def test_events_route_uses_constant_queries(self):
+        # /events costs the same number of queries for 2 events as for 20
+        from sqlalchemy import event as sqlalchemy_event
+        def count_queries():
+            statements = []
+            with app.app_context():
+                listener = lambda *args: statements.append(args[2])
+                sqlalchemy_event.listen(db.engine, 'before_cursor_execute', listener)
+                try:
+                    response = self.app.get('/events')
+                finally:
+                    sqlalchemy_event.remove(db.engine, 'before_cursor_execute', listener)
+            self.assertEqual(response.status_code, 200)
+            return len(statements), response.get_data(as_text=True)
+        def add_events(count, locked):
+            with app.app_context():
+                for index in range(count):
+                    event = Event(title=f'Event {index}', description='')
+                    event.reminders = [Reminder(date_time=datetime(2030, 1, 1, 8, index), repeater='Never', reminder_lock=locked),
+                                       Reminder(date_time=datetime(2030, 1, 2, 8, index), repeater='Never', reminder_lock=True)]
+                    db.session.add(event)
+                db.session.commit()
+        add_events(2, False)
+        few, _ = count_queries()
+        add_events(18, True)
+        many, text = count_queries()
+        self.assertEqual(few, many)
+        self.assertLessEqual(many, 3)
+        self.assertIn('Event 17', text)
+
+    def test_all_locked_is_computed_per_event(self):
+        from app import relevant_events_filter
+        with app.app_context():
+            spent, active, empty = Event(title='Spent'), Event(title='Active'), Event(title='Empty')
+            spent.reminders = [Reminder(date_time=datetime(2030, 1, 1), reminder_lock=True)]
+            active.reminders = [Reminder(date_time=datetime(2030, 1, 1), reminder_lock=True), Reminder(date_time=datetime(2030, 1, 2), reminder_lock=False)]
+            db.session.add_all([spent, active, empty, Event(title='Deleted', event_lock=True)])
+            db.session.commit()
+            events = {event['title']: event for event in relevant_events_filter()[0]}
+        self.assertEqual(set(events), {'Spent', 'Active', 'Empty'})
+        self.assertTrue(events['Spent']['all_locked'])
+        self.assertFalse(events['Active']['all_locked'])
+        self.assertTrue(events['Empty']['all_locked']) # Like all() over no reminders
+        self.assertEqual([reminder.date_time.day for reminder in events['Active']['reminders']], [1, 2])
+
+    def test_events_pages_follow_reminder_order(self):
+        from app import relevant_events_filter
+        with app.app_context():
+            for index in range(7):
+                event = Event(title=f'Event {index}')
+                event.reminders = [Reminder(date_time=datetime(2030, 1, 1 + index % 3, 8, index)), Reminder(date_time=datetime(2030, 2, 1 + index, 8))]
+                db.session.add(event)
+            db.session.add(Event(title='No reminders'))
+            db.session.commit()
+            for sort_order, expected in (('desc', [6, 5, 4, 3, 2, 1, 0]), ('asc', [0, 3, 6, 1, 4, 2, 5])):
+                titles, after = [], None
+                while True:
+                    page, after = relevant_events_filter(sort_order, after and parse_event_cursor(after), 3)
+                    titles += [event['title'] for event in page]
+                    if after is None:
+                        break
+                self.assertEqual(titles, [f'Event {index}' for index in expected] + ['No reminders'])
+
+    def test_events_route_logs_structured_fields(self):
+        with app.app_context():
+            db.session.add(Event(title='Logged', reminders=[Reminder(date_time=datetime(2030, 1, 1, 8, 0), repeater='Daily')]))
+            db.session.commit()
+        with self.assertLogs('pitime.app', 'DEBUG') as logs:
+            self.app.get('/events')
+        reminders = [record.fields for record in logs.records if record.getMessage() == 'Active reminder']
+        self.assertEqual([(fields['repeater'], fields['date_time']) for fields in reminders], [('Daily', datetime(2030, 1, 1, 8, 0))])
+
+    def test_events_route_next_page_link(self):
+        with app.app_context():
+            for index in range(3):
+                db.session.add(Event(title=f'Event {index}', reminders=[Reminder(date_time=datetime(2030, 1, 1, 8, index))]))
+            db.session.commit()
+        first = self.app.get('/events?sort=asc&limit=2').get_data(as_text=True)
+        self.assertIn('Event 1', first)
+        self.assertNotIn('Event 2', first)
+        after = re.search(r'after=([^&"]+)', first).group(1)
+        second = self.app.get(f'/events?sort=asc&limit=2&after={after}').get_data(as_text=True)
+        self.assertIn('Event 2', second)
+        self.assertNotIn('Next Page', second)
+        self.assertEqual(self.app.get('/events?after=garbage').status_code, 400)
+
+    def use_upload_folder(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.addCleanup(app.config.__setitem__, 'UPLOAD_FOLDER', app.config['UPLOAD_FOLDER'])
+        app.config['UPLOAD_FOLDER'] = folder
+        return folder
+
+    def post_image(self, title, image, filename):
+        test_event = {
+            'main_event_title': title,
+            'main_event_description': '',
+            'reminder_time[]': ['12:00'],
+            'reminder_date[]': ['2030-01-01'],
+            'event_image': (io.BytesIO(image), filename)
+        }
+        return self.app.post('/submit', data=test_event, content_type='multipart/form-data')
+
+    def stored_files(self, folder):
+        return sorted(os.path.relpath(os.path.join(root, name), folder) for root, _, names in os.walk(folder) for name in names)
+
+    def test_image_upload_is_recorded_on_the_event(self):
+        # The upload's path, dimensions and hash are stored once, then /events renders it without touching the disk
+        folder = self.use_upload_folder()
+        sha256 = hashlib.sha256(PNG).hexdigest()
+        with mock.patch('app.image_pipeline.submit') as submit:
+            self.assertEqual(self.post_image('Picture Day', PNG, 'photo.PNG').status_code, 302)
+        with app.app_context():
+            event = Event.query.filter_by(title='Picture Day').one()
+            self.assertEqual((event.image_path, event.image_width, event.image_height, event.image_sha256), (f'images/{sha256[:2]}/{sha256}.png', 640, 480, sha256))
+        submit.assert_called_once_with(event.id, event.image_path, sha256)
+        self.assertEqual(self.stored_files(folder), [os.path.join('images', sha256[:2], f'{sha256}.png')])
+        with mock.patch('os.path.isfile') as isfile, mock.patch('os.path.exists') as exists:
+            page = self.app.get('/events').get_data(as_text=True)
+        isfile.assert_not_called()
+        exists.assert_not_called()
+        self.assertIn(f'{sha256}.png" alt="Event Image" loading="lazy" width="640" height="480"', page)
+
+    def test_identical_uploads_are_stored_once(self):
+        folder = self.use_upload_folder()
+        with mock.patch('app.image_pipeline.submit') as submit:
+            self.post_image('First', PNG, 'photo.png')
+            with app.app_context():
+                first = Event.query.filter_by(title='First').one()
+                first.image_thumb_path, first.image_web_path = 'images/thumb.jpg', 'images/web.jpg' # As if the pipeline had finished
+                db.session.commit()
+            self.post_image('Second', PNG, 'copy.jpg') # Named after the wrong format, the same bytes still map to one file
+        with app.app_context():
+            first, second = Event.query.filter_by(title='First').one(), Event.query.filter_by(title='Second').one()
+            self.assertEqual(first.image_path, second.image_path)
+            self.assertEqual((second.image_thumb_path, second.image_web_path), ('images/thumb.jpg', 'images/web.jpg')) # Reused, not resized again
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(len(self.stored_files(folder)), 1) # The second copy was dropped once hashed
+
+    def test_oversized_upload_is_refused(self):
+        folder = self.use_upload_folder()
+        self.addCleanup(app.config.__setitem__, 'MAX_CONTENT_LENGTH', app.config['MAX_CONTENT_LENGTH'])
+        app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+        response = self.post_image('Too Big', PNG + bytes(2 * 1024 * 1024), 'huge.png')
+        self.assertEqual(response.status_code, 302)
+        with self.app.session_transaction() as session:
+            self.assertEqual(session['_flashes'], [('message', 'Images must be smaller than 1 MB.')])
+        with app.app_context():
+            self.assertEqual(Event.query.count(), 0)
+        self.assertEqual(self.stored_files(folder), [])
+
+    def test_oversized_import_gets_a_status(self):
+        self.addCleanup(app.config.__setitem__, 'MAX_CONTENT_LENGTH', app.config['MAX_CONTENT_LENGTH'])
+        app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+        response = self.app.post('/import?format=ndjson', data=bytes(2 * 1024 * 1024))
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('1 MB', response.get_json()['error'])
+        with self.app.session_transaction() as session:
+            self.assertNotIn('_flashes', session)
+
+    def test_rejected_upload_leaves_no_file(self):
+        folder = self.use_upload_folder()
+        self.post_image('Notes', b'not an image', 'notes.txt')
+        self.assertEqual(self.stored_files(folder), [])
+
+    def test_events_serve_image_variants(self):
+        # Once the pipeline has made them, the list shows the thumbnail and links the web sized copy
+        with app.app_context():
+            db.session.add(Event(id=3, title='Photo', image_path='3.jpg', image_width=4000, image_height=3000, image_sha256='cd' * 32, reminders=[Reminder(date_time=datetime(2030, 1, 1))]))
+            db.session.add(Event(id=4, title='Done', image_path='4.jpg', image_sha256='ef' * 32, image_thumb_path='images/ef/thumb.jpg'))
+            db.session.commit()
+        with mock.patch('app.image_pipeline.submit', return_value=object()) as submit:
+            self.assertEqual(queue_missing_image_variants(), 1)
+        submit.assert_called_once_with(3, '3.jpg', 'cd' * 32)
+        self.assertIn('/static/3.jpg', self.app.get('/events').get_data(as_text=True)) # The original until the variants exist
+        record_image_variants(3, {'thumb': 'images/cd/cd-thumb.jpg', 'web': 'images/cd/cd-web.jpg'})
+        record_image_variants(99, {'thumb': 'gone.jpg'}) # Event deleted meanwhile
+        page = self.app.get('/events').get_data(as_text=True)
+        self.assertIn('<a href="/static/images/cd/cd-web.jpg">', page)
+        self.assertIn('<img src="/static/images/cd/cd-thumb.jpg"', page)
+        self.assertNotIn('/static/3.jpg', page)
+
+    def test_import_route(self):
+        # Each event takes its id from its own insert, the reminders go in with one executemany; invalid rows are reported by row number
+        from sqlalchemy import event as sqlalchemy_event
+        rows = [{'title': f'Imported {index}', 'reminders': [{'date_time': '2030-01-02T08:00'}, {'date_time': f'2030-01-0{index + 3}T08:00', 'repeater': 'Daily'}]} for index in range(3)]
+        rows.insert(1, {'title': 'Old', 'reminders': [{'date_time': '2000-01-01T08:00'}]})
+        inserts = []
+        def count_inserts(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT'):
+                inserts.append(executemany)
+        with app.app_context():
+            sqlalchemy_event.listen(db.engine, 'before_cursor_execute', count_inserts)
+            try:
+                response = self.app.post('/import', data='\n'.join(json.dumps(row) for row in rows), content_type='application/x-ndjson')
+            finally:
+                sqlalchemy_event.remove(db.engine, 'before_cursor_execute', count_inserts)
+            report = response.get_json()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((report['rows'], report['events'], report['reminders'], report['error_count']), (4, 3, 6, 1))
+            self.assertEqual(report['errors'], [{'row': 2, 'error': 'reminder 1 is set in the past'}])
+            self.assertEqual(inserts, [False, False, False, True]) # The three events, then their reminders
+            event = Event.query.filter_by(title='Imported 2').one()
+            self.assertEqual((event.first_reminder, event.last_reminder), (datetime(2030, 1, 2, 8, 0), datetime(2030, 1, 5, 8, 0)))
+
+    def test_import_batches_keep_reminders_with_their_events(self):
+        from importer import import_events
+        rows = [{'title': f'Event {index}', 'reminders': [{'date_time': f'2030-01-{index + 1:02d}T08:00'}]} for index in range(5)]
+        with app.app_context():
+            db.session.add(Event(title='Existing'))
+            db.session.commit()
+            report = import_events(db.session, io.BytesIO(json.dumps(rows).encode()), 'json', datetime(2029, 1, 1), batch_size=2)
+            db.session.commit()
+            self.assertEqual(report['events'], 5)
+            for index in range(5):
+                event = Event.query.filter_by(title=f'Event {index}').one()
+                self.assertEqual([reminder.date_time.day for reminder in event.reminders], [index + 1])
+
+    def test_import_is_all_or_nothing_for_malformed_files(self):
+        response = self.app.post('/import?format=json', data='[{"title": "Dentist", "reminders": []}, {"title": ')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('after row 1', response.get_json()['error'])
+        self.assertEqual(self.app.post('/import', data='title,date', content_type='text/csv').status_code, 400)
+        with app.app_context():
+            self.assertEqual(Event.query.count(), 0)
+
+    def test_metrics_route(self):
+        # Request latency is recorded per route and rpi_main's snapshot is merged in
+        self.app.get('/')
+        handle_channel_message('metrics', '{"labels":{"process":"rpi_main"},"metrics":[{"type":"counter","name":"pitime_reminders_fired_total","help":"Reminders processed","labels":[],"buckets":[],"values":[[[],4]]}]}')
+        response = self.app.get('/metrics')
+        text = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pitime_http_request_seconds_count{process="app",route="/",method="GET",status="200"}', text)
+        self.assertIn('pitime_reminders_fired_total{process="rpi_main"} 4', text)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+import importlib.util
+import os
+import threading
+import unittest
+from backends import SimulatedBackend
+from rpi_models import Buzzer, Vibration, Speaker
+
+# test/ holds an older copy of the LCD driver, so the repository's copy is loaded by path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location('root_I2C_LCD_driver', os.path.join(ROOT, 'I2C_LCD_driver.py'))
+I2C_LCD_driver = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(I2C_LCD_driver)
+
+class SimulatedBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.backend = SimulatedBackend()
+        self.log = self.backend.log
+
+    def test_transactions_are_timestamped_in_order(self):
+        device = self.backend.output(17)
+        device.on()
+        device.off()
+        entries = self.log.filter('gpio17')
+        self.assertEqual([entry[2] for entry in entries], ['on', 'off'])
+        self.assertLessEqual(entries[0][0], entries[1][0])
+
+    def test_buzzer_and_vibration_drive_simulated_pins(self):
+        buzzer = Buzzer(backend=self.backend)
+        vibration = Vibration(backend=self.backend)
+        buzzer.start()
+        vibration.start()
+        buzzer.stop()
+        vibration.stop()
+        self.assertGreaterEqual(self.log.count('gpio17', 'on'), 1)
+        self.assertGreaterEqual(self.log.count('gpio25', 'on'), 1)
+        self.assertFalse(buzzer.buzzer.is_active)
+        self.assertFalse(vibration.vibration.is_active)
+
+    def test_speaker_plays_alarm_through_simulated_mixer(self):
+        speaker = Speaker('Extremely', backend=self.backend)
+        speaker.start()
+        speaker.sync()
+        self.assertTrue(speaker.mixer.music.get_busy())
+        self.assertIn(os.path.join('alarms', 'Extremely'), self.log.filter('mixer', 'load')[0][3])
+        speaker.stop()
+        speaker.sync()
+        self.assertEqual(self.log.count('mixer', 'stop'), 1)
+
+    def test_lcd_writes_to_simulated_bus(self):
+        screen = I2C_LCD_driver.lcd(bus=self.backend.i2c_bus(1))
+        self.log.clear()
+        screen.lcd_display_string("Hi", 1)
+        writes = self.log.filter('i2c1', 'write_i2c_block_data')
+        self.assertEqual(len(writes), 1) # Cursor move plus two characters, 6 bytes each, in one block
+        address, first, rest = writes[0][3]
+        self.assertEqual(address, I2C_LCD_driver.ADDRESS)
+        expected = screen.encode(0x80) + screen.encode(ord('H'), I2C_LCD_driver.Rs) + screen.encode(ord('i'), I2C_LCD_driver.Rs)
+        self.assertEqual([first] + rest, expected)
+
+    def test_button_press_runs_callback(self):
+        pressed = threading.Event()
+        button = self.backend.button(23)
+        button.when_pressed = pressed.set
+        button.press()
+        self.assertTrue(pressed.wait(1))
+
+    def test_tts_engine_records_speech(self):
+        engine = self.backend.tts_engine()
+        engine.say("Event number 1")
+        engine.runAndWait()
+        self.assertEqual(self.log.filter('tts', 'say')[0][3], "Event number 1")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from datetime import datetime
+import clock
+from clock import VirtualClock
+from backends import SimulatedBackend
+from boot import BootTimer, wait_until_ready, probe_i2c
+from metrics import Registry
+
+class WaitUntilReadyTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(datetime(2024, 1, 1))
+        self.previous = clock.set_clock(self.clock)
+
+    def tearDown(self):
+        clock.set_clock(self.previous)
+
+    def test_returns_as_soon_as_probe_succeeds(self):
+        attempts = []
+        def probe():
+            attempts.append(clock.monotonic())
+            if len(attempts) < 4:
+                raise OSError("No such device")
+            return 'device'
+        self.assertEqual(wait_until_ready("Test device", probe), 'device')
+        self.assertEqual(len(attempts), 4)
+        self.assertLess(self.clock.slept, 1) # Backs off from 50ms instead of sleeping a fixed 25s
+
+    def test_gives_up_after_timeout(self):
+        self.assertIsNone(wait_until_ready("Missing device", lambda: False, timeout=10))
+        self.assertLessEqual(self.clock.slept, 10)
+
+    def test_probe_i2c_returns_open_bus(self):
+        backend = SimulatedBackend()
+        bus = probe_i2c(backend, 1, 0x27)
+        self.assertEqual(bus.name, 'i2c1')
+        self.assertEqual(backend.log.count('i2c1', 'read_byte'), 1)
+
+class BootTimerTests(unittest.TestCase):
+    def test_phases_and_marks_are_reported(self):
+        registry = Registry()
+        timer = BootTimer(registry=registry)
+        with timer.phase('database'):
+            pass
+        first = timer.mark('first_clock_display')
+        self.assertEqual(timer.mark('first_clock_display'), first) # Only the first call counts
+        report = timer.report()
+        self.assertIn('database', report)
+        self.assertIn('first_clock_display', report)
+        self.assertEqual(registry.histogram('pitime_boot_phase_seconds', '', ('phase',)).count(phase='database'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import re
+import subprocess
+import sys
+import threading
+import unittest
+from datetime import datetime
+import clock
+from clock import VirtualClock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class VirtualClockTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(datetime(2024, 1, 1, 8, 0))
+        self.previous = clock.set_clock(self.clock)
+
+    def tearDown(self):
+        clock.set_clock(self.previous)
+
+    def test_sleep_advances_virtual_time(self):
+        clock.sleep(3600)
+        self.assertEqual(clock.now(), datetime(2024, 1, 1, 9, 0))
+        self.assertEqual(clock.monotonic(), 3600)
+        self.assertEqual(self.clock.slept, 3600)
+
+    def test_wait_times_out_immediately(self):
+        condition = threading.Condition()
+        with condition:
+            self.assertFalse(clock.wait(condition, 86400))
+        self.assertEqual(clock.today(), datetime(2024, 1, 2).date())
+
+    def test_negative_sleep_does_not_rewind(self):
+        clock.sleep(-5)
+        self.assertEqual(clock.now(), datetime(2024, 1, 1, 8, 0))
+
+class ReplayTests(unittest.TestCase):
+    def run_replay(self, *arguments):
+        # replay.py imports rpi_main on its own clock and database, so it runs in a separate interpreter
+        result = subprocess.run([sys.executable, 'replay.py', '--reminders', '20', '--days', '1', '--seed', '3', *arguments],
+                                cwd=ROOT, capture_output=True, text=True, timeout=120,
+                                env={**os.environ, 'PITIME_BACKEND': 'simulated'})
+        self.assertEqual(result.returncode, 0, result.stderr)
+        fired = int(re.search(r"Reminders fired: (\d+)", result.stdout).group(1))
+        mean, maximum = (float(value) for value in re.search(r"mean ([\d.]+), .* max ([\d.]+)", result.stdout).groups())
+        return fired, mean, maximum
+
+    def test_replay_fires_reminders_on_time(self):
+        fired, _, maximum = self.run_replay()
+        self.assertGreater(fired, 20) # Repeating reminders fire again within the day, each processed row is counted
+        self.assertEqual(maximum, 0.0) # Due times are off the minute, so only waking at the due time gets here
+
+    def test_replay_measures_polling_lag(self):
+        fired, mean, maximum = self.run_replay('--mode', 'poll', '--poll-interval', '5')
+        self.assertGreater(fired, 20)
+        self.assertGreater(mean, 0.0)
+        self.assertLess(maximum, 5.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import importlib.util
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from backends import SimulatedBackend
+from display import FramebufferLCD, DisplayWorker, full_redraw_cost, CLOCK, UNLOCK
+
+# test/ holds an older copy of the LCD driver, so the repository's copy is loaded by path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location('root_I2C_LCD_driver', os.path.join(ROOT, 'I2C_LCD_driver.py'))
+I2C_LCD_driver = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(I2C_LCD_driver)
+
+class FramebufferLCDTests(unittest.TestCase):
+    def setUp(self):
+        self.backend = SimulatedBackend()
+        self.log = self.backend.log
+        self.display = FramebufferLCD(I2C_LCD_driver.lcd(bus=self.backend.i2c_bus(1)))
+        self.log.clear()
+
+    def transactions(self):
+        return self.log.count('i2c1', 'write_byte') + self.log.count('i2c1', 'write_i2c_block_data')
+
+    def bytes_sent(self):
+        return self.log.count('i2c1', 'write_byte') + sum(1 + len(entry[3][2]) for entry in self.log.filter('i2c1', 'write_i2c_block_data'))
+
+    def test_unchanged_frame_writes_nothing(self):
+        self.display.show(("07:15 AM", "October 18, '26"))
+        self.log.clear()
+        self.assertEqual(self.display.show(("07:15 AM", "October 18, '26")), 0)
+        self.assertEqual(self.transactions(), 0)
+
+    def test_only_changed_cells_are_written(self):
+        self.display.show(("07:15 AM", "October 18, '26"))
+        self.log.clear()
+        written = self.display.show(("07:16 AM", "October 18, '26"))
+        self.assertEqual(self.bytes_sent(), 2 * 6) # One cursor move and one character
+        self.assertEqual(written, 1)
+        self.assertEqual(self.transactions(), written)
+
+    def test_contiguous_cells_share_one_cursor_move(self):
+        self.display.show(("Key: 1234", ""))
+        self.log.clear()
+        self.display.show(("Key: 5678", ""))
+        self.assertEqual(self.bytes_sent(), 6 + 4 * 6) # One cursor move, then four characters
+
+    def test_transactions_saved_against_full_redraw(self):
+        frame = ("07:15 AM", "October 18, '26")
+        written = self.display.show(frame)
+        self.display.show(frame)
+        self.assertEqual(self.display.transactions_saved, 2 * full_redraw_cost(frame) - written)
+        self.assertEqual(self.display.transactions_written, self.transactions())
+
+    def test_backlight_off_is_restored_after_writes(self):
+        self.display.show(("Alarm", ""), 0)
+        self.assertEqual(self.log.filter('i2c1', 'write_byte')[-1][3][1], I2C_LCD_driver.LCD_NOBACKLIGHT)
+        self.log.clear()
+        self.display.show(("Alarm", ""), 0)
+        self.assertEqual(self.transactions(), 0)
+
+    def test_invalidate_redraws_every_cell(self):
+        self.display.show(("07:15 AM", ""))
+        self.display.invalidate()
+        self.log.clear()
+        self.display.show(("07:15 AM", ""))
+        self.assertEqual(self.bytes_sent(), 2 * (6 + 16 * 6) + 1)
+
+    def test_frame_is_sent_in_block_writes(self):
+        written = self.display.show(("07:15 AM", "October 18, '26"))
+        self.assertEqual(written, math.ceil((self.bytes_sent() - 1) / I2C_LCD_driver.BLOCK_SIZE) + 1) # Blocks of 33 bytes, then the backlight
+        self.assertEqual(self.log.filter('i2c1', 'write_byte')[-1][3][1], I2C_LCD_driver.LCD_BACKLIGHT)
+
+class DisplayWorkerTests(unittest.TestCase):
+    def setUp(self):
+        self.written = []
+        self.release = threading.Event()
+        self.release.set()
+        self.worker = DisplayWorker(self.write, min_interval=0.05)
+        self.worker.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.worker.close()
+
+    def write(self, frame):
+        self.release.wait()
+        self.written.append(frame)
+
+    def test_higher_priority_frame_covers_the_clock(self):
+        self.worker.show(("07:15 AM", "", 1), CLOCK)
+        self.worker.show(("abcd", "efgh", 0), UNLOCK)
+        self.worker.show(("07:16 AM", "", 1), CLOCK)
+        self.assertTrue(self.worker.sync())
+        self.assertEqual(self.written[-1], ("abcd", "efgh", 0))
+        self.worker.clear(UNLOCK)
+        self.assertTrue(self.worker.sync())
+        self.assertEqual(self.written[-1], ("07:16 AM", "", 1))
+
+    def test_show_never_waits_for_the_bus(self):
+        self.release.clear() # The LCD is stuck mid write
+        self.worker.show(("first", "", 1))
+        started = time.perf_counter()
+        for minute in range(100):
+            self.worker.show((f"{minute:02}", "", 1))
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.release.set()
+        self.assertTrue(self.worker.sync())
+        self.assertEqual(self.written[-1], ("99", "", 1))
+        self.assertLessEqual(len(self.written), 3) # Stale frames were dropped, not queued
+        self.assertGreaterEqual(self.worker.frames_dropped, 97)
+
+    def test_frames_are_rate_limited(self):
+        for index in range(20):
+            self.worker.show((str(index), "", 1))
+            time.sleep(0.005)
+        self.assertTrue(self.worker.sync())
+        self.assertLess(len(self.written), 10)
+        self.assertEqual(self.written[-1], ("19", "", 1))
+
+class LCDBenchmarkTests(unittest.TestCase):
+    def test_block_writes_beat_byte_writes(self):
+        # lcd_benchmark.py imports the repository's LCD driver, which test/ shadows, so it runs in a separate interpreter
+        result = subprocess.run([sys.executable, 'lcd_benchmark.py', '--frames', '2'], cwd=ROOT, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('chars/s', result.stdout)
+        speedup = float(result.stdout.strip().splitlines()[-1].split()[3].rstrip('x'))
+        self.assertGreater(speedup, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import io
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from images import image_format, image_size, image_info, find_event_image, variant_path, render_variants, pillow_installed, ImagePipeline
+
+def png(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+
+def jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + bytes(3)
+    return b'\xff\xd8' + app0 + sof + b'\xff\xd9'
+
+def fake_render(source, directory, sha256):
+    # Stands in for render_variants(), which needs Pillow; reports the process it ran in
+    return {'thumb': variant_path(sha256, 'thumb'), 'source': source, 'pid': os.getpid()}
+
+class ImageTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_header_dimensions(self):
+        self.assertEqual(image_size(io.BytesIO(png(640, 480))), (640, 480))
+        self.assertEqual(image_size(io.BytesIO(b'GIF87a' + struct.pack('<HH', 32, 16))), (32, 16))
+        self.assertEqual(image_size(io.BytesIO(jpeg(1024, 768))), (1024, 768))
+        self.assertEqual(image_size(io.BytesIO(b'not an image')), (None, None))
+        self.assertEqual(image_size(io.BytesIO(jpeg(1024, 768)[:24])), (None, None)) # Truncated before the frame header
+
+    def test_format_is_read_from_the_header(self):
+        self.assertEqual([image_format(io.BytesIO(data)) for data in (png(1, 1), jpeg(1, 1), b'GIF89a' + bytes(4), b'not an image')], ['png', 'jpg', 'gif', None])
+
+    def test_info_and_lookup(self):
+        data = png(2, 3)
+        with open(os.path.join(self.directory, '7.PNG'), 'wb') as file:
+            file.write(data)
+        self.assertEqual(find_event_image(self.directory, 7), '7.PNG')
+        self.assertIsNone(find_event_image(self.directory, 8))
+        self.assertEqual(image_info(os.path.join(self.directory, '7.PNG')), {'width': 2, 'height': 3, 'sha256': hashlib.sha256(data).hexdigest()})
+
+    def test_pipeline_renders_in_worker_process(self):
+        done, results = threading.Event(), []
+        def on_done(event_id, variants):
+            results.append((event_id, variants))
+            done.set()
+        pipeline = ImagePipeline(self.directory, on_done, render=fake_render)
+        with mock.patch('images.pillow_installed', return_value=True):
+            try:
+                futures = []
+                request = threading.Thread(target=lambda: futures.append(pipeline.submit(7, '7.png', 'ab' * 32))) # Started lazily from a request thread
+                request.start()
+                request.join()
+                futures[0].result(timeout=30)
+                self.assertTrue(done.wait(5))
+                self.assertNotEqual(pipeline.executor._mp_context.get_start_method(), 'fork') # Never forks the multithreaded server
+            finally:
+                pipeline.close()
+        event_id, variants = results[0]
+        self.assertEqual(event_id, 7)
+        self.assertEqual(variants['thumb'], 'images/ab/' + 'ab' * 32 + '-thumb.jpg')
+        self.assertEqual(variants['source'], os.path.join(self.directory, '7.png'))
+        self.assertNotEqual(variants['pid'], os.getpid())
+
+    @unittest.skipUnless(pillow_installed(), "Pillow isn't installed")
+    def test_variants_are_bounded(self):
+        from PIL import Image
+        source = os.path.join(self.directory, '1.png')
+        Image.new('RGBA', (4000, 1000), (0, 0, 255, 128)).save(source)
+        variants = render_variants(source, self.directory, 'ab' * 32)
+        sizes = {name: Image.open(os.path.join(self.directory, path)).size for name, path in variants.items()}
+        self.assertEqual(sizes, {'thumb': (320, 80), 'web': (1280, 320)})
+        self.assertEqual(render_variants(source, self.directory, 'ab' * 32), variants) # Already written, nothing is decoded
+
+    def test_pipeline_without_pillow(self):
+        pipeline = ImagePipeline(self.directory, mock.Mock(), render=fake_render)
+        with mock.patch('images.pillow_installed', return_value=False):
+            self.assertIsNone(pipeline.submit(7, '7.png', 'ab' * 32))
+        self.assertIsNone(pipeline.executor)
+
+if __name__ == '__main__':
+    unittest.main()
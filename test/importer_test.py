@@ -0,0 +1,110 @@
+import io
+import json
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+import importer
+from importer import read_rows, validate_event, detect_format, ImportFormatError
+
+NOW = datetime(2030, 1, 1, 12, 0)
+
+ICS = '''BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+SUMMARY:Dentist\r
+DESCRIPTION:Bring the forms\\, both\\nof them\r
+DTSTART:20300102T080000\r
+BEGIN:VALARM\r
+TRIGGER:-PT15M\r
+END:VALARM\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:Standup with a title that is folded onto\r
+  a second line\r
+DTSTART;VALUE=DATE:20200106\r
+RRULE:FREQ=WEEKLY\r
+END:VEVENT\r
+BEGIN:VEVENT\r
+SUMMARY:Every other second\r
+DTSTART:20300102T080000Z\r
+RRULE:FREQ=SECONDLY\r
+END:VEVENT\r
+END:VCALENDAR\r
+'''
+
+def rows(text, import_format):
+    return list(read_rows(io.BytesIO(text.encode('utf-8')), import_format))
+
+class ImporterTests(unittest.TestCase):
+    def test_json_array_is_read_across_chunks(self):
+        events = [{'title': f'Event {index}', 'reminders': [{'date_time': '2030-01-02T08:00'}]} for index in range(50)]
+        with mock.patch('importer.READ_SIZE', 7): # Elements, numbers and separators split between reads
+            self.assertEqual(rows(json.dumps(events, indent=1), 'json'), list(enumerate(events, 1)))
+        self.assertEqual(rows('[]', 'json'), [])
+
+    def test_malformed_json_array(self):
+        with self.assertRaises(ImportFormatError):
+            rows('{"title": "Not an array"}', 'json')
+        with self.assertRaisesRegex(ImportFormatError, 'after row 1'):
+            rows('[{"title": "Dentist"}, {"title": ', 'json')
+
+    def test_ndjson_rows_fail_independently(self):
+        read = rows('{"title": "A"}\n\nnot json\n{"title": "B"}\n', 'ndjson')
+        self.assertEqual([row for row, _ in read], [1, 3, 4])
+        self.assertIsInstance(read[1][1], ValueError)
+        self.assertEqual(read[2][1], {'title': 'B'})
+
+    def test_ics_events(self):
+        (first_row, dentist), (second_row, standup), (third_row, error) = rows(ICS, 'ics')
+        self.assertEqual((first_row, second_row, third_row), (3, 11, 17))
+        self.assertEqual(dentist['title'], 'Dentist')
+        self.assertEqual(dentist['description'], 'Bring the forms, both\nof them')
+        self.assertEqual([reminder['date_time'] for reminder in dentist['reminders']], [datetime(2030, 1, 2, 8, 0), datetime(2030, 1, 2, 7, 45)])
+        self.assertEqual(standup['title'], 'Standup with a title that is folded onto a second line')
+        self.assertEqual(standup['reminders'], [{'date_time': datetime(2020, 1, 6, 9, 0), 'repeater': 'Weekly'}])
+        self.assertIn('SECONDLY', str(error))
+        with self.assertRaises(ImportFormatError):
+            rows('BEGIN:VCALENDAR\nBEGIN:VEVENT\nSUMMARY:Cut off\n', 'ics')
+
+    def test_ics_rules_that_a_repeater_cannot_express_are_row_errors(self):
+        def rule(text, start='20200106'):
+            return rows(f'BEGIN:VCALENDAR\nBEGIN:VEVENT\nSUMMARY:Rule\nDTSTART;VALUE=DATE:{start}\nRRULE:{text}\nEND:VEVENT\nEND:VCALENDAR\n', 'ics')[0][1]
+        for text, part in (('FREQ=WEEKLY;INTERVAL=2', 'INTERVAL'), ('FREQ=DAILY;COUNT=3', 'COUNT'), ('FREQ=DAILY;UNTIL=20200110', 'UNTIL'),
+                           ('FREQ=WEEKLY;BYDAY=MO,WE', 'BYDAY'), ('FREQ=WEEKLY;BYDAY=TU', 'BYDAY'), ('FREQ=MONTHLY;BYDAY=1MO', 'BYDAY')):
+            error = rule(text)
+            self.assertIsInstance(error, ValueError, text)
+            self.assertIn(part, str(error))
+        self.assertEqual(rule('FREQ=DAILY;INTERVAL=1;WKST=SU')['reminders'][0]['repeater'], 'Daily')
+        self.assertEqual(rule('FREQ=WEEKLY;BYDAY=MO')['reminders'][0]['repeater'], 'Weekly') # 2020-01-06 is a Monday
+
+    def test_utc_times_become_local(self):
+        _, event = rows('BEGIN:VCALENDAR\nBEGIN:VEVENT\nSUMMARY:UTC\nDTSTART:20300102T080000Z\nEND:VEVENT\nEND:VCALENDAR\n', 'ics')[0]
+        self.assertEqual(event['reminders'][0]['date_time'], datetime(2030, 1, 2, 8, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None))
+
+    def test_validation_follows_the_form(self):
+        event, reminders = validate_event({'title': ' Dentist ', 'reminders': [
+            {'date_time': '2030-01-02T08:00', 'buzzer': 'Loud', 'alarm': 'Urgent', 'pattern': '200, 200', 'vibration': True},
+            {'date_time': '2029-12-30T08:00', 'repeater': 'Daily'}]}, NOW)
+        self.assertEqual(event, {'title': 'Dentist', 'description': '', 'event_lock': False})
+        self.assertEqual((reminders[0]['buzzer'], reminders[0]['alarm'], reminders[0]['pattern'], reminders[0]['vibration'], reminders[0]['web_unlock']),
+                         ('Loud', 'Urgent', '200,200', True, False))
+        self.assertEqual(reminders[1]['date_time'], datetime(2030, 1, 2, 8, 0)) # A repeating reminder in the past starts at its next occurrence
+        for data, message in (({'title': ''}, 'title'),
+                              ({'title': 'x' * 121}, 'at most'),
+                              ({'title': 'Old', 'reminders': [{'date_time': '2029-12-31T08:00'}]}, 'past'),
+                              ({'title': 'Bad', 'reminders': [{'date_time': 'tomorrow'}]}, 'ISO 8601'),
+                              ({'title': 'Bad', 'reminders': [{'date_time': '2030-01-02T08:00', 'alarm': 'Loud'}]}, 'alarm'),
+                              ({'title': 'Bad', 'reminders': [{'date_time': '2030-01-02T08:00', 'repeater': 'Fortnightly'}]}, 'repeater'),
+                              ({'title': 'Bad', 'reminders': [{'date_time': '2030-01-02T08:00', 'pattern': 'abc'}]}, 'pattern')):
+            with self.assertRaisesRegex(ValueError, message):
+                validate_event(data, NOW)
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('ICS', 'application/json'), 'ics')
+        self.assertEqual(detect_format(None, 'text/calendar; charset=utf-8'), 'ics')
+        self.assertEqual(detect_format(None, 'application/x-ndjson'), 'ndjson')
+        self.assertIsNone(detect_format('csv', None))
+        self.assertIsNone(detect_format(None, 'text/plain'))
+
+if __name__ == '__main__':
+    unittest.main()
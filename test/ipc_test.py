@@ -0,0 +1,53 @@
+import os
+import queue
+import tempfile
+import unittest
+from ipc import Channel, MAX_MESSAGE
+
+class ChannelTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.main_path = os.path.join(self.directory, 'rpi_main.sock')
+        self.app_path = os.path.join(self.directory, 'app.sock')
+        self.received = queue.Queue()
+        self.main = Channel(self.main_path, self.app_path)
+        self.app = Channel(self.app_path, self.main_path)
+
+    def tearDown(self):
+        self.main.close()
+        self.app.close()
+        os.rmdir(self.directory)
+
+    def test_message_round_trip(self):
+        self.assertTrue(self.main.start(lambda command, argument: self.received.put((command, argument))))
+        self.assertTrue(self.app.send('unlock'))
+        self.assertEqual(self.received.get(timeout=1), ('unlock', ''))
+        self.app.send('key', 'abc123')
+        self.assertEqual(self.received.get(timeout=1), ('key', 'abc123'))
+
+    def test_send_without_listener_is_not_delivered(self):
+        self.assertFalse(self.app.send('unlock'))
+
+    def test_oversize_messages_are_refused_by_the_sender(self):
+        self.assertTrue(self.main.start(lambda command, argument: self.received.put((command, argument))))
+        with self.assertLogs('pitime.ipc', 'ERROR'):
+            self.assertFalse(self.app.send('metrics', 'x' * MAX_MESSAGE))
+        self.assertTrue(self.app.send('metrics', 'x' * (MAX_MESSAGE - len('metrics '))))
+        self.assertEqual(len(self.received.get(timeout=1)[1]), MAX_MESSAGE - len('metrics '))
+
+    def test_handler_errors_do_not_stop_listener(self):
+        def handler(command, argument):
+            if command == 'bad':
+                raise RuntimeError('handler failure')
+            self.received.put(command)
+        self.main.start(handler)
+        self.app.send('bad')
+        self.app.send('good')
+        self.assertEqual(self.received.get(timeout=1), 'good')
+
+    def test_stale_socket_file_is_replaced(self):
+        open(self.main_path, 'w').close()
+        self.assertTrue(self.main.start(lambda command, argument: None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import io
+import logging
+import unittest
+import log
+from log import configure, get_logger, parse_levels, ring_buffer
+
+class ExpensiveRepr:
+    # Counts how many times a log argument is actually formatted
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'expensive'
+
+class LogTests(unittest.TestCase):
+    def setUp(self):
+        configure(default_level='WARNING', levels={'log_test': 'INFO'})
+        ring_buffer.records.clear()
+
+    def tearDown(self):
+        logging.getLogger('pitime.log_test').setLevel(logging.NOTSET)
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels("rpi_main=debug, app=INFO,bogus,=WARNING"), {'rpi_main': 'DEBUG', 'app': 'INFO'})
+        self.assertEqual(parse_levels(None), {})
+
+    def test_suppressed_messages_are_never_formatted(self):
+        logger = get_logger('log_test')
+        argument = ExpensiveRepr()
+        logger.debug("Suppressed %s", argument)
+        self.assertEqual(argument.formatted, 0)
+        self.assertEqual(len(ring_buffer.records), 0)
+
+    def test_emitted_records_land_in_ring_buffer(self):
+        logger = get_logger('log_test')
+        logger.info("Kept %s", 'value', extra={'fields': {'reminder_id': 3}})
+        self.assertEqual(len(ring_buffer.records), 1)
+        self.assertIn("Kept value reminder_id=3", ring_buffer.recent()[0])
+        stream = io.StringIO()
+        ring_buffer.dump(stream)
+        self.assertIn("pitime.log_test", stream.getvalue())
+
+    def test_ring_buffer_keeps_values_as_logged(self):
+        # A post-mortem dump must show what a live object looked like when the line was logged, not at dump time
+        logger = get_logger('log_test')
+        live = {'trigger': False}
+        logger.info("State %s", live, extra={'fields': {'state': live}})
+        live['trigger'] = True
+        self.assertIn("State {'trigger': False} state={'trigger': False}", ring_buffer.recent()[0])
+
+    def test_ring_buffer_is_bounded(self):
+        buffer = log.RingBufferHandler(capacity=3)
+        logger = logging.getLogger('pitime.log_test.bounded')
+        logger.addHandler(buffer)
+        try:
+            for index in range(5):
+                logger.warning("Record %s", index)
+        finally:
+            logger.removeHandler(buffer)
+        self.assertEqual([record.getMessage() for record in buffer.records], ["Record 2", "Record 3", "Record 4"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from metrics import Registry, render, instrument_database
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry(process='test')
+
+    def test_counter_renders_with_labels(self):
+        counter = self.registry.counter('pitime_test_total', "Test counter", ('kind',))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        self.assertEqual(counter.value(kind='a'), 3)
+        text = self.registry.render()
+        self.assertIn("# TYPE pitime_test_total counter", text)
+        self.assertIn('pitime_test_total{process="test",kind="a"} 3', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('pitime_test_seconds', "Test histogram", buckets=(0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        text = self.registry.render()
+        self.assertIn('pitime_test_seconds_bucket{process="test",le="0.1"} 1', text)
+        self.assertIn('pitime_test_seconds_bucket{process="test",le="1"} 2', text)
+        self.assertIn('pitime_test_seconds_bucket{process="test",le="+Inf"} 3', text)
+        self.assertIn('pitime_test_seconds_sum{process="test"} 5.55', text)
+        self.assertIn('pitime_test_seconds_count{process="test"} 3', text)
+
+    def test_snapshot_round_trip_merges_with_local_registry(self):
+        histogram = self.registry.histogram('pitime_db_query_seconds', "Query time", ('statement',))
+        histogram.observe(0.002, statement='SELECT')
+        remote = Registry.from_snapshot(self.registry.to_json())
+        local = Registry(process='app')
+        local.histogram('pitime_db_query_seconds', "Query time", ('statement',)).observe(0.002, statement='SELECT')
+        text = render(local, remote)
+        self.assertEqual(text.count("# TYPE pitime_db_query_seconds histogram"), 1)
+        self.assertIn('pitime_db_query_seconds_count{process="app",statement="SELECT"} 1', text)
+        self.assertIn('pitime_db_query_seconds_count{process="test",statement="SELECT"} 1', text)
+
+    def test_reregistering_returns_same_metric(self):
+        first = self.registry.counter('pitime_test_total', "Test counter")
+        self.assertIs(first, self.registry.counter('pitime_test_total', "Test counter"))
+        with self.assertRaises(ValueError):
+            self.registry.histogram('pitime_test_total', "Wrong type")
+
+    def test_failed_statements_leave_no_start_time(self):
+        from sqlalchemy import create_engine, text
+        from sqlalchemy.orm import Session
+        engine = create_engine('sqlite://')
+        instrument_database(self.registry, engine, Session)
+        with engine.connect() as connection:
+            for _ in range(3):
+                with self.assertRaises(Exception):
+                    connection.execute(text("SELECT * FROM missing"))
+            connection.execute(text("SELECT 1"))
+            starts = [value for key, value in connection.info.items() if key[0] == 'pitime_query_start']
+        self.assertEqual(starts, [{}])
+        self.assertEqual(self.registry.metrics['pitime_db_query_seconds'].count(statement='SELECT'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os, shutil, struct
+import tempfile
+import unittest
+from sqlalchemy import create_engine, text
+from migrations import MIGRATIONS, run_migrations, schema_version, add_column, backfill_event_images
+
+LEGACY_SCHEMA = [ # Tables as created by db.create_all() before any indexes were declared
+    "CREATE TABLE event (id INTEGER NOT NULL, title VARCHAR(120) NOT NULL, description VARCHAR(500), event_lock BOOLEAN, PRIMARY KEY (id))",
+    "CREATE TABLE reminder (id INTEGER NOT NULL, date_time DATETIME NOT NULL, buzzer VARCHAR(120), vibration BOOLEAN, web_unlock BOOLEAN, reminder_lock BOOLEAN, "
+    "alarm VARCHAR(120), repeater VARCHAR(50), event_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(event_id) REFERENCES event (id))",
+]
+
+class MigrationTests(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        with self.engine.begin() as connection:
+            for statement in LEGACY_SCHEMA:
+                connection.execute(text(statement))
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def index_names(self):
+        with self.engine.connect() as connection:
+            return {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+
+    def test_migrations_upgrade_legacy_database(self):
+        applied = run_migrations(self.engine)
+        self.assertEqual(applied, [version for version, _, _ in MIGRATIONS])
+        self.assertTrue({'ix_reminder_active_date_time', 'ix_reminder_event_id_date_time', 'ix_event_active_id'} <= self.index_names())
+        with self.engine.connect() as connection:
+            self.assertEqual(schema_version(connection), MIGRATIONS[-1][0])
+
+    def test_migrations_are_applied_once(self):
+        run_migrations(self.engine)
+        self.assertEqual(run_migrations(self.engine), [])
+
+    def test_pattern_column_added_once(self):
+        run_migrations(self.engine)
+        with self.engine.begin() as connection:
+            columns = [row[1] for row in connection.execute(text("PRAGMA table_info(reminder)"))]
+            connection.execute(text("PRAGMA user_version = 1"))
+        self.assertEqual(columns.count('pattern'), 1)
+        self.assertEqual(run_migrations(self.engine), [version for version, _, _ in MIGRATIONS if version > 1]) # Re-running against a table that already has the column is harmless
+
+    def test_reminder_span_is_backfilled_and_maintained(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO event (id, title, event_lock) VALUES (1, 'Dentist', 0)"))
+            connection.execute(text("INSERT INTO reminder (id, date_time, event_id) VALUES (1, '2030-01-02 08:00:00.000000', 1), (2, '2030-01-05 08:00:00.000000', 1)"))
+        run_migrations(self.engine)
+        span = "SELECT first_reminder, last_reminder FROM event WHERE id = 1"
+        with self.engine.begin() as connection:
+            self.assertEqual(tuple(connection.execute(text(span)).one()), ('2030-01-02 08:00:00.000000', '2030-01-05 08:00:00.000000'))
+            connection.execute(text("UPDATE reminder SET date_time = '2030-01-09 08:00:00.000000' WHERE id = 1")) # i.e. rpi_main advancing a repeating reminder
+            self.assertEqual(tuple(connection.execute(text(span)).one()), ('2030-01-05 08:00:00.000000', '2030-01-09 08:00:00.000000'))
+            connection.execute(text("DELETE FROM reminder"))
+            self.assertEqual(tuple(connection.execute(text(span)).one()), (None, None))
+
+    def test_event_images_are_backfilled(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(folder, '2.gif'), 'wb') as file:
+                file.write(b'GIF89a' + struct.pack('<HH', 32, 16))
+            with self.engine.begin() as connection:
+                connection.execute(text("INSERT INTO event (id, title, event_lock) VALUES (1, 'No picture', 0), (2, 'Picture', 0)"))
+                for column, definition in (('image_path', 'VARCHAR(255)'), ('image_width', 'INTEGER'), ('image_height', 'INTEGER'), ('image_sha256', 'VARCHAR(64)')):
+                    add_column('event', column, definition)(connection)
+                backfill_event_images(folder)(connection)
+                rows = connection.execute(text("SELECT id, image_path, image_width, image_height FROM event ORDER BY id")).all()
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual([tuple(row) for row in rows], [(1, None, None, None), (2, '2.gif', 32, 16)])
+
+    def test_due_reminder_query_uses_partial_index(self):
+        run_migrations(self.engine)
+        with self.engine.connect() as connection:
+            plan = connection.execute(text("EXPLAIN QUERY PLAN SELECT id FROM reminder WHERE reminder.reminder_lock = 0 AND reminder.date_time <= '2030-01-01'")).all()
+        self.assertIn('ix_reminder_active_date_time', ' '.join(str(row[-1]) for row in plan))
+
+if __name__ == '__main__':
+    unittest.main()
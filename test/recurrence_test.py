@@ -0,0 +1,55 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+import recurrence
+from recurrence import catch_up_batch, next_occurrence
+
+class RecurrenceTests(unittest.TestCase):
+    def test_hourly_reminder_jumps_past_week_of_downtime(self):
+        original = datetime(2024, 3, 1, 8, 0)
+        now = original + timedelta(days=7, minutes=30)
+        next_datetime, skipped = next_occurrence(original, "Hourly", now)
+        self.assertEqual(next_datetime, datetime(2024, 3, 8, 9, 0))
+        self.assertEqual(skipped, 168)
+
+    def test_on_time_reminder_advances_one_interval(self):
+        original = datetime(2024, 3, 1, 8, 0)
+        self.assertEqual(next_occurrence(original, "Daily", original), (datetime(2024, 3, 2, 8, 0), 0))
+        self.assertEqual(next_occurrence(original, "Monthly", original), (datetime(2024, 4, 1, 8, 0), 0))
+
+    def test_monthly_reminder_keeps_end_of_month_anchor(self):
+        original = datetime(2024, 1, 31, 9, 0)
+        self.assertEqual(next_occurrence(original, "Monthly", datetime(2024, 2, 10)), (datetime(2024, 2, 29, 9, 0), 0))
+        self.assertEqual(next_occurrence(original, "Monthly", datetime(2024, 3, 31, 9, 0)), (datetime(2024, 4, 30, 9, 0), 2))
+
+    def test_yearly_reminder_on_leap_day(self):
+        original = datetime(2020, 2, 29, 7, 0)
+        self.assertEqual(next_occurrence(original, "Yearly", datetime(2023, 6, 1)), (datetime(2024, 2, 29, 7, 0), 3))
+
+    def test_never_and_illegal_repeaters(self):
+        original = datetime(2024, 3, 1, 8, 0)
+        self.assertEqual(next_occurrence(original, "Never", datetime(2025, 1, 1)), (original, 0))
+        with self.assertRaises(ValueError):
+            next_occurrence(original, "Fortnightly", datetime(2025, 1, 1))
+
+    def test_batch_matches_scalar(self):
+        generator = random.Random(1234)
+        now = datetime(2024, 7, 15, 12, 30)
+        repeaters = ["Never", "Hourly", "Daily", "Weekly", "Monthly", "Yearly", "Fortnightly"]
+        date_times = [now - timedelta(minutes=generator.randint(0, 60 * 24 * 800)) for _ in range(2000)]
+        chosen = [generator.choice(repeaters) for _ in date_times]
+        expected_dates, expected_skips = [], []
+        for date_time, repeater in zip(date_times, chosen):
+            try:
+                next_datetime, skipped = next_occurrence(date_time, repeater, now)
+            except ValueError:
+                next_datetime, skipped = None, 0
+            expected_dates.append(next_datetime)
+            expected_skips.append(skipped)
+        self.assertEqual(catch_up_batch(date_times, chosen, now), (expected_dates, expected_skips))
+        with patch.object(recurrence, 'np', None): # Pure Python fallback
+            self.assertEqual(catch_up_batch(date_times, chosen, now), (expected_dates, expected_skips))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,18 @@
+import asyncio
 import unittest
-from unittest.mock import patch
-from rpi_main import *
+from collections import namedtuple
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from dateutil.relativedelta import relativedelta
+from backends import set_backend, SimulatedBackend
+
+set_backend(SimulatedBackend()) # Before rpi_main is imported, so no hardware is touched
+import rpi_main
+from rpi_main import (state, initialize_globals, fetch_active_reminders, reminder_looper, update_reminder, speak, reset,
+                      set_web_unlock, process_event_reminders, snooze_button_press, Reminder, AlarmRuntime, RETRY_MAX_SECONDS)
+from alarm_state import URGENCY_COMPARATOR
+
+DueRow = namedtuple('DueRow', ['id', 'date_time', 'repeater', 'buzzer', 'vibration', 'web_unlock', 'alarm', 'pattern', 'event_id', 'event_title', 'event_description'])
 
 class TestRPIFunctions(unittest.TestCase):
     def setUp(self):
@@ -9,16 +21,17 @@ class TestRPIFunctions(unittest.TestCase):
 
     def test_initialize_globals(self):
         # Test if the global variables are initialized correctly
-        self.assertFalse(alarm_trigger)
-        self.assertEqual(options_dict, {'buzzer': False, 'vibration': False, 'web_unlock': False, 'alarm': {'None'}})
-        self.assertEqual(current_events_dict, {})
-        self.assertEqual(current_urgency, 'None')
+        current = state.snapshot()
+        self.assertFalse(current.trigger)
+        self.assertEqual(current.options, {'buzzer': False, 'vibration': False, 'web_unlock': False, 'alarm': {'None'}, 'pattern': None})
+        self.assertEqual(current.events, {})
+        self.assertEqual(current.urgency, 'None')
 
-    @patch('RPI_main.Reminder.query')
-    def test_fetch_active_reminders(self, mock_query):
+    def test_fetch_active_reminders(self):
         # Mock the database query and test fetch_active_reminders function
-        mock_query.join.filter.filter.return_value.all.return_value = []
-        reminders = fetch_active_reminders()
+        with rpi_main.app.app_context(), patch('rpi_main.Reminder.query') as mock_query:
+            mock_query.join.return_value.filter.return_value.filter.return_value.all.return_value = []
+            reminders = fetch_active_reminders()
         self.assertEqual(reminders, [])
 
     def test_reminder_looper(self):
@@ -27,40 +40,141 @@ class TestRPIFunctions(unittest.TestCase):
         self.assertEqual(reminder_looper(original_datetime, "Never"), original_datetime)
         self.assertEqual(reminder_looper(original_datetime, "Daily"), original_datetime + relativedelta(days=1))
         self.assertEqual(reminder_looper(original_datetime, "Monthly"), original_datetime + relativedelta(months=1))
-        # Add more assertions for other repeater values
+        with self.assertRaises(ValueError):
+            reminder_looper(original_datetime, "Fortnightly")
 
-    @patch('RPI_main.db.session.commit')
-    def test_update_reminder(self, mock_commit):
+    @patch('rpi_main.db.session')
+    def test_update_reminder(self, mock_session):
         # Test update_reminder function with a mock reminder
-        reminder = Reminder(date_time=datetime.now(), repeater='Never', reminder_lock=False)
+        reminder = Reminder(date_time=datetime(2030, 1, 1), repeater='Never', reminder_lock=False)
         update_reminder(reminder)
         self.assertTrue(reminder.reminder_lock)
-        mock_commit.assert_called_once()
+        mock_session.commit.assert_called_once()
 
-    @patch('RPI_main.speak')
-    def test_speak(self, mock_speak):
-        # Test if speak function is calling with correct parameter
-        speech = "Test speech"
-        speak(speech)
-        mock_speak.assert_called_with(speech)
+    def test_speak(self):
+        # Test if speak hands the speech to the engine and waits for it
+        engine = MagicMock()
+        speak("Test speech", engine)
+        engine.say.assert_called_once_with("Test speech")
+        engine.runAndWait.assert_called_once()
 
     def test_reset(self):
         # Test if reset function correctly resets global variables
-        reset()
-        self.assertFalse(alarm_trigger)
-        self.assertEqual(options_dict, {'buzzer': False, 'vibration': False, 'web_unlock': False, 'alarm': {'None'}})
-        self.assertEqual(current_events_dict, {})
-        self.assertEqual(current_urgency, 'None')
-
-    @patch('RPI_main.write_to_file')
-    def test_set_web_unlock(self, mock_write_to_file):
+        with patch('rpi_main.write_to_file'), patch('rpi_main.unlock_channel'):
+            reset()
+        current = state.snapshot()
+        self.assertFalse(current.trigger)
+        self.assertEqual(current.options, {'buzzer': False, 'vibration': False, 'web_unlock': False, 'alarm': {'None'}, 'pattern': None})
+        self.assertEqual(current.events, {})
+        self.assertEqual(current.urgency, 'None')
+
+    @patch('rpi_main.unlock_channel')
+    @patch('rpi_main.write_to_file')
+    def test_set_web_unlock(self, mock_write_to_file, mock_channel):
         # Test set_web_unlock function with different flags
-        set_web_unlock(True)
+        key = set_web_unlock(True)
         mock_write_to_file.assert_any_call('alarm.txt', '1')
+        mock_channel.send.assert_called_with('key', key)
+        self.assertTrue(state.snapshot().web_unlock_key_set)
         set_web_unlock(False)
-        mock_write_to_file.assert_called_with('alarm.txt', '')
+        mock_write_to_file.assert_called_with('unlock.txt', '')
+        self.assertFalse(state.snapshot().web_unlock_key_set)
+
+    @patch('rpi_main.advance_reminders')
+    @patch('rpi_main.fetch_due_reminder_rows')
+    def test_process_event_reminders_triggers_alarm(self, mock_fetch, mock_advance):
+        # Due reminders are merged into the alarm state in one step and the batch is advanced once
+        due = datetime(2030, 1, 1, 8, 0)
+        mock_fetch.return_value = [DueRow(1, due, 'Never', 'Loud', False, False, 'Somewhat', None, 10, 'Dentist', 'Forms'),
+                                   DueRow(2, due, 'Daily', None, True, True, 'Urgent', '200,200', 11, 'Pills', '')]
+        mock_advance.return_value = ([], [], 0)
+        with patch('rpi_main.notify_state_changed') as notify:
+            self.assertTrue(process_event_reminders(URGENCY_COMPARATOR))
+        mock_advance.assert_called_once_with(mock_fetch.return_value)
+        notify.assert_called()
+        current = state.snapshot()
+        self.assertTrue(current.trigger)
+        self.assertEqual(current.urgency, 'Urgent')
+        self.assertEqual(current.events, {10: ('Dentist', 'Forms'), 11: ('Pills', '')})
+        self.assertTrue(current.options['vibration'] and current.options['web_unlock'])
+        self.assertEqual(current.options['pattern'], '200,200')
+
+    @patch('rpi_main.fetch_due_reminder_rows')
+    def test_only_unwritten_reminders_are_retried(self, mock_fetch):
+        # A row locked for an illegal repeater is done with; only rows whose commit failed are still due, and they are counted once written
+        due = datetime(2030, 1, 1, 8, 0)
+        mock_fetch.return_value = [DueRow(1, due, 'Sometimes', None, False, False, 'Urgent', None, 10, 'Broken', ''),
+                                   DueRow(2, due, 'Daily', None, False, False, 'Urgent', None, 11, 'Pills', '')]
+        fired = rpi_main.reminders_fired.value()
+        with patch('rpi_main.notify_state_changed'):
+            with patch('rpi_main.advance_reminders', return_value=([1], [], 0)):
+                self.assertTrue(process_event_reminders(URGENCY_COMPARATOR))
+            self.assertEqual(rpi_main.reminders_fired.value(), fired + 2)
+            with patch('rpi_main.advance_reminders', return_value=([], [2], 0)):
+                self.assertFalse(process_event_reminders(URGENCY_COMPARATOR))
+        self.assertEqual(rpi_main.reminders_fired.value(), fired + 3) # Counted again only when its retry commits
+
+    @patch('rpi_main.advance_reminders', return_value=([], [1], 0))
+    @patch('rpi_main.fetch_due_reminder_rows', return_value=[DueRow(1, datetime(2030, 1, 1), 'Daily', None, False, False, 'Urgent', None, 10, 'Pills', '')])
+    def test_failed_advance_backs_off(self, mock_fetch, mock_advance):
+        # The rows stay due when their commit fails, so the lane must pause instead of querying in a tight loop
+        with patch('rpi_main.notify_state_changed'):
+            self.assertFalse(process_event_reminders(URGENCY_COMPARATOR))
+        delays = []
+        async def sleep(seconds):
+            delays.append(seconds)
+            if len(delays) == 8:
+                raise asyncio.CancelledError
+        async def lane():
+            runtime = AlarmRuntime(MagicMock(), MagicMock(), MagicMock())
+            runtime.loop = asyncio.get_running_loop()
+            try:
+                await runtime.scheduling_lane()
+            finally:
+                for executor in runtime.executors.values():
+                    executor.shutdown()
+        iterations = rpi_main.lane_iteration_time.count(lane='scheduling')
+        with patch('rpi_main.scheduler') as scheduler, patch('rpi_main.asyncio.sleep', sleep), patch('rpi_main.notify_state_changed'):
+            scheduler.wait.return_value = True
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(lane())
+        self.assertEqual(delays, [1, 2, 4, 8, 16, 32, RETRY_MAX_SECONDS, RETRY_MAX_SECONDS])
+        self.assertEqual(mock_fetch.call_count, 9) # Once above, then once per pause
+        self.assertEqual(rpi_main.lane_iteration_time.count(lane='scheduling'), iterations + 8) # The pauses aren't part of an iteration
 
+    def test_alarm_lane_survives_a_failed_unlock_key(self):
+        # set_web_unlock() returns None when .unlock can't be written; the lane retries instead of ending every lane
+        state.add_reminders([DueRow(1, datetime(2030, 1, 1), 'Never', None, False, True, 'Urgent', None, 10, 'Dentist', '')])
+        keys = iter([None, 'abcdefghijklmnopqrstuvwxyz012345'])
+        async def lane():
+            runtime = AlarmRuntime(MagicMock(), MagicMock(), MagicMock())
+            runtime.loop, runtime.display = asyncio.get_running_loop(), MagicMock()
+            runtime.state_changed, runtime.audio_queue, runtime.actuation_queue = asyncio.Event(), asyncio.Queue(), asyncio.Queue()
+            runtime.state_changed.set()
+            task = asyncio.ensure_future(runtime.alarm_lane())
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if runtime.display.show.called:
+                    break
+            self.assertFalse(task.done())
+            task.cancel()
+            for executor in runtime.executors.values():
+                executor.shutdown()
+            return runtime.display.show.call_args
+        with patch('rpi_main.set_web_unlock', side_effect=lambda flag: next(keys)), patch('rpi_main.RETRY_MIN_SECONDS', 0.01), \
+                patch('rpi_main.get_web_unlock', return_value=False):
+            shown = asyncio.run(lane())
+        self.assertEqual(shown.args[0][:2], ('abcdefghijklmnop', 'qrstuvwxyz012345'))
 
+    def test_snooze_button_clears_trigger(self):
+        state.add_reminders([DueRow(1, datetime(2030, 1, 1), 'Never', None, False, False, 'Urgent', None, 10, 'Dentist', '')])
+        runtime = MagicMock()
+        with patch('rpi_main.runtime', runtime):
+            snooze_button_press()
+        self.assertFalse(state.snapshot().trigger)
+        runtime.silence.assert_called_once()
+        snooze_button_press() # Already snoozed, nothing more to silence
+        runtime.silence.assert_called_once()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,8 @@
 import os
 import sys
+import threading
 import time
 import unittest
-from unittest.mock import patch, MagicMock
 
 # Add parent directory to working directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,45 +11,128 @@ sys.path.insert(0, parent_dir)
 
 from rpi_models import Buzzer, Vibration, Speaker
 
-# Testing with gpiozero implementation
+# Testing the devices against the simulated backend
 class TestAlarmSystem(unittest.TestCase):
+    def setUp(self):
+        from backends import SimulatedBackend
+        from rpi_models import PatternEngine
+        self.backend = SimulatedBackend()
+        self.engine = PatternEngine()
 
-    @patch('rpi_models.gpiozero.Buzzer')
-    def test_buzzer(self, MockBuzzer):
-        mock_buzzer = MockBuzzer.return_value
-        buzzer = Buzzer(pin=17)
+    def test_buzzer(self):
+        buzzer = Buzzer(pin=17, backend=self.backend, engine=self.engine)
         buzzer.start()
         self.assertTrue(buzzer.buzzing)
-        self.assertIsNotNone(buzzer.thread)
         buzzer.stop()
         self.assertFalse(buzzer.buzzing)
-        self.assertTrue(mock_buzzer.on.called)
-        self.assertTrue(mock_buzzer.off.called)
+        actions = [entry[2] for entry in self.backend.log.filter('gpio17')]
+        self.assertEqual((actions[0], actions[-1]), ('on', 'off'))
 
-    @patch('rpi_models.gpiozero.LED')
-    def test_vibration(self, MockLED):
-        mock_vibration = MockLED.return_value
-        vibration = Vibration(pin=18)
+    def test_vibration(self):
+        vibration = Vibration(pin=18, backend=self.backend, engine=self.engine)
         vibration.start()
         self.assertTrue(vibration.vibrating)
-        self.assertIsNotNone(vibration.thread)
         vibration.stop()
         self.assertFalse(vibration.vibrating)
-        self.assertTrue(mock_vibration.on.called)
-        self.assertTrue(mock_vibration.off.called)
-
-    @patch('rpi_models.pygame.mixer.Sound')
-    def test_speaker(self, MockSound):
-        mock_sound = MockSound.return_value
-        mock_sound.get_length.return_value = 5
-        speaker = Speaker()
-        speaker.start({'Urgent'})
-        self.assertTrue(speaker.playing)
-        self.assertIsNotNone(speaker.thread)
-        speaker.stop()
-        self.assertFalse(speaker.playing)
-        self.assertTrue(mock_sound.play.called)
-        self.assertTrue(mock_sound.stop.called)
+        actions = [entry[2] for entry in self.backend.log.filter('gpio18')]
+        self.assertEqual((actions[0], actions[-1]), ('on', 'off'))
+
+    def test_speaker(self):
+        speaker = Speaker(backend=self.backend)
+        try:
+            speaker.update_urgency('Urgent')
+            self.assertTrue(speaker.playing)
+            self.assertTrue(speaker.sync(1))
+            speaker.stop()
+            self.assertFalse(speaker.playing)
+            self.assertTrue(speaker.sync(1))
+        finally:
+            speaker.close()
+        actions = [entry[2] for entry in self.backend.log.filter('mixer')]
+        self.assertTrue({'play', 'sound_play'} & set(actions))
+        self.assertTrue({'stop', 'sound_stop'} & set(actions))
+
+# Testing the audio worker against the simulated backend
+class TestSpeakerWorker(unittest.TestCase):
+    def setUp(self):
+        from backends import SimulatedBackend
+        self.backend = SimulatedBackend()
+        self.commands = []
+        self.speaker = Speaker('None', backend=self.backend, on_command=lambda command, latency: self.commands.append((command, latency)))
+
+    def tearDown(self):
+        self.speaker.close()
+
+    def test_commands_apply_in_order_without_blocking(self):
+        self.speaker.update_urgency('Urgent')
+        self.speaker.update_urgency('Extremely')
+        self.speaker.duck(0.5)
+        self.speaker.update_urgency('None')
+        self.assertFalse(self.speaker.playing) # Caller side state is updated immediately
+        self.assertTrue(self.speaker.sync(1))
+        self.assertEqual([command for command, _ in self.commands], ['escalate', 'escalate', 'duck', 'escalate'])
+        self.assertTrue(all(latency >= 0 for _, latency in self.commands))
+        loads = [entry[3] for entry in self.backend.log.filter('mixer', 'load')]
+        self.assertIn(os.path.join('alarms', 'Urgent'), loads[0])
+        self.assertIn(os.path.join('alarms', 'Extremely'), loads[1])
+        self.assertFalse(self.speaker.mixer.music.get_busy())
+
+    def test_clip_reports_its_length(self):
+        clip = os.path.join(parent_dir, 'alarms', 'Urgent', os.listdir(os.path.join(parent_dir, 'alarms', 'Urgent'))[0])
+        self.assertGreater(self.speaker.play_clip(clip).result(1), 0)
+        self.assertEqual(self.backend.log.filter('mixer', 'sound_play')[0][3][0], clip)
+
+
+# Testing the pattern engine against the simulated backend
+class TestPatternEngine(unittest.TestCase):
+    def setUp(self):
+        from backends import SimulatedBackend
+        from rpi_models import PatternEngine
+        self.backend = SimulatedBackend()
+        self.engine = PatternEngine()
+
+    def test_parse_pattern(self):
+        from rpi_models import parse_pattern, PATTERNS
+        self.assertEqual(parse_pattern("200, 100"), (0.2, 0.1))
+        self.assertEqual(parse_pattern('Loud'), PATTERNS['Loud'])
+        for invalid in ("200", "200,-1", "fast", "", None, '1'):
+            self.assertIsNone(parse_pattern(invalid))
+
+    def test_stop_takes_effect_immediately(self):
+        buzzer = Buzzer(backend=self.backend, engine=self.engine)
+        buzzer.start("10000,10000") # A sleep-based loop would hold stop() for 20 seconds
+        self.assertTrue(buzzer.buzzer.is_active)
+        started = time.perf_counter()
+        buzzer.stop()
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertFalse(buzzer.buzzer.is_active)
+        self.assertFalse(buzzer.buzzing)
+
+    def test_patterns_play_on_several_pins_from_one_thread(self):
+        buzzer = Buzzer(backend=self.backend, engine=self.engine)
+        vibration = Vibration(backend=self.backend, engine=self.engine)
+        buzzer.start("20,20")
+        vibration.start("30,30")
+        time.sleep(0.2)
+        buzzer.stop()
+        vibration.stop()
+        self.assertGreaterEqual(self.backend.log.count('gpio17', 'on'), 3)
+        self.assertGreaterEqual(self.backend.log.count('gpio25', 'on'), 2)
+        self.assertEqual(len([thread for thread in threading.enumerate() if thread.name == 'pitime-gpio' and thread is self.engine.thread]), 1)
+
+    def test_late_wakeup_skipping_whole_cycles_reschedules(self):
+        buzzer = Buzzer(backend=self.backend, engine=self.engine)
+        buzzer.start("10000,10000")
+        with self.engine.condition:
+            channel = next(iter(self.engine.channels.values()))
+            channel[3] = time.monotonic() - 15 # One full 20 s cycle late, so the step index ends up unchanged
+            self.engine.condition.notify()
+        time.sleep(0.05)
+        with self.engine.condition:
+            self.assertEqual(channel[2], 0)
+            self.assertGreater(channel[3], time.monotonic()) # Otherwise the timer thread spins on wait(0)
+        buzzer.stop()
+        self.assertEqual(self.backend.log.count('gpio17', 'on'), 1)
 
 
 # The following are in-house tests of the general logic behavior of each 
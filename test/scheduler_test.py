@@ -0,0 +1,75 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, Event, Reminder
+from scheduler import ReminderScheduler
+
+class ReminderSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        # Isolated in-memory database so the scheduler can be exercised without rpi_main's hardware
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.event = Event(title='Test Event', description='Test Description')
+        db.session.add(self.event)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_reminder(self, date_time, locked=False):
+        reminder = Reminder(date_time=date_time, repeater='Never', reminder_lock=locked, event=self.event)
+        db.session.add(reminder)
+        db.session.commit()
+        return reminder
+
+    def test_next_due_is_earliest_unlocked(self):
+        now = datetime.now()
+        self.add_reminder(now + timedelta(hours=2))
+        self.add_reminder(now + timedelta(hours=1), locked=True)
+        expected = self.add_reminder(now + timedelta(hours=3))
+        self.add_reminder(now + timedelta(minutes=30), locked=True)
+        scheduler = ReminderScheduler()
+        scheduler.reload()
+        self.assertEqual(scheduler.next_due(), now + timedelta(hours=2))
+        self.assertEqual(len(scheduler.heap), 2)
+        self.assertIn((expected.date_time, expected.id), scheduler.heap)
+
+    def test_wait_returns_when_reminder_due(self):
+        self.add_reminder(datetime.now() + timedelta(milliseconds=200))
+        scheduler = ReminderScheduler()
+        start = time.monotonic()
+        self.assertTrue(scheduler.wait(timeout=5))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wait_times_out_when_nothing_due(self):
+        self.add_reminder(datetime.now() + timedelta(days=1))
+        scheduler = ReminderScheduler()
+        self.assertFalse(scheduler.wait(timeout=0.05))
+
+    def test_notify_wakes_waiter_early(self):
+        scheduler = ReminderScheduler()
+        scheduler.reload()
+        threading.Timer(0.1, scheduler.wake).start()
+        start = time.monotonic()
+        scheduler.wait(timeout=5)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_notify_marks_heap_stale(self):
+        scheduler = ReminderScheduler()
+        scheduler.reload()
+        self.assertIsNone(scheduler.next_due())
+        due = self.add_reminder(datetime.now() - timedelta(minutes=1))
+        scheduler.notify()
+        self.assertTrue(scheduler.wait(timeout=0))
+        self.assertEqual(scheduler.next_due(), due.date_time)
+
+if __name__ == '__main__':
+    unittest.main()
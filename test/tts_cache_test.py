@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from backends import SimulatedBackend
+from tts_cache import TTSCache, cache_key, event_phrases
+
+class TTSCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.backend = SimulatedBackend()
+        self.cache = TTSCache(self.directory, max_bytes=1024, voice='test')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_keys_depend_on_text_and_voice(self):
+        self.assertNotEqual(cache_key("Dentist", 'a'), cache_key("Dentist", 'b'))
+        self.assertEqual(self.cache.path_for("Dentist"), os.path.join(self.directory, cache_key("Dentist", 'test') + '.wav'))
+
+    def test_render_once_then_hit(self):
+        engine = self.backend.tts_engine()
+        self.assertIsNone(self.cache.lookup("Dentist"))
+        path = self.cache.render("Dentist", engine)
+        self.assertEqual(self.cache.lookup("Dentist"), path)
+        self.cache.render("Dentist", engine)
+        self.assertEqual(self.backend.log.count('tts', 'save'), 1)
+
+    def test_render_missing_creates_engine_only_when_needed(self):
+        created = []
+        def factory():
+            created.append(1)
+            return self.backend.tts_engine()
+        self.assertEqual(self.cache.render_missing(event_phrases(1, "Dentist", "Teeth"), factory), 3)
+        self.assertEqual(self.cache.render_missing(event_phrases(1, "Dentist", "Teeth"), factory), 0)
+        self.assertEqual(len(created), 1)
+
+    def test_least_recently_used_clips_are_evicted(self):
+        engine = self.backend.tts_engine()
+        oldest = self.cache.render("a" * 400, engine)
+        recent = self.cache.render("b" * 400, engine)
+        past = time.time() - 60
+        os.utime(oldest, (past, past))
+        os.utime(recent, (past + 1, past + 1))
+        self.cache.lookup("a" * 400) # Touching the oldest clip makes the other one the eviction candidate
+        self.cache.render("c" * 400, engine)
+        self.assertIsNotNone(self.cache.lookup("a" * 400))
+        self.assertIsNone(self.cache.lookup("b" * 400))
+
+    def test_prerender_runs_in_background(self):
+        self.cache.prerender(["Event number 2"], self.backend.tts_engine)
+        self.cache.queue.join()
+        path = self.cache.lookup("Event number 2")
+        self.assertTrue(os.path.isfile(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+'''
+Content-addressed cache of synthesized announcement audio
+    Each phrase is rendered to <sha256(voice, text)>.wav once, ahead of time, so announcing events at alarm dismissal plays a file instead of waiting on espeak
+    app.py renders the phrases of every submitted event in the background, rpi_main renders the phrases of triggered events while the alarm is still sounding
+    The directory is bounded to CACHE_BYTES with least recently used eviction; file modification times double as the LRU order so both processes can share it
+'''
+import hashlib, os, queue, threading
+from log import get_logger
+
+logger = get_logger('tts_cache')
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tts_cache')
+CACHE_BYTES = int(os.environ.get('PITIME_TTS_CACHE_BYTES', 32 * 1024 * 1024))
+VOICE = os.environ.get('PITIME_TTS_VOICE', '') # pyttsx3 voice id, '' keeps the engine's default voice
+
+def event_phrases(event_id, title, description):
+    '''
+    Returns the phrases (list) read out for one event, in the order AlarmRuntime.announce() speaks them
+    '''
+    return [f"Event number {event_id}", str(title), str(description)]
+
+def count_phrase(count):
+    return f'You have {count} events currently'
+
+def cache_key(text, voice=VOICE):
+    return hashlib.sha256(f"{voice}\0{text}".encode('utf-8')).hexdigest()
+
+def configure_engine(engine, voice=VOICE):
+    '''
+    Applies the cache's voice to a text to speech engine, so live speech and cached clips sound the same
+    '''
+    if voice:
+        engine.setProperty('voice', voice)
+    return engine
+
+class TTSCache:
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_BYTES, voice=VOICE):
+        '''
+        Initializes the TTSCache object
+        Args:
+            directory (str), folder holding the rendered clips, created by the first render
+            max_bytes (int), total size the folder is trimmed to after each render
+            voice (str), voice id the clips are rendered with, part of every key
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.voice = voice
+        self.queue = None # Phrases waiting for the background worker, see prerender()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def path_for(self, text):
+        return os.path.join(self.directory, f"{cache_key(text, self.voice)}.wav")
+
+    def lookup(self, text):
+        '''
+        Returns the path (str) of the rendered clip for text and marks it as recently used, or None if it hasn't been rendered
+        '''
+        path = self.path_for(text)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            logger.debug("Cache miss for %r", text)
+            return None
+        return path
+
+    def render(self, text, engine):
+        '''
+        Synthesizes text to its cache file unless it is already there, then trims the cache
+            Blocks for the duration of the synthesis, so call it from a worker thread; engine must only be used from that thread
+        Returns:
+            path (str) of the rendered clip
+        '''
+        path = self.lookup(text)
+        if path:
+            return path
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(text)
+        partial = f"{path}.part" # Renamed into place once complete so readers never see half a file
+        engine.save_to_file(text, partial)
+        engine.runAndWait()
+        os.replace(partial, path)
+        logger.debug("Rendered %r to %s", text, path)
+        self.evict()
+        return path
+
+    def render_missing(self, texts, engine_factory):
+        '''
+        Renders every text that isn't cached yet, creating the engine only if something is missing
+        Returns:
+            rendered (int), number of clips synthesized
+        '''
+        missing = [text for text in dict.fromkeys(texts) if self.lookup(text) is None]
+        if missing:
+            engine = engine_factory()
+            for text in missing:
+                try:
+                    self.render(text, engine)
+                except Exception as ex:
+                    logger.error("Error rendering %r: %s", text, ex)
+        return len(missing)
+
+    def evict(self):
+        '''
+        Deletes the least recently used clips until the cache fits in max_bytes
+        '''
+        with self.lock:
+            entries, total = [], 0
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.wav'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.debug("Evicted %s", path)
+                except FileNotFoundError: # Already evicted by the other process
+                    total -= size
+
+    def prerender(self, texts, engine_factory):
+        '''
+        Queues texts for rendering on a background thread that owns its own engine, returning immediately
+            For processes that don't have a dedicated text to speech thread (app.py)
+        '''
+        with self.lock:
+            if self.worker is None:
+                self.queue = queue.Queue()
+                self.worker = threading.Thread(target=self.work, args=(engine_factory,), name='pitime-tts-cache', daemon=True)
+                self.worker.start()
+        self.queue.put(list(texts))
+
+    def work(self, engine_factory):
+        engine = None
+        def get_engine():
+            nonlocal engine
+            if engine is None:
+                engine = configure_engine(engine_factory(), self.voice)
+            return engine
+        while True:
+            texts = self.queue.get()
+            try:
+                self.render_missing(texts, get_engine)
+            except Exception as ex:
+                logger.error("Error in TTSCache worker: %s", ex)
+            finally:
+                self.queue.task_done()